@@ -0,0 +1,47 @@
+"""قياس زمن بناء أزرار القائمة الرئيسية قبل وبعد الذاكرة المؤقتة
+
+التشغيل: python benchmarks/bench_menu.py
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_bot():
+    """تحميل ملف البوت كموديول بدون تشغيله"""
+    os.environ.setdefault("BOT_TOKEN", "0:BENCH")
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="asser-bench-"))
+    spec = importlib.util.spec_from_file_location("asser_bot", ROOT / "main (5).py")
+    bot = importlib.util.module_from_spec(spec)
+    sys.modules["asser_bot"] = bot
+    spec.loader.exec_module(bot)
+    return bot
+
+
+def main():
+    bot = load_bot()
+    variants = [(premium, admin) for premium in (False, True) for admin in (False, True)]
+    number = 20000
+
+    def uncached():
+        for premium, admin in variants:
+            bot.InlineKeyboardMarkup(bot.main_menu_keyboard(premium, admin))
+
+    def cached():
+        for premium, admin in variants:
+            bot.cached_markup(("main_menu", premium, admin),
+                              lambda: bot.main_menu_keyboard(premium, admin))
+
+    for name, func in (("uncached", uncached), ("cached", cached)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        per_call = best / (number * len(variants)) * 1e6
+        print(f"{name:>9}: {per_call:8.3f} µs / menu")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""قياس أداء التخزين والأرباح والبحث والعرض على بيانات صناعية بأحجام مختلفة
+
+يقيس: load_data/save_data لملف المستخدمين، process_automatic_payouts (مستحقة وغير مستحقة)،
+check_duplicate_data، البحث في لوحة الأدمن (search_users)، تجميع الإحصائيات (platform_stats)
+وبناء أزرار القائمة الرئيسية. النتائج تُحفظ بصيغة JSON للمقارنة بين الإصدارات.
+
+التشغيل:
+    python benchmarks/bench_suite.py --sizes 1000,100000 --output bench-results.json
+    python benchmarks/bench_suite.py --sizes 1000000 --repeat 1   # مليون مستخدم (~ عدة GB رام)
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_menu import ROOT, load_bot
+from synthetic import make_pending, make_users
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(fn, repeat, setup=None, number=1):
+    """زمن كل تشغيل بالثواني (متوسط number استدعاء)، وsetup لا يدخل في القياس"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - started) / number)
+    return times
+
+
+def summary(name, size, times, **extra):
+    return {
+        "name": name,
+        "size": size,
+        "runs": len(times),
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        **extra
+    }
+
+
+def bench_size(bot, size, repeat, seed):
+    """كل القياسات لحجم واحد من المستخدمين"""
+    results = []
+    due_users = make_users(size, seed=seed, due_ratio=1.0)
+    idle_users = make_users(size, seed=seed, due_ratio=0.0)
+    deposits, withdrawals = make_pending(due_users, seed=seed)
+    plans = sum(len(user["plans"]) for user in due_users.values())
+
+    # التخزين
+    bot.save_data(bot.USERS_FILE, due_users)
+    file_size = bot.USERS_FILE.stat().st_size
+    results.append(summary("load_data.users", size, measure(lambda: bot.load_data(bot.USERS_FILE, {}), repeat),
+                           file_bytes=file_size))
+    results.append(summary("save_data.users", size, measure(lambda: bot.save_data(bot.USERS_FILE, due_users), repeat),
+                           file_bytes=file_size))
+
+    # الأرباح: كل شهادة مستحقة (أسوأ حالة) ثم لا شيء مستحق (الحالة المعتادة كل ساعة)
+    def payouts_setup(users):
+        def setup():
+            bot.save_data(bot.USERS_FILE, users)
+            bot.SEGMENTS.rebuild(users)
+        return setup
+
+    run_payouts = lambda: asyncio.run(bot.process_automatic_payouts())
+    results.append(summary("process_automatic_payouts.due", size,
+                           measure(run_payouts, repeat, setup=payouts_setup(due_users)), plans=plans))
+    results.append(summary("process_automatic_payouts.idle", size,
+                           measure(run_payouts, repeat, setup=payouts_setup(idle_users)), plans=plans))
+
+    # التحقق من التكرار: بريد جديد يمر على كل المستخدمين
+    bot.save_data(bot.USERS_FILE, due_users)
+    results.append(summary("check_duplicate_data.miss", size,
+                           measure(lambda: bot.check_duplicate_data("new.user@example.com", "+201999999999"), repeat)))
+
+    # البحث والإحصائيات على البيانات المحملة في الذاكرة
+    last_uid, last_user = next(reversed(due_users.items()))
+    for label, term in (("uid", last_uid), ("email", last_user["email"].upper()), ("miss", "nobody@example.com")):
+        results.append(summary(f"search_users.{label}", size,
+                               measure(lambda: bot.search_users(due_users, term), repeat)))
+    results.append(summary("platform_stats", size,
+                           measure(lambda: bot.platform_stats(due_users, deposits, withdrawals), repeat),
+                           deposits=len(deposits), withdrawals=len(withdrawals)))
+    return results
+
+
+def bench_menu(bot, repeat):
+    """بناء أزرار القائمة الرئيسية مع وبدون الذاكرة المؤقتة (لا يعتمد على عدد المستخدمين)"""
+    variants = [(premium, admin) for premium in (False, True) for admin in (False, True)]
+    number = 2000
+
+    def uncached():
+        for premium, admin in variants:
+            bot.InlineKeyboardMarkup(bot.main_menu_keyboard(premium, admin))
+
+    def cached():
+        for premium, admin in variants:
+            bot.cached_markup(("main_menu", premium, admin), lambda: bot.main_menu_keyboard(premium, admin))
+
+    return [
+        summary("main_menu.uncached", None, measure(uncached, repeat, number=number), variants=len(variants)),
+        summary("main_menu.cached", None, measure(cached, repeat, number=number), variants=len(variants))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000", help="أعداد المستخدمين مفصولة بفاصلة")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=Path("bench-results.json"))
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    output = args.output.resolve()
+
+    # البوت يكتب bot.log في المجلد الحالي، فيتم التشغيل داخل مجلد مؤقت
+    workdir = tempfile.mkdtemp(prefix="asser-bench-")
+    os.environ["DATA_DIR"] = str(Path(workdir) / "data")
+    os.chdir(workdir)
+    bot = load_bot()
+
+    results = bench_menu(bot, args.repeat)
+    for size in sizes:
+        print(f"▶ {size} users", file=sys.stderr)
+        results.extend(bench_size(bot, size, args.repeat, args.seed))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    for row in results:
+        size = row["size"] if row["size"] is not None else "-"
+        print(f"{row['name']:<34} {size:>9}  median {row['median_s'] * 1000:>11.3f} ms")
+    print(f"saved: {output}")
+
+
+if __name__ == "__main__":
+    main()
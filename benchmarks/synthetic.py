@@ -0,0 +1,112 @@
+"""مولد بيانات صناعية بنفس شكل ملفات البوت (users.json والطلبات المعلقة)
+
+البيانات ثابتة لنفس البذرة (seed) حتى تكون النتائج قابلة للمقارنة بين الإصدارات.
+"""
+import random
+import secrets
+import time
+
+DAY = 24 * 60 * 60
+
+FIRST_NAMES = ["Ahmed", "Mohamed", "Mahmoud", "Omar", "Youssef", "Mostafa", "Ali", "Hassan",
+               "Sara", "Mona", "Nour", "Aya", "Fatma", "Salma", "Mariam", "Heba"]
+LAST_NAMES = ["Gamal", "Hassan", "Ibrahim", "Mostafa", "Adel", "Samir", "Fathy", "Saeed"]
+EMAIL_DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "hotmail.com"]
+
+# (نوع الخطة، النسبة) — أغلب المستثمرين في الخطة اليومية
+PLAN_TYPES = [("daily", 0.6), ("weekly", 0.3), ("monthly", 0.1)]
+PLAN_INTERVALS = {"daily": DAY, "weekly": 7 * DAY, "monthly": 30 * DAY}
+
+
+def make_plan(rng, now, due):
+    """شهادة بتاريخ اشتراك عشوائي خلال مدتها (40 يوم)، مستحقة الدفع أو لا حسب due"""
+    plan_type = rng.choices([name for name, _ in PLAN_TYPES], [weight for _, weight in PLAN_TYPES])[0]
+    interval = PLAN_INTERVALS[plan_type]
+    join_date = int(now - rng.uniform(0, 40) * DAY)
+    if due:
+        last_payout = int(now - interval - rng.uniform(0, interval))
+    else:
+        last_payout = int(now - rng.uniform(0, interval * 0.9))
+    return {
+        "type": plan_type,
+        "amount": float(rng.choice([500, 1000, 2000, 5000, 10000])),
+        "join_date": min(join_date, last_payout),
+        "duration": 40,
+        "last_payout": last_payout
+    }
+
+
+def make_user(rng, index, now, due_ratio):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    plans = [make_plan(rng, now, rng.random() < due_ratio) for _ in range(rng.choices([0, 1, 2, 3], [50, 30, 15, 5])[0])]
+    banned = rng.random() < 0.01
+    accepted = rng.random() < 0.8
+    return {
+        "name": f"{first} {last}",
+        "email": f"{first.lower()}.{last.lower()}{index}@{rng.choice(EMAIL_DOMAINS)}",
+        "phone": f"+2010{index:08d}",
+        "password": secrets.token_hex(4),
+        "balance": {
+            "EGP": round(rng.expovariate(1 / 1500), 2),
+            "USDT": round(rng.expovariate(1 / 30), 2) if rng.random() < 0.3 else 0.0
+        },
+        "plans": plans,
+        "accepted_terms": accepted,
+        "acceptance_time": int(now - rng.uniform(0, 300) * DAY) if accepted else None,
+        "team_count": rng.choices([0, 1, 3, 10], [80, 12, 6, 2])[0],
+        "invite_code": f"inv{index:010d}",
+        "inviter_id": None,
+        "banned": banned,
+        "ban_reason": "spam" if banned else "",
+        "ban_time": int(now - DAY) if banned else None,
+        "premium": rng.random() < 0.05,
+        "registration_date": int(now - rng.uniform(0, 365) * DAY)
+    }
+
+
+def make_users(count, seed=42, due_ratio=0.5, now=None):
+    """count مستخدم بمعرفات تبدأ من 1000000000، وdue_ratio نسبة الشهادات المستحقة الدفع"""
+    rng = random.Random(seed)
+    now = now or time.time()
+    return {str(1000000000 + index): make_user(rng, index, now, due_ratio) for index in range(count)}
+
+
+def make_pending(users, ratio=0.01, seed=42, now=None):
+    """طلبات إيداع وسحب معلقة لنسبة ratio من المستخدمين، وإرجاع (deposits, withdrawals)"""
+    rng = random.Random(seed + 1)
+    now = now or time.time()
+    deposits, withdrawals = [], []
+    for uid, user in users.items():
+        if rng.random() >= ratio:
+            continue
+        currency = rng.choice(["EGP", "EGP", "USDT"])
+        if rng.random() < 0.6:
+            deposits.append({
+                "id": f"bench-d{len(deposits)}",
+                "uid": uid,
+                "currency": currency,
+                "amount": float(rng.choice([200, 500, 1000, 3000])),
+                "time": int(now - rng.uniform(0, 3) * DAY),
+                "user_name": user["name"],
+                "user_phone": user["phone"],
+                "status": "pending",
+                "screenshot_path": None,
+                "screenshot_sha256": None,
+                "screenshot_file_id": f"AgAC{uid}",
+                "type": "normal"
+            })
+        else:
+            amount = float(rng.choice([100, 300, 800]))
+            fee = round(amount * 0.02, 2)
+            withdrawals.append({
+                "id": f"bench-w{len(withdrawals)}",
+                "uid": uid,
+                "currency": currency,
+                "amount": amount - fee,
+                "fee": fee,
+                "time": int(now - rng.uniform(0, 3) * DAY),
+                "user_name": user["name"],
+                "user_phone": user["phone"],
+                "status": "pending"
+            })
+    return deposits, withdrawals
@@ -1,45 +1,380 @@
 
 import os
 import json
+import bisect
+import hashlib
+import html
+import io
+import math
 import time
 import secrets
 import asyncio
+import atexit
+import gc
+import gzip
 import logging
+import logging.handlers
+import queue
+import random
 import re
+import sys
+import threading
+import traceback
+import tracemalloc
+import types
+import zipfile
+import httpx
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup
+    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, ContextTypes, filters
+    BaseUpdateProcessor, ConversationHandler, ContextTypes, ExtBot, TypeHandler, filters
 )
 
+try:
+    import resource
+except ImportError:  # غير متاح على ويندوز
+    resource = None
+
+try:
+    from PIL import Image
+except ImportError:  # كشف الصور المكررة يتطلب Pillow
+    Image = None
+
 # ─── إعداد الملفات واللوجينج ────────────────────────────────────────────
-DATA_DIR = Path(__file__).parent / "data"
+DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).parent / "data"))
 USERS_FILE = DATA_DIR / "users.json"
 PEND_WDR = DATA_DIR / "pending_withdrawals.json"
 PEND_DEP = DATA_DIR / "pending_deposits.json"
+SETTLED_DEP = DATA_DIR / "settled_deposits.json"
 ADMIN_LOG = DATA_DIR / "admin_log.json"
 WORK_WITHDRAWALS = DATA_DIR / "work_withdrawals.json"
 CERTIFICATES_FILE = DATA_DIR / "certificates.json"
 BAN_LOG = DATA_DIR / "ban_log.json"
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# إعداد اللوجينج
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filename='bot.log'
-)
+# إعداد اللوجينج: الحلقة تضع السجل في طابور فقط، وخيط منفصل ينسقه JSON ويكتبه ويدور الملفات
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# مستوى لكل لوجر: "payouts=WARNING,httpx=WARNING" (httpx يسجل كل طلب لتيليجرام على INFO)
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")
+LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", "50")) * 1024 * 1024)  # 0 = بدون حد للحجم
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))  # 0 = حسب الحجم فقط
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "14"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_MS", "200")) / 1000
+# نسبة سجلات تفاصيل الأرباح (لكل شهادة) التي تُكتب: 1 = الكل، 0 = لا شيء
+PAYOUT_LOG_SAMPLE = float(os.getenv("PAYOUT_LOG_SAMPLE", "1"))
+
+# خصائص LogRecord الأساسية، وما عداها يأتي من extra ويُكتب كحقول في JSON
+LOG_RECORD_FIELDS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """سطر JSON لكل سجل: الوقت، المستوى، اللوجر، الرسالة، وحقول extra"""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """تدوير عند تجاوز الحجم أو مرور LOG_ROTATE_HOURS، والملفات القديمة تُضغط gzip (bot.log.1.gz ...)"""
+
+    def __init__(self, filename, max_bytes, backups, rotate_seconds):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = time.time() + rotate_seconds
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self.compress
+
+    @staticmethod
+    def compress(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        # RotatingFileHandler ينسق السجل مرتين (للحجم ثم للكتابة)، هنا الحجم من موضع الملف (±8KB)
+        if self.stream is None:
+            self.stream = self._open()
+        if self.rotate_seconds and time.time() >= self.rollover_at:
+            return self.stream.buffer.tell() > 0
+        return 0 < self.maxBytes <= self.stream.buffer.tell()
+
+    def doRollover(self):
+        self.rollover_at = time.time() + self.rotate_seconds
+        super().doRollover()
+
+    def flush(self):
+        """لا flush لكل سجل، LogWriter يستدعي flush_batch مرة لكل دفعة"""
+
+    def flush_batch(self):
+        super().flush()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """وضع السجل في الطابور بدون تنسيق الرسالة: getMessage و JSON يتمان في خيط الكتابة
+
+    السجل يُرسل كما هو (msg + args) لأن معاملات اللوج نصوص وأرقام لا تتغير بعد الاستدعاء.
+    الطابور SimpleQueue محدود بـ LOG_QUEUE_SIZE: إذا امتلأ يُحذف السجل ويُعد بدلاً من
+    تعطيل الحلقة أو استهلاك الذاكرة.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # التتبع يُنسق الآن حتى لا تبقى الإطارات حية حتى الكتابة
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+class LogWriter:
+    """خيط الكتابة: يستيقظ كل LOG_FLUSH_INTERVAL ويفرغ الطابور دفعة واحدة
+
+    بدلاً من QueueListener الذي يستيقظ ويكتب على القرص لكل سجل، فكل استيقاظ على سيرفر
+    بمعالج واحد يعني تبديل GIL مع حلقة الأحداث.
+    """
+
+    def __init__(self, log_queue, handler, interval):
+        self.queue = log_queue
+        self.handler = handler
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record.levelno >= self.handler.level:
+                self.handler.handle(record)
+        self.handler.flush_batch()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.drain()
+        self.drain()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+class SampleFilter(logging.Filter):
+    """تمرير نسبة rate فقط من السجلات (1 = الكل، 0 = لا شيء)"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def configure_log_levels(spec):
+    """تطبيق "name=LEVEL,..." وإرجاع العناصر غير الصالحة"""
+    invalid = []
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if not name:
+            continue
+        try:
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+        except ValueError:
+            invalid.append(item.strip())
+    return invalid
+
+
+def setup_logging():
+    """ربط اللوجر الرئيسي بطابور وتشغيل خيط الكتابة، وإرجاع (handler, writer)"""
+    file_handler = CompressedRotatingFileHandler(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_ROTATE_HOURS * 3600)
+    file_handler.setFormatter(JsonFormatter())
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    # سطر JSON لا يحتوي الخيط أو العملية، فلا داعي لجمعها مع كل سجل
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    writer = LogWriter(queue_handler.queue, file_handler, LOG_FLUSH_INTERVAL)
+    writer.start()
+    return queue_handler, writer
+
+
+def stop_logging():
+    """كتابة ما تبقى في الطابور وإيقاف خيط الكتابة (مرة واحدة)"""
+    global LOG_WRITER
+    if LOG_WRITER:
+        LOG_WRITER.stop()
+        LOG_WRITER = None
+
+
+LOG_HANDLER, LOG_WRITER = setup_logging()
+atexit.register(stop_logging)
 logger = logging.getLogger(__name__)
+# تفاصيل كل دفعة أرباح: يمكن تقليلها بـ PAYOUT_LOG_SAMPLE أو إيقافها بـ LOG_LEVELS="payouts=WARNING"
+PAYOUT_LOGGER = logging.getLogger("payouts")
+PAYOUT_LOGGER.addFilter(SampleFilter(PAYOUT_LOG_SAMPLE))
+for item in configure_log_levels(LOG_LEVELS):
+    logger.warning(f"مستوى لوج غير صالح في LOG_LEVELS: {item}")
 
 # تعريف هوية الأدمن
 ADMIN_IDS = [7952226615]
 
+# ─── قياس زمن المعالجات واستدعاءات تيليجرام والتخزين ─────────────────
+# هيستوجرامات في الذاكرة: واحد منذ التشغيل، وواحد لكل دقيقة لحساب آخر ساعة
+METRICS_WINDOW_MINUTES = 60
+
+
+class LatencyHistogram:
+    """هيستوجرام لوغاريتمي بدقة نسبية ثابتة (~4%) على طريقة HDR، بالميكروثانية"""
+
+    BUCKETS_PER_DOUBLING = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        bucket = int(math.log2(max(seconds * 1e6, 1.0)) * self.BUCKETS_PER_DOUBLING)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def cumulative(self, bounds):
+        """أعداد تراكمية لحدود ثابتة (le) بصيغة Prometheus، كل فئة تُحسب بحدها الأعلى"""
+        counts = [0] * len(bounds)
+        for bucket, count in self.buckets.items():
+            index = bisect.bisect_left(bounds, 2 ** ((bucket + 1) / self.BUCKETS_PER_DOUBLING) / 1e6)
+            if index < len(bounds):
+                counts[index] += count
+        for index in range(1, len(counts)):
+            counts[index] += counts[index - 1]
+        return counts
+
+    def percentile(self, fraction):
+        """الحد الأعلى للفئة التي تحتوي النسبة المطلوبة (بالثواني)"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 1) / self.BUCKETS_PER_DOUBLING) / 1e6, self.max)
+        return self.max
+
+
+class WindowedHistogram:
+    """هيستوجرام منذ التشغيل + هيستوجرام لكل دقيقة من آخر ساعة"""
+
+    def __init__(self):
+        self.overall = LatencyHistogram()
+        self.minutes = deque(maxlen=METRICS_WINDOW_MINUTES)
+
+    def record(self, seconds, minute):
+        self.overall.record(seconds)
+        if not self.minutes or self.minutes[-1][0] != minute:
+            self.minutes.append((minute, LatencyHistogram()))
+        self.minutes[-1][1].record(seconds)
+
+    def recent(self, minute):
+        merged = LatencyHistogram()
+        for bucket_minute, histogram in self.minutes:
+            if bucket_minute > minute - METRICS_WINDOW_MINUTES:
+                merged.merge(histogram)
+        return merged
+
+
+class Metrics:
+    """سلاسل القياس حسب (النوع، الاسم): handler / api / storage / updates / jobs، وعدادات بسيطة
+
+    كل التحديثات تتم من حلقة الأحداث بعمليات قاموس مباشرة بدون أقفال، والتنسيق
+    (/metrics أو Prometheus) يحدث فقط عند الطلب.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def observe(self, family, name, seconds):
+        series = self.series.get((family, name))
+        if series is None:
+            series = self.series[(family, name)] = WindowedHistogram()
+        series.record(seconds, int(time.time() // 60))
+
+    def count(self, name, *labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def family(self, family):
+        """[(الاسم، منذ التشغيل، آخر ساعة)] مرتبة حسب إجمالي الوقت"""
+        minute = int(time.time() // 60)
+        rows = [(name, series.overall, series.recent(minute))
+                for (series_family, name), series in list(self.series.items()) if series_family == family]
+        return sorted(rows, key=lambda row: row[1].total, reverse=True)
+
+METRICS = Metrics()
+
 # ─── دالة تحميل البيانات المحسنة ───────────────────────────────────────
 def load_data(path: Path, default=None, ensure_list=False):
+    started = time.perf_counter()
+    try:
+        return _load_data(path, default, ensure_list)
+    finally:
+        METRICS.observe("storage", f"load {path.name}", time.perf_counter() - started)
+
+def _load_data(path, default, ensure_list):
     if not path.exists():
         return default if default is not None else ([] if ensure_list else {})
     try:
@@ -62,12 +397,1061 @@ def load_data(path: Path, default=None, ensure_list=False):
         logger.error(f"Error loading {path}: {e}")
         return default if default is not None else ([] if ensure_list else {})
 
-def save_data(path: Path, obj):
+# عدد مرات الحفظ والبايتات المكتوبة لكل ملف (تظهر في اللوج عند الإيقاف)
+STORAGE_STATS = {}
+
+# عدد الطلبات المعلقة، يُحدّث مع كل حفظ لملفها حتى لا تقرأ /metrics الملفات في كل طلب
+PENDING_FILES = {PEND_DEP: "deposit", PEND_WDR: "withdrawal"}
+PENDING_COUNTS = dict.fromkeys(PENDING_FILES.values(), 0)
+
+def load_pending_counts():
+    for path, kind in PENDING_FILES.items():
+        PENDING_COUNTS[kind] = len(load_data(path, [], ensure_list=True))
+
+def save_data(path: Path, obj, atomic=False):
+    """حفظ JSON وإرجاع True عند النجاح. atomic=True يكتب في ملف مؤقت ثم يستبدل الملف
+    (os.replace)، فلا يبقى الملف نصف مكتوب إذا توقف البوت أثناء الحفظ"""
+    started = time.perf_counter()
+    target = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp") if atomic else path
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        with open(target, "w", encoding="utf-8") as f:
             json.dump(obj, f, ensure_ascii=False, indent=2)
+            written = f.tell()
+            if atomic:
+                f.flush()
+                os.fsync(f.fileno())
+        if atomic:
+            os.replace(target, path)
+        stats = STORAGE_STATS.setdefault(path.name, {"saves": 0, "bytes": 0})
+        stats["saves"] += 1
+        stats["bytes"] += written
+        if path in PENDING_FILES:
+            PENDING_COUNTS[PENDING_FILES[path]] = len(obj)
+        return True
     except Exception as e:
         logger.error(f"Error saving {path}: {e}")
+        if atomic:
+            target.unlink(missing_ok=True)
+        return False
+    finally:
+        METRICS.observe("storage", f"save {path.name}", time.perf_counter() - started)
+
+# ─── فهرس شرائح المستخدمين للإشعارات الموجّهة ─────────────────────────
+SEGMENT_LABELS = {
+    "all": "👥 جميع المستخدمين",
+    "not_banned": "✅ غير المحظورين",
+    "premium": "👑 الحسابات المميزة",
+    "not_premium": "👤 الحسابات العادية",
+    "active_plans": "📈 لديهم شهادات نشطة",
+    "terms_pending": "⚖️ لم يوافقوا على العقد",
+    "recent": "🆕 المسجلين خلال آخر N يوم",
+    "balance_above": "💰 رصيد EGP أعلى من X"
+}
+
+# الشرائح التي تحتاج قيمة من الأدمن (عدد الأيام أو الحد الأدنى للرصيد)
+PARAM_SEGMENTS = ("recent", "balance_above")
+
+class SegmentIndex:
+    """مجموعات عضوية الشرائح، تُبنى مرة واحدة ثم تُحدّث مع كل تعديل على مستخدم"""
+
+    FLAG_SEGMENTS = ("all", "not_banned", "premium", "not_premium", "terms_pending")
+
+    def __init__(self):
+        self.loaded = False
+        self.members = {name: set() for name in self.FLAG_SEGMENTS}
+        # uid -> (تاريخ التسجيل, رصيد EGP, نهاية آخر شهادة)
+        self.keys = {}
+        # قوائم مرتبة من (القيمة, uid) للشرائح المعتمدة على نطاق
+        self.by_registration = []
+        self.by_balance = []
+        self.by_plan_end = []
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.rebuild(load_data(USERS_FILE, {}))
+
+    def rebuild(self, users):
+        self.__init__()
+        for uid, user in users.items():
+            self._add(uid, user)
+        self.loaded = True
+
+    def update_user(self, uid, user):
+        """تحديث عضوية مستخدم واحد بعد تعديل بياناته"""
+        if not self.loaded:
+            return
+        self.remove_user(uid)
+        self._add(uid, user)
+
+    def remove_user(self, uid):
+        for members in self.members.values():
+            members.discard(uid)
+        keys = self.keys.pop(uid, None)
+        if keys is None:
+            return
+        for ordered, value in zip((self.by_registration, self.by_balance, self.by_plan_end), keys):
+            i = bisect.bisect_left(ordered, (value, uid))
+            if i < len(ordered) and ordered[i] == (value, uid):
+                del ordered[i]
+
+    def _add(self, uid, user):
+        banned = user.get("banned", False)
+        premium = user.get("premium", False)
+        self.members["all"].add(uid)
+        if not banned:
+            self.members["not_banned"].add(uid)
+        self.members["premium" if premium else "not_premium"].add(uid)
+        if not user.get("accepted_terms", False):
+            self.members["terms_pending"].add(uid)
+
+        registration = user.get("registration_date") or 0
+        balance = user.get("balance", {}).get("EGP", 0.0)
+        plan_end = max(
+            (plan["join_date"] + plan["duration"] * 24 * 3600 for plan in user.get("plans", [])),
+            default=0
+        )
+        keys = (registration, balance, plan_end)
+        self.keys[uid] = keys
+        for ordered, value in zip((self.by_registration, self.by_balance, self.by_plan_end), keys):
+            bisect.insort(ordered, (value, uid))
+
+    def _above(self, ordered, threshold):
+        # كل العناصر بعد أول قيمة أكبر من الحد
+        i = bisect.bisect_right(ordered, (threshold, "\uffff"))
+        return {uid for _, uid in ordered[i:]}
+
+    def members_of(self, segment, param=None):
+        """إرجاع مجموعة UIDs الخاصة بالشريحة دون المرور على بيانات كل المستخدمين
+
+        كل الشرائح ما عدا "all" تستبعد المحظورين.
+        """
+        self.ensure_loaded()
+        if segment == "all":
+            return set(self.members["all"])
+        if segment in self.members:
+            members = self.members[segment]
+        elif segment == "recent":
+            members = self._above(self.by_registration, time.time() - float(param) * 24 * 3600)
+        elif segment == "balance_above":
+            members = self._above(self.by_balance, float(param))
+        elif segment == "active_plans":
+            members = self._above(self.by_plan_end, time.time())
+        else:
+            raise KeyError(segment)
+        return members & self.members["not_banned"]
+
+SEGMENTS = SegmentIndex()
+
+# ─── مخزن لقطات الشاشة المعنون بالمحتوى ────────────────────────────────
+BLOBS_DIR = DATA_DIR / "blobs"
+COUNTERS_FILE = DATA_DIR / "counters.json"
+LEGACY_SCREENSHOT_PATTERNS = ("deposit_*.jpg", "assets_withdrawal_*.jpg")
+LEGACY_SCREENSHOT_NAME = re.compile(r"^(deposit|assets_withdrawal)_(\d+)_(\d+)\.jpg$")
+
+class BlobStore:
+    """تخزين الملفات بمفتاح SHA-256 في مجلدات مقسمة (ab/cd/<hash>) مع عداد مراجع.
+
+    الملفات المتطابقة تُخزن مرة واحدة، وكل طلب يشير للملف يزيد عداد المراجع بواحد.
+    القفل يجعل إضافة ملف وحذف الملفات غير المستخدمة (من خيط الصيانة) عمليتين متتاليتين.
+    """
+
+    def __init__(self, root, suffix=".jpg"):
+        self.root = root
+        self.suffix = suffix
+        self.refs_path = root / "refs.json"
+        self.refs = None
+        self.lock = threading.RLock()
+        self.pinned = Counter()
+
+    def _ensure_loaded(self):
+        if self.refs is None:
+            self.refs = load_data(self.refs_path, {})
+
+    def path(self, digest):
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{self.suffix}"
+
+    def exists(self, digest):
+        return self.path(digest).exists()
+
+    def find(self, digest):
+        """البحث عن ملف بالـ hash، ترجع المسار أو None"""
+        path = self.path(digest)
+        return path if path.exists() else None
+
+    def put_bytes(self, data):
+        """تخزين محتوى وإرجاع الـ hash الخاص به (مع زيادة عداد المراجع)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        with self.lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self.incref(digest)
+        return digest
+
+    def put_file(self, source):
+        with open(source, "rb") as f:
+            return self.put_bytes(f.read())
+
+    def temp_path(self):
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        return tmp_dir / f"{secrets.token_hex(8)}.tmp"
+
+    def put_temp(self, tmp_path, digest):
+        """نقل ملف مؤقت تم حساب الـ hash الخاص به إلى مكانه النهائي (نقل ذري)"""
+        path = self.path(digest)
+        with self.lock:
+            if path.exists():
+                tmp_path.unlink()
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+            self.incref(digest)
+        return digest
+
+    def refcount(self, digest):
+        self._ensure_loaded()
+        return self.refs.get(digest, 0)
+
+    def incref(self, digest, count=1):
+        with self.lock:
+            self._ensure_loaded()
+            self.refs[digest] = self.refs.get(digest, 0) + count
+            save_data(self.refs_path, self.refs)
+
+    def decref(self, digest):
+        with self.lock:
+            self._ensure_loaded()
+            if digest not in self.refs:
+                return 0
+            self.refs[digest] -= 1
+            remaining = self.refs[digest]
+            if remaining <= 0:
+                del self.refs[digest]
+            save_data(self.refs_path, self.refs)
+            return max(remaining, 0)
+
+    def pin(self, digest):
+        """منع حذف الملف أثناء استخدامه (ربطه بالطلب وفحص التكرار) حتى لو كان بدون مراجع"""
+        with self.lock:
+            self.pinned[digest] += 1
+
+    def unpin(self, digest):
+        with self.lock:
+            self.pinned[digest] -= 1
+            if self.pinned[digest] <= 0:
+                del self.pinned[digest]
+
+    def remove_if_unused(self, path):
+        """حذف ملف ليس له مراجع وغير مثبت، وإرجاع حجمه (أو 0 إذا بقي)"""
+        with self.lock:
+            digest = path.stem
+            if self.refcount(digest) or self.pinned[digest]:
+                return 0
+            size = path.stat().st_size
+            path.unlink()
+            return size
+
+SCREENSHOTS = BlobStore(BLOBS_DIR)
+
+def next_request_id():
+    """رقم تسلسلي ثابت للطلبات (لا يتغير عند حذف طلبات من القائمة)"""
+    counters = load_data(COUNTERS_FILE, {})
+    counters["request"] = counters.get("request", 0) + 1
+    save_data(COUNTERS_FILE, counters)
+    return counters["request"]
+
+def assign_request_ids():
+    """إعطاء رقم طلب للطلبات المعلقة المحفوظة قبل وجود الأرقام، حتى يمكن قبولها أو رفضها"""
+    for path in (PEND_DEP, PEND_WDR):
+        pend = load_data(path, [], ensure_list=True)
+        missing = [req for req in pend if req.get("id") is None]
+        for req in missing:
+            req["id"] = next_request_id()
+        if missing:
+            save_data(path, pend)
+            logger.info(f"تم إعطاء أرقام لـ {len(missing)} طلب معلق في {path.name}")
+
+def screenshot_evidence(kind, uid, digest, created):
+    """سجل منتهي للقطة شاشة ليس لها طلب إيداع (سحب الأصول والملفات القديمة)،
+    يملك مرجع الملف حتى تؤرشفه الصيانة بعد SCREENSHOT_ARCHIVE_DAYS"""
+    return {
+        "id": None,
+        "uid": uid,
+        "type": kind,
+        "time": created,
+        "status": "evidence",
+        "settled_time": created,
+        "screenshot_sha256": digest,
+        "screenshot_path": str(SCREENSHOTS.path(digest))
+    }
+
+def migrate_legacy_screenshots():
+    """نقل لقطات الشاشة القديمة (data/deposit_*.jpg ...) إلى مخزن الـ hash وحذف المكرر منها.
+
+    كل ملف يبقى له مرجع واحد: الطلب المعلق الذي يشير إليه، أو سجل منتهي في
+    settled_deposits.json حتى تؤرشفه الصيانة وتحرر المرجع.
+    """
+    legacy_files = [path for pattern in LEGACY_SCREENSHOT_PATTERNS for path in DATA_DIR.glob(pattern)]
+    if not legacy_files:
+        return
+
+    migrated = {}
+    saved_bytes = 0
+    for path in legacy_files:
+        digest = SCREENSHOTS.put_file(path)
+        if SCREENSHOTS.refcount(digest) > 1:
+            saved_bytes += path.stat().st_size
+        migrated[path.name] = digest
+        path.unlink()
+
+    pend = load_data(PEND_DEP, [], ensure_list=True)
+    linked = set()
+    for req in pend:
+        name = Path(req.get("screenshot_path") or "").name
+        if name in migrated:
+            req["screenshot_sha256"] = migrated[name]
+            req["screenshot_path"] = str(SCREENSHOTS.path(migrated[name]))
+            linked.add(name)
+    save_data(PEND_DEP, pend)
+
+    # باقي الملفات لطلبات تمت مراجعتها قبل وجود سجل الطلبات المنتهية، فتُسجل فيه بوقت إنشائها
+    settled = load_data(SETTLED_DEP, [], ensure_list=True)
+    for name, digest in migrated.items():
+        if name in linked:
+            continue
+        match = LEGACY_SCREENSHOT_NAME.match(name)
+        if match:
+            kind, uid, created = match.group(1), match.group(2), int(match.group(3))
+        else:
+            kind, uid, created = "deposit", None, int(time.time())
+        settled.append(screenshot_evidence(kind, uid, digest, created))
+    save_data(SETTLED_DEP, settled)
+
+    logger.info(
+        f"تم نقل {len(migrated)} لقطة شاشة إلى مخزن الـ hash "
+        f"({len(set(migrated.values()))} ملف فريد، تم توفير {saved_bytes} بايت)"
+    )
+
+# ─── فهرس البصمة البصرية لكشف لقطات الشاشة المكررة ─────────────────────
+PHASH_INDEX_FILE = DATA_DIR / "phash_index.jsonl"
+LEGACY_PHASH_INDEX_FILE = DATA_DIR / "phash_index.json"
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("PHASH_WORKERS", "2")), thread_name_prefix="phash")
+
+def compute_dhash(path):
+    """بصمة dHash بطول 64 بت: مقارنة كل بكسل بجاره في صورة رمادية 9x8"""
+    with Image.open(path) as image:
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).tobytes())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+class MultiIndexHash:
+    """فهرس بحث بمسافة Hamming بطريقة multi-index hashing.
+
+    البصمة (64 بت) تُقسم إلى max_distance + 1 أجزاء، وأي بصمة ضمن المسافة المطلوبة
+    لا بد أن تتطابق تماماً في جزء واحد على الأقل، فيكفي البحث في جداول الأجزاء ثم
+    التحقق من المسافة الفعلية للمرشحين فقط.
+    """
+
+    def __init__(self, bits=64, max_distance=PHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        self.slices = []
+        offset = 0
+        for i in range(parts):
+            width = bits // parts + (1 if i < bits % parts else 0)
+            self.slices.append((offset, (1 << width) - 1))
+            offset += width
+        self.tables = [{} for _ in self.slices]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        for table, (offset, mask) in zip(self.tables, self.slices):
+            table.setdefault((value >> offset) & mask, []).append((value, item))
+
+    def search(self, value, max_distance=None):
+        """إرجاع [(المسافة, العنصر)] مرتبة من الأقرب"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        results = []
+        seen = set()
+        for table, (offset, mask) in zip(self.tables, self.slices):
+            for candidate, item in table.get((value >> offset) & mask, ()):
+                if id(item) in seen:
+                    continue
+                seen.add(id(item))
+                distance = (value ^ candidate).bit_count()
+                if distance <= max_distance:
+                    results.append((distance, item))
+        results.sort(key=lambda result: result[0])
+        return results
+
+class PerceptualIndex:
+    """فهرس دائم لبصمات لقطات الشاشة مع فهرس multi-index في الذاكرة.
+
+    الملف JSONL: كل بصمة جديدة تُضاف كسطر في آخره بدلاً من إعادة كتابة الفهرس كاملاً.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.entries = None
+        self.index = MultiIndexHash()
+
+    def _ensure_loaded(self):
+        if self.entries is not None:
+            return
+        self.entries = []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # سطر ناقص بعد توقف مفاجئ أثناء الكتابة
+                        continue
+        except FileNotFoundError:
+            pass
+        if self.legacy_path and self.legacy_path.exists():
+            legacy = load_data(self.legacy_path, [], ensure_list=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in legacy:
+                    f.write(json.dumps(entry) + "\n")
+            self.entries = legacy + self.entries
+            self.legacy_path.unlink()
+        for entry in self.entries:
+            self.index.add(entry["hash"], entry)
+
+    def find_similar(self, value, max_distance=PHASH_MAX_DISTANCE):
+        self._ensure_loaded()
+        return self.index.search(value, max_distance)
+
+    def add(self, value, request_id, uid, sha256):
+        self._ensure_loaded()
+        entry = {"hash": value, "request_id": request_id, "uid": uid, "sha256": sha256, "time": int(time.time())}
+        self.entries.append(entry)
+        self.index.add(value, entry)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+PHASH_INDEX = PerceptualIndex(PHASH_INDEX_FILE, LEGACY_PHASH_INDEX_FILE)
+
+async def check_duplicate_screenshot(path, request_id, uid, digest):
+    """حساب البصمة في مجموعة العمال وإرجاع أقرب طلب سابق مشابه (إن وجد)"""
+    if Image is None:
+        return None
+    try:
+        value = await asyncio.get_running_loop().run_in_executor(PHASH_POOL, compute_dhash, path)
+    except Exception as e:
+        logger.error(f"فشل في حساب بصمة لقطة الشاشة: {e}")
+        return None
+
+    matches = PHASH_INDEX.find_similar(value)
+    PHASH_INDEX.add(value, request_id, uid, digest)
+    return matches[0][1] if matches else None
+
+def duplicate_note(match):
+    if match.get("request_id") is not None:
+        return f"⚠️ <b>احتمال تكرار للطلب #{match['request_id']}</b> (UID: <code>{match['uid']}</code>)"
+    return f"⚠️ <b>احتمال تكرار لطلب سحب أصول سابق</b> (UID: <code>{match['uid']}</code>)"
+
+# ─── مدير تحميل لقطات الشاشة ────────────────────────────────────────
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
+DOWNLOAD_PER_USER = int(os.getenv("DOWNLOAD_PER_USER", "2"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+MAX_SCREENSHOT_BYTES = int(os.getenv("MAX_SCREENSHOT_BYTES", str(10 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class DownloadManager:
+    """تحميل لقطات الشاشة في الخلفية بحد أقصى للتحميلات المتزامنة ولكل مستخدم.
+
+    التحميل يُكتب على دفعات لملف مؤقت مع حساب الـ hash أثناء الكتابة، ثم يُنقل
+    ذرياً إلى مخزن الـ hash، ويتوقف فور تجاوز الحجم الأقصى.
+    """
+
+    def __init__(self, concurrency, per_user, max_bytes):
+        self.concurrency = concurrency
+        self.per_user = per_user
+        self.max_bytes = max_bytes
+        self.semaphore = None
+        self.client = None
+        self.in_flight = {}
+
+    def try_reserve(self, uid):
+        """حجز مكان تحميل للمستخدم قبل إضافة الطلب، ترجع False عند تجاوز الحد"""
+        if self.in_flight.get(uid, 0) >= self.per_user:
+            return False
+        self.in_flight[uid] = self.in_flight.get(uid, 0) + 1
+        return True
+
+    def release(self, uid):
+        remaining = self.in_flight.get(uid, 0) - 1
+        if remaining > 0:
+            self.in_flight[uid] = remaining
+        else:
+            self.in_flight.pop(uid, None)
+
+    async def download(self, bot, file_id, uid):
+        """تحميل ملف محجوز مسبقاً بـ try_reserve وإرجاع الـ hash الخاص به"""
+        try:
+            if self.semaphore is None:
+                self.semaphore = asyncio.Semaphore(self.concurrency)
+            async with self.semaphore:
+                remote_file = await bot.get_file(file_id)
+                if remote_file.file_size and remote_file.file_size > self.max_bytes:
+                    raise ValueError(f"حجم الملف {remote_file.file_size} يتجاوز الحد الأقصى {self.max_bytes}")
+                return await self._stream(remote_file.file_path)
+        finally:
+            self.release(uid)
+
+    async def _stream(self, file_path):
+        tmp_path = SCREENSHOTS.temp_path()
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                async for chunk in self._chunks(file_path):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError(f"حجم الملف يتجاوز الحد الأقصى {self.max_bytes}")
+                    sha256.update(chunk)
+                    f.write(chunk)
+            return SCREENSHOTS.put_temp(tmp_path, sha256.hexdigest())
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    async def _chunks(self, file_path):
+        # خادم Bot API المحلي يُرجع مسار ملف بدلاً من رابط
+        if not file_path.startswith(("http://", "https://")):
+            with open(file_path, "rb") as f:
+                while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+            return
+
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=DOWNLOAD_TIMEOUT,
+                limits=httpx.Limits(max_connections=self.concurrency)
+            )
+        async with self.client.stream("GET", file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+DOWNLOADS = DownloadManager(DOWNLOAD_CONCURRENCY, DOWNLOAD_PER_USER, MAX_SCREENSHOT_BYTES)
+
+# ─── صيانة لقطات الشاشة: ضغط وأرشفة وحذف غير المستخدم ───────────────────
+ARCHIVE_DIR = DATA_DIR / "archive"
+SCREENSHOT_ARCHIVE_DAYS = int(os.getenv("SCREENSHOT_ARCHIVE_DAYS", "30"))
+SCREENSHOT_MAINTENANCE_HOURS = float(os.getenv("SCREENSHOT_MAINTENANCE_HOURS", "24"))
+ARCHIVE_MAX_SIDE = 1280
+ARCHIVE_JPEG_QUALITY = 60
+STALE_TEMP_SECONDS = 3600
+
+def pack_screenshot(source, archive_path, name):
+    """إضافة لقطة شاشة (بعد تصغيرها وإعادة ضغطها إن أمكن) إلى أرشيف الشهر"""
+    data = source.read_bytes()
+    if Image is not None:
+        try:
+            with Image.open(source) as image:
+                image = image.convert("RGB")
+                image.thumbnail((ARCHIVE_MAX_SIDE, ARCHIVE_MAX_SIDE))
+                out = io.BytesIO()
+                image.save(out, "JPEG", quality=ARCHIVE_JPEG_QUALITY, optimize=True)
+            if out.tell() < len(data):
+                data = out.getvalue()
+        except Exception as e:
+            logger.warning(f"تعذر إعادة ضغط {source}: {e}")
+
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(archive_path, "a", compression=zipfile.ZIP_STORED) as archive:
+        if name not in archive.namelist():
+            archive.writestr(name, data)
+
+def remove_orphan_blobs():
+    """حذف الملفات التي لا يشير إليها أي طلب والملفات المؤقتة القديمة، وإرجاع عدد البايتات المحررة
+    (تعمل في خيط، والتحقق من المراجع والحذف يتمان تحت قفل المخزن)"""
+    freed = 0
+    now = time.time()
+    for path in BLOBS_DIR.glob("*/*/*" + SCREENSHOTS.suffix):
+        freed += SCREENSHOTS.remove_if_unused(path)
+    for path in BLOBS_DIR.glob("tmp/*.tmp"):
+        if now - path.stat().st_mtime > STALE_TEMP_SECONDS:
+            freed += path.stat().st_size
+            path.unlink()
+    return freed
+
+def archive_size():
+    return sum(path.stat().st_size for path in ARCHIVE_DIR.glob("*.zip"))
+
+def archived_screenshots():
+    """محتوى الأرشيفات: {اسم الملف: اسم الأرشيف الذي يحتويه}"""
+    contents = {}
+    for archive_path in sorted(ARCHIVE_DIR.glob("*.zip")):
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                for name in archive.namelist():
+                    contents.setdefault(name, archive_path.name)
+        except zipfile.BadZipFile as e:
+            logger.error(f"أرشيف لقطات الشاشة تالف {archive_path.name}: {e}")
+    return contents
+
+def settled_key(req):
+    """مفتاح ثابت لطلب منتهي (الطلبات القديمة بدون معرف تُميَّز بالمستخدم والوقت)"""
+    return (req.get("id"), req.get("uid"), req.get("time"))
+
+async def screenshot_maintenance(context=None):
+    """أرشفة لقطات شاشة الطلبات المنتهية القديمة حسب الشهر، ثم حذف الملفات غير المستخدمة"""
+    started = time.time()
+    settled = load_data(SETTLED_DEP, [], ensure_list=True)
+    cutoff = started - SCREENSHOT_ARCHIVE_DAYS * 24 * 3600
+    archived = 0
+    missing = 0
+    # المفتاح -> اسم الأرشيف، أو None إذا لم يكن الملف موجوداً في المخزن ولا في أي أرشيف
+    archived_requests = {}
+    archive_contents = None
+    archive_bytes_before = await asyncio.to_thread(archive_size)
+
+    for req in settled:
+        digest = req.get("screenshot_sha256")
+        if (not digest or req.get("screenshot_archive") or req.get("screenshot_missing")
+                or req["settled_time"] > cutoff):
+            continue
+        name = f"{digest}.jpg"
+        source = SCREENSHOTS.find(digest)
+        if source is None:
+            # لم يكتمل التحميل أو حُذف الملف بعد أرشفته لطلب آخر بنفس المحتوى: لا شيء يُضغط
+            # ولا مرجع يُحرر، ويُسجل الأرشيف الذي يحتويه فعلاً إن وجد
+            if archive_contents is None:
+                archive_contents = await asyncio.to_thread(archived_screenshots)
+            archived_requests[settled_key(req)] = archive_contents.get(name)
+            missing += archive_contents.get(name) is None
+            continue
+        month = time.strftime("%Y-%m", time.localtime(req["settled_time"]))
+        archive_name = f"screenshots-{month}.zip"
+        try:
+            await asyncio.to_thread(pack_screenshot, source, ARCHIVE_DIR / archive_name, name)
+        except Exception as e:
+            logger.error(f"فشل في أرشفة لقطة الشاشة {digest}: {e}")
+            continue
+        archived_requests[settled_key(req)] = archive_name
+        if archive_contents is not None:
+            archive_contents.setdefault(name, archive_name)
+        SCREENSHOTS.decref(digest)
+        archived += 1
+
+    if archived_requests:
+        # إعادة التحميل لأن طلبات جديدة قد تُضاف أثناء الأرشفة
+        settled = load_data(SETTLED_DEP, [], ensure_list=True)
+        for req in settled:
+            key = settled_key(req)
+            if key not in archived_requests:
+                continue
+            if archived_requests[key]:
+                req["screenshot_archive"] = archived_requests[key]
+            else:
+                req["screenshot_missing"] = True
+            req["screenshot_path"] = None
+        save_data(SETTLED_DEP, settled)
+    if missing:
+        logger.warning(f"صيانة لقطات الشاشة: {missing} طلب بدون ملف في المخزن أو الأرشيف")
+
+    freed = await asyncio.to_thread(remove_orphan_blobs)
+    archive_bytes = await asyncio.to_thread(archive_size) - archive_bytes_before
+    reclaimed = freed - archive_bytes
+
+    logger.info(
+        f"صيانة لقطات الشاشة: أرشفة {archived} ملف، تحرير {freed} بايت، "
+        f"إضافة {archive_bytes} بايت للأرشيف (صافي {reclaimed} بايت) "
+        f"خلال {time.time() - started:.1f} ثانية"
+    )
+    METRICS.observe("jobs", "screenshot_maintenance", time.time() - started)
+    if archived or freed:
+        for admin_id in ADMIN_IDS:
+            OUTBOX.enqueue(
+                admin_id,
+                text=f"🧹 <b>صيانة لقطات الشاشة</b>\n\n"
+                     f"📦 تمت أرشفة: {archived} ملف\n"
+                     f"🗑️ مساحة محررة: {freed / 1024:.1f} KB\n"
+                     f"🗄️ مضاف للأرشيف: {archive_bytes / 1024:.1f} KB\n"
+                     f"💾 صافي المساحة الموفرة: {reclaimed / 1024:.1f} KB",
+                parse_mode=ParseMode.HTML
+            )
+
+# ─── سجل المحادثات المغلقة (مستخدمين قاموا بحظر البوت) ───────────────────
+DEAD_CHATS_FILE = DATA_DIR / "dead_chats.json"
+
+class DeadChatRegistry:
+    """سجل بالمحادثات التي رفضها تيليجرام (Forbidden / chat not found) لتخطيها في الإرسال"""
+
+    def __init__(self, path):
+        self.path = path
+        self.chats = None
+
+    def _ensure_loaded(self):
+        if self.chats is None:
+            self.chats = load_data(self.path, {})
+
+    def is_dead(self, chat_id):
+        self._ensure_loaded()
+        return str(chat_id) in self.chats
+
+    def mark(self, chat_id, reason):
+        self._ensure_loaded()
+        self.chats[str(chat_id)] = {"time": int(time.time()), "reason": reason}
+        save_data(self.path, self.chats)
+
+    def clear(self, chat_id):
+        self._ensure_loaded()
+        if self.chats.pop(str(chat_id), None) is not None:
+            save_data(self.path, self.chats)
+            logger.info(f"تمت إزالة المحادثة {chat_id} من سجل المحادثات المغلقة")
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.chats)
+
+DEAD_CHATS = DeadChatRegistry(DEAD_CHATS_FILE)
+
+def is_dead_chat_error(error):
+    """هل الخطأ يعني أن المستخدم حظر البوت أو أن المحادثة غير موجودة؟"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+async def send_to_user(bot, chat_id, **kwargs):
+    """إرسال رسالة لمستخدم مع تخطي المحادثات المغلقة وتسجيل الجديدة منها.
+
+    ترجع None إذا تم تخطي المحادثة، وترفع الخطأ في باقي حالات الفشل.
+    """
+    if DEAD_CHATS.is_dead(chat_id):
+        return None
+    try:
+        return await bot.send_message(chat_id=chat_id, **kwargs)
+    except TelegramError as e:
+        if is_dead_chat_error(e):
+            DEAD_CHATS.mark(chat_id, str(e))
+            return None
+        raise
+
+async def revive_dead_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إزالة المستخدم من سجل المحادثات المغلقة عند أي تفاعل جديد منه"""
+    if update.effective_user and DEAD_CHATS.is_dead(update.effective_user.id):
+        DEAD_CHATS.clear(update.effective_user.id)
+
+# ─── صندوق الرسائل الصادرة (Outbox) ──────────────────────────────────
+OUTBOX_FILE = DATA_DIR / "outbox.json"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_MAX_BACKOFF = 300
+# أقل عدد سطور في سجل الصندوق قبل ضغطه في لقطة outbox.json
+OUTBOX_COMPACT_LINES = int(os.getenv("OUTBOX_COMPACT_LINES", "1000"))
+
+class Outbox:
+    """صندوق صادر دائم: المعالجات تضيف الإشعارات فوراً، وعمال الإرسال يسلمونها لاحقاً.
+
+    كل محادثة مرتبطة بعامل واحد ثابت (chat_id % عدد العمال) فيحافظ ذلك على ترتيب
+    رسائل نفس المحادثة، والرسائل غير المرسلة محفوظة وتُستأنف بعد إعادة التشغيل.
+    الإضافة والتسليم وعدد المحاولات تُكتب كسطر في سجل (outbox.journal)، والسجل يُضغط في لقطة
+    outbox.json عندما يكبر عن ضعف الرسائل المعلقة، فلا يُعاد كتابة الصندوق كاملاً مع كل رسالة.
+    """
+
+    def __init__(self, path, workers):
+        self.path = path
+        self.journal_path = path.with_suffix(".journal")
+        self.journal = None
+        self.journal_lines = 0
+        self.workers = workers
+        self.pending = {}
+        self.held = {}
+        self.queues = []
+        self.tasks = []
+        self.bot = None
+
+    def enqueue(self, chat_id, text, save=True, **kwargs):
+        """إضافة رسالة للصندوق دون انتظار تيليجرام (save=False يؤجل الكتابة لـ save())"""
+        msg = {
+            "id": secrets.token_hex(8),
+            "chat_id": int(chat_id),
+            "text": text,
+            "kwargs": kwargs,
+            "attempts": 0,
+            "time": time.time()
+        }
+        self.pending[msg["id"]] = msg
+        self._log({"add": msg}, flush=save)
+        if self.queues:
+            self.queues[msg["chat_id"] % len(self.queues)].put_nowait(msg)
+        return msg["id"]
+
+    def _log(self, entry, flush=True):
+        if self.journal is None:
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.journal_lines += 1
+        if self.journal_lines > max(OUTBOX_COMPACT_LINES, 2 * len(self.pending)):
+            self.compact()
+        elif flush:
+            self.journal.flush()
+
+    def save(self):
+        """كتابة سطور السجل المؤجلة (بعد enqueue بـ save=False)"""
+        if self.journal:
+            self.journal.flush()
+
+    def compact(self):
+        """لقطة كاملة للرسائل المعلقة ثم تفريغ السجل (لا يُفرغ السجل إذا فشلت كتابة اللقطة)"""
+        if not save_data(self.path, list(self.pending.values()), atomic=True):
+            if self.journal:
+                self.journal.flush()
+            return
+        if self.journal:
+            self.journal.close()
+        self.journal = open(self.journal_path, "w", encoding="utf-8")
+        self.journal_lines = 0
+
+    def replay_journal(self):
+        """تطبيق سطور السجل على اللقطة (السطر الأخير قد يكون ناقصاً بعد توقف مفاجئ)"""
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "add" in entry:
+                        self.pending.setdefault(entry["add"]["id"], entry["add"])
+                    elif "done" in entry:
+                        self.pending.pop(entry["done"], None)
+                    elif "attempts" in entry:
+                        msg_id, attempts = entry["attempts"]
+                        if msg_id in self.pending:
+                            self.pending[msg_id]["attempts"] = attempts
+        except FileNotFoundError:
+            pass
+
+    async def start(self, bot):
+        self.bot = bot
+        self.queues = [asyncio.Queue() for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+        # استئناف الرسائل التي لم تُرسل قبل إيقاف البوت بنفس ترتيب إضافتها
+        self.save()
+        for msg in load_data(self.path, [], ensure_list=True):
+            self.pending.setdefault(msg["id"], msg)
+        self.replay_journal()
+        self.compact()
+        for msg in sorted(self.pending.values(), key=lambda m: m["time"]):
+            self.queues[msg["chat_id"] % len(self.queues)].put_nowait(msg)
+        if self.pending:
+            logger.info(f"تم استئناف {len(self.pending)} رسالة من صندوق الصادر")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queues = []
+        self.held = {}
+        self.compact()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def finish(self, msg):
+        self.pending.pop(msg["id"], None)
+        self._log({"done": msg["id"]})
+
+    def defer(self, msg, delay):
+        """إيقاف المحادثة وحدها حتى موعد إعادة المحاولة بدلاً من نوم العامل،
+        فلا تنتظر باقي المحادثات على نفس العامل خلفها"""
+        self.held[msg["chat_id"]] = [msg]
+        asyncio.get_running_loop().call_later(delay, self.release, msg["chat_id"])
+
+    def retry(self, msg, error, reason):
+        """محاولة فاشلة تُحسب وتُكتب في السجل حتى لا يعود العداد للصفر بعد إعادة التشغيل،
+        وترجع True إذا استُنفدت المحاولات"""
+        msg["attempts"] += 1
+        if msg["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"فشل إرسال رسالة للمحادثة {msg['chat_id']} بعد {msg['attempts']} محاولات: {error}")
+            METRICS.count("outbox_messages", "failed")
+            return True
+        METRICS.count("outbox_retries", reason)
+        self._log({"attempts": [msg["id"], msg["attempts"]]})
+        self.defer(msg, min(OUTBOX_MAX_BACKOFF, 2 ** msg["attempts"]))
+        return False
+
+    def release(self, chat_id):
+        """إعادة رسائل المحادثة المؤجلة للطابور بنفس ترتيبها"""
+        held = self.held.pop(chat_id, [])
+        if self.queues:
+            queue = self.queues[chat_id % len(self.queues)]
+            for msg in held:
+                queue.put_nowait(msg)
+
+    async def _worker(self, queue):
+        while True:
+            msg = await queue.get()
+            try:
+                held = self.held.get(msg["chat_id"])
+                if held is not None:
+                    # المحادثة تنتظر إعادة محاولة: الرسالة تُرسل بعد سابقاتها
+                    held.append(msg)
+                elif await self._deliver(msg):
+                    self.finish(msg)
+            except Exception as e:
+                # خطأ غير متوقع يُعامل كمحاولة فاشلة، فلا يضيع إشعار دائم من أول خطأ
+                logger.error(f"خطأ غير متوقع في صندوق الصادر للمحادثة {msg['chat_id']}: {e}")
+                if self.retry(msg, e, "error"):
+                    self.finish(msg)
+            # عند الإلغاء (إيقاف البوت) تبقى الرسالة محفوظة لإعادة المحاولة لاحقاً
+            queue.task_done()
+
+    async def _deliver(self, msg):
+        """محاولة إرسال واحدة، وإرجاع False إذا تأجلت الرسالة لإعادة المحاولة"""
+        try:
+            sent = await send_to_user(self.bot, msg["chat_id"], text=msg["text"], **msg["kwargs"])
+            METRICS.count("outbox_messages", "sent" if sent else "dead_chat")
+            return True
+        except RetryAfter as e:
+            # تجاوز حد الإرسال لا يُحسب كمحاولة فاشلة
+            METRICS.count("outbox_retries", "retry_after")
+            self.defer(msg, e.retry_after)
+            return False
+        except BadRequest as e:
+            logger.error(f"تم رفض رسالة للمحادثة {msg['chat_id']}: {e}")
+            METRICS.count("outbox_messages", "rejected")
+            return True
+        except (TimedOut, NetworkError) as e:
+            return self.retry(msg, e, "network")
+        except TelegramError as e:
+            logger.error(f"تعذر إرسال رسالة للمحادثة {msg['chat_id']}: {e}")
+            METRICS.count("outbox_messages", "failed")
+            return True
+
+OUTBOX = Outbox(OUTBOX_FILE, OUTBOX_WORKERS)
+
+# ─── مراقبة تأخر حلقة الأحداث ─────────────────────────────────────────
+# مهمة صغيرة تنام LOOP_LAG_INTERVAL وتقيس كم تأخرت في الاستيقاظ، وخيط منفصل يلاحظ
+# توقف نبضها أثناء الحجب فيلتقط مكدس خيط الحلقة (الدالة التي تحجبها) قبل أن تنتهي.
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_MS", "250")) / 1000  # 0 = متوقف
+LOOP_STALL_ALERT_INTERVAL = int(os.getenv("LOOP_STALL_ALERT_MINUTES", "10")) * 60
+LOOP_STALL_STACK_DEPTH = 8
+
+class LoopWatchdog:
+    """قياس تأخر حلقة الأحداث والتقاط مكدس الكود الذي يحجبها"""
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+        self.captured = None
+        self.task = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.stalls = 0
+        self.unreported = 0
+        self.last_alert = 0
+
+    async def start(self):
+        if self.threshold <= 0:
+            return
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._tick())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopping.set()
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _tick(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            lag = max(0.0, self.heartbeat - before - self.interval)
+            METRICS.observe("loop", "lag", lag)
+            if lag >= self.threshold:
+                self.report(lag, self.captured)
+            self.captured = None
+
+    def _watch(self):
+        """يعمل في خيط منفصل: عند توقف النبض يحفظ مكدس خيط الحلقة مرة واحدة لكل توقف"""
+        while not self.stopping.wait(self.threshold / 2):
+            if self.captured is None and time.monotonic() - self.heartbeat > self.interval + self.threshold:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.captured = traceback.extract_stack(frame)
+
+    @staticmethod
+    def task_frames(stack):
+        """إطارات المهمة نفسها بدون إطارات تشغيل asyncio التي تسبقها"""
+        asyncio_dir = os.path.dirname(asyncio.__file__)
+        start = 0
+        for index, frame in enumerate(stack[:-1]):
+            if frame.filename.startswith(asyncio_dir):
+                start = index + 1
+        return stack[start:]
+
+    @staticmethod
+    def offending_frame(stack):
+        """أعمق إطار من كود البوت (وليس من المكتبات) في المكدس الملتقط"""
+        for frame in reversed(stack):
+            if frame.filename == __file__:
+                return frame
+        return stack[-1] if stack else None
+
+    def report(self, lag, stack):
+        self.stalls += 1
+        METRICS.count("loop_stalls")
+        stack = self.task_frames(stack or [])
+        frame = self.offending_frame(stack)
+        where = f"{frame.name} ({Path(frame.filename).name}:{frame.lineno})" if frame else "غير معروف"
+        trace = "".join(traceback.format_list(stack[-LOOP_STALL_STACK_DEPTH:]))
+        logger.warning(f"توقف حلقة الأحداث {lag * 1000:.0f}ms في {where}\n{trace}")
+
+        now = time.time()
+        if now - self.last_alert < LOOP_STALL_ALERT_INTERVAL:
+            self.unreported += 1
+            return
+        self.last_alert = now
+        skipped = f"\n(+{self.unreported} توقف آخر منذ التنبيه السابق)" if self.unreported else ""
+        self.unreported = 0
+        for admin_id in ADMIN_IDS:
+            OUTBOX.enqueue(
+                admin_id,
+                text=(
+                    f"⚠️ <b>توقف حلقة الأحداث</b>\n\n"
+                    f"⏱ المدة: {lag * 1000:.0f} ms\n"
+                    f"📍 الموضع: <code>{html.escape(where)}</code>{skipped}\n\n"
+                    f"<pre>{html.escape(trace[-3000:]) or '-'}</pre>"
+                ),
+                parse_mode=ParseMode.HTML
+            )
+
+LOOP_WATCHDOG = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD)
 
 # ─── ثوابت عامة ──────────────────────────────────────────────
 TOKEN = os.getenv("BOT_TOKEN")
@@ -77,6 +1461,210 @@ if not TOKEN:
     print("تأكد من إضافة BOT_TOKEN في قسم Secrets")
     exit(1)
 
+# ─── مسارات الاتصال بتيليجرام (تفاعلي / جماعي) ─────────────────────────
+# الردود والتعديلات التفاعلية تستخدم بوت التطبيق بمجموعة اتصالات خاصة بها،
+# والإرسال الجماعي (الإشعارات العامة وصندوق الصادر) يستخدم بوتاً ثانياً بمجموعة محدودة
+# حتى لا ينتظر المستخدمون خلف إشعار عام أو دفعة أرباح كبيرة.
+INTERACTIVE_POOL_SIZE = int(os.getenv("INTERACTIVE_POOL_SIZE", "32"))
+INTERACTIVE_TIMEOUT = float(os.getenv("INTERACTIVE_TIMEOUT", "10"))
+BULK_POOL_SIZE = int(os.getenv("BULK_POOL_SIZE", "4"))
+BULK_TIMEOUT = float(os.getenv("BULK_TIMEOUT", "30"))
+UPDATES_TIMEOUT = float(os.getenv("UPDATES_TIMEOUT", "30"))
+
+# عنوان Bot API (يمكن توجيهه لخادم محلي بديل للاختبار بدون إنترنت)
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org").rstrip("/")
+
+# ─── استقبال التحديثات عبر Webhook ────────────────────────────────────
+# إذا تم تحديد WEBHOOK_URL يعمل البوت بوضع webhook بدل long polling،
+# ويتحقق من X-Telegram-Bot-Api-Secret-Token في كل طلب وارد.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# كل العمليات خلف نفس العنوان يجب أن تستخدم نفس الرمز: رمز عشوائي لكل عملية يستبدله
+# setWebhook عند كل تشغيل فترفض باقي العمليات طلبات تيليجرام بـ 403
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    print("❌ خطأ: وضع webhook يتطلب WEBHOOK_SECRET في متغيرات البيئة!")
+    print("استخدم نفس القيمة لكل العمليات، مثلاً: python -c \"import secrets; print(secrets.token_urlsafe(32))\"")
+    exit(1)
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest يسجل زمن كل استدعاء لـ Bot API حسب اسم الطريقة"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        name = "file_download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            METRICS.count("api_errors", name, type(e).__name__)
+            raise
+        finally:
+            METRICS.observe("api", name, time.perf_counter() - started)
+        if code >= 400:
+            METRICS.count("api_errors", name, str(code))
+        return code, payload
+
+def build_request(pool_size, timeout):
+    return MeteredRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=timeout,
+        read_timeout=timeout,
+        write_timeout=timeout,
+        pool_timeout=timeout
+    )
+
+# يتم تهيئته عند بدء التشغيل
+BULK_BOT = None
+
+def bulk_bot(context):
+    """بوت الإرسال الجماعي، أو بوت التطبيق إذا لم يكن مسار الإرسال الجماعي جاهزاً"""
+    return BULK_BOT or context.bot
+
+# ─── تجنب التعديلات المطابقة لآخر محتوى معروض ─────────────────────────
+# الضغط على "العودة" أو فتح نفس الشاشة يرسل نفس المحتوى، فيرفضه تيليجرام
+# بـ "Message is not modified" بعد رحلة كاملة. نحتفظ ببصمة آخر نص وأزرار لكل
+# رسالة في ذاكرة LRU محدودة ونتخطى التعديل المطابق محلياً.
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "10000"))
+
+def is_not_modified_error(error):
+    return isinstance(error, BadRequest) and "message is not modified" in error.message.lower()
+
+class RenderCacheBot(ExtBot):
+    """بوت التطبيق مع ذاكرة لآخر محتوى معروض في كل رسالة"""
+
+    def __init__(self, *args, render_cache_size=RENDER_CACHE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        # كائنات تيليجرام مجمدة بعد الإنشاء
+        with self._unfrozen():
+            self.render_cache_size = render_cache_size
+            self.rendered = OrderedDict()
+            self.skipped_edits = OrderedDict()
+            self.answered_queries = OrderedDict()
+            self.render_stats = {"skipped": 0, "sent": 0}
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.render_cache_size:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def _message_key(chat_id, message_id, inline_message_id):
+        if inline_message_id:
+            return inline_message_id
+        if chat_id is None or message_id is None:
+            return None
+        return (int(chat_id), message_id)
+
+    def forget(self, chat_id=None, message_id=None, inline_message_id=None):
+        """إلغاء المحتوى المحفوظ لرسالة تم تعديلها أو حذفها بطريقة أخرى"""
+        key = self._message_key(chat_id, message_id, inline_message_id)
+        if key is not None:
+            self.rendered.pop(key, None)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, inline_message_id=None, **kwargs):
+        key = self._message_key(chat_id, message_id, inline_message_id)
+        fingerprint = hash((
+            text,
+            str(kwargs.get("parse_mode")),
+            kwargs.get("reply_markup"),
+            str(kwargs.get("disable_web_page_preview")),
+            tuple(kwargs.get("entities") or ())
+        ))
+        if key is not None and self.rendered.get(key) == fingerprint:
+            self.rendered.move_to_end(key)
+            self._remember(self.skipped_edits, key, True)
+            self.render_stats["skipped"] += 1
+            return True
+
+        self.render_stats["sent"] += 1
+        try:
+            result = await super().edit_message_text(
+                text, chat_id=chat_id, message_id=message_id,
+                inline_message_id=inline_message_id, **kwargs
+            )
+        except BadRequest as e:
+            if not is_not_modified_error(e):
+                self.forget(chat_id, message_id, inline_message_id)
+                raise
+            result = True
+            if key is not None:
+                self._remember(self.skipped_edits, key, True)
+
+        if key is not None:
+            self._remember(self.rendered, key, fingerprint)
+        return result
+
+    async def edit_message_caption(self, chat_id=None, message_id=None, inline_message_id=None, *args, **kwargs):
+        self.forget(chat_id, message_id, inline_message_id)
+        return await super().edit_message_caption(chat_id, message_id, inline_message_id, *args, **kwargs)
+
+    async def edit_message_reply_markup(self, chat_id=None, message_id=None, inline_message_id=None, *args, **kwargs):
+        self.forget(chat_id, message_id, inline_message_id)
+        return await super().edit_message_reply_markup(chat_id, message_id, inline_message_id, *args, **kwargs)
+
+    async def delete_message(self, chat_id, message_id, *args, **kwargs):
+        self.forget(chat_id, message_id)
+        return await super().delete_message(chat_id, message_id, *args, **kwargs)
+
+    async def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        self._remember(self.answered_queries, callback_query_id, True)
+        return await super().answer_callback_query(callback_query_id, *args, **kwargs)
+
+    def take_skipped_edit(self, query):
+        """هل تم تخطي تعديل رسالة هذا الزر ولم تتم الإجابة عليه بعد؟"""
+        message = query.message
+        key = self._message_key(
+            message.chat_id if message else None,
+            message.message_id if message else None,
+            query.inline_message_id
+        )
+        skipped = key is not None and self.skipped_edits.pop(key, None) is not None
+        answered = self.answered_queries.pop(query.id, None) is not None
+        return skipped and not answered
+
+async def answer_skipped_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """الإجابة على الزر إذا تم تخطي التعديل المطابق حتى لا يبقى مؤشر التحميل"""
+    bot = context.bot
+    if isinstance(bot, RenderCacheBot) and bot.take_skipped_edit(update.callback_query):
+        try:
+            await update.callback_query.answer()
+        except TelegramError as e:
+            logger.debug(f"تعذر الإجابة على الزر بعد تخطي التعديل: {e}")
+
+async def on_startup(application):
+    global BULK_BOT
+    migrate_legacy_screenshots()
+    assign_request_ids()
+    BULK_BOT = Bot(
+        TOKEN,
+        base_url=f"{BOT_API_URL}/bot",
+        base_file_url=f"{BOT_API_URL}/file/bot",
+        request=build_request(BULK_POOL_SIZE, BULK_TIMEOUT)
+    )
+    await BULK_BOT.initialize()
+    await OUTBOX.start(BULK_BOT)
+    await start_metrics_server()
+    await LOOP_WATCHDOG.start()
+
+async def on_shutdown(application):
+    global BULK_BOT
+    await stop_metrics_server()
+    await LOOP_WATCHDOG.stop()
+    await OUTBOX.stop()
+    await DOWNLOADS.stop()
+    if BULK_BOT:
+        await BULK_BOT.shutdown()
+        BULK_BOT = None
+    if UPDATE_RECORDER:
+        UPDATE_RECORDER.close()
+    if LOG_HANDLER.dropped:
+        logger.warning(f"تم حذف {LOG_HANDLER.dropped} سجل لامتلاء طابور اللوج")
+    logger.info("إحصائيات الكتابة عند الإيقاف", extra={"save_data": STORAGE_STATS})
+
 # تعريف الخطط الاستثمارية
 PLANS = {
     "daily": {
@@ -289,11 +1877,553 @@ CONTRACT_TEXT = """
  ADMIN_BROADCAST, ADMIN_STATS, ADMIN_REQUESTS, ADMIN_PREMIUM, ADMIN_PREMIUM_USER,
  ADMIN_DEPOSIT_CHOICE, ADMIN_CUSTOM_REASON, ADMIN_SEARCH, ADMIN_SEARCH_INPUT) = range(33, 49)
 
+# حالات الإشعار العام الموجّه
+(ADMIN_BROADCAST_SEGMENT, ADMIN_BROADCAST_PARAM) = range(49, 51)
+
+
+# ─── تسجيل التحديثات لإعادة تشغيلها (tools/replay_trace.py) ─────────────
+# مسار ملف التسجيل، ويقبل صيغ strftime لبدء ملف جديد كل يوم مثل
+# data/traces/%Y-%m-%d.jsonl.gz — فارغ = التسجيل متوقف. كل عملية تكتب ملفها الخاص
+# (يُضاف وقت البدء ورقم العملية للاسم) لأن الـ salt وبداية "t" لا يُحفظان بين التشغيلات
+UPDATE_TRACE = os.getenv("UPDATE_TRACE", "")
+TRACE_FLUSH_EVERY = 100
+
+EMAIL_PATTERN = re.compile(r"[\w.%+-]+@[\w.-]+\.[A-Za-z]{2,}")
+# أي نص من أرقام فقط (هواتف، محافظ، كلمات مرور رقمية، UID، مبالغ) تُستبدل أرقامه
+PHONE_LIKE = re.compile(r"\+?[\d][\d\s-]*")
+NAME_FIELDS = ("first_name", "last_name", "username", "title", "bio")
+FILE_FIELDS = ("file_id", "file_unique_id")
+
+
+class UpdateRecorder:
+    """كتابة التحديثات الواردة بعد إخفاء البيانات الشخصية في ملف JSONL مضغوط
+
+    الأسماء والنصوص والبريد والأرقام ومعرفات الملفات تُستبدل بقيم ثابتة داخل نفس
+    التسجيل (نفس القيمة = نفس البديل) حتى تتصرف فحوصات التكرار بنفس الطريقة عند الإعادة.
+    معرفات المستخدمين وبيانات الأزرار والأوامر تبقى كما هي لتطابق نسخة مجلد البيانات.
+    الرسالة التالية لطلب كلمة المرور (secret_chats) تُستبدل كلها بغض النظر عن شكلها.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.salt = secrets.token_bytes(16)
+        self.run_id = f"{time.strftime('%H%M%S')}-{os.getpid()}"
+        self.secret_chats = set()
+        self.base = None
+        self.path = None
+        self.file = None
+        self.started = None
+        self.pending = 0
+        self.recorded = 0
+
+    def pseudonym(self, value, prefix="x"):
+        digest = hashlib.blake2s(value.encode(), key=self.salt, digest_size=6).hexdigest()
+        return f"{prefix}{digest}"
+
+    def scrub_digits(self, value):
+        digest = hashlib.blake2s(value.encode(), key=self.salt).digest()
+        digits = iter(str(byte % 10) for byte in digest * 4)
+        result = [next(digits) if char.isdigit() else char for char in value]
+        # أول رقم غير صفري يبقى غير صفري حتى تحتفظ المبالغ بعدد خاناتها
+        first = next((i for i, char in enumerate(value) if char.isdigit()), None)
+        if first is not None and value[first] != "0" and result[first] == "0":
+            result[first] = str(digest[0] % 9 + 1)
+        return "".join(result)
+
+    def scrub_text(self, text, secret=False):
+        text = text.strip()
+        if secret:
+            return self.pseudonym(text, "p")
+        if text.startswith("/"):
+            return text
+        if PHONE_LIKE.fullmatch(text):
+            return self.scrub_digits(text)
+        if EMAIL_PATTERN.fullmatch(text):
+            return f"{self.pseudonym(text.lower(), 'u')}@example.com"
+        return self.pseudonym(text, "t")
+
+    def expect_secret(self, chat_id):
+        """الرسالة النصية التالية من هذه المحادثة كلمة مرور"""
+        self.secret_chats.add(chat_id)
+
+    def scrub(self, obj, secret=False):
+        if isinstance(obj, list):
+            return [self.scrub(item, secret) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+        result = {}
+        for key, value in obj.items():
+            if key in NAME_FIELDS and isinstance(value, str):
+                result[key] = self.pseudonym(value, "n")
+            elif key in FILE_FIELDS and isinstance(value, str):
+                result[key] = self.pseudonym(value, "f")
+            elif key in ("text", "caption") and isinstance(value, str):
+                result[key] = self.scrub_text(value, secret)
+            elif key == "phone_number" and isinstance(value, str):
+                result[key] = self.scrub_digits(value)
+            elif key in ("entities", "caption_entities"):
+                # الإزاحات لم تعد صحيحة بعد تغيير النص، ما عدا الأمر في أول الرسالة
+                result[key] = [e for e in value if e.get("type") == "bot_command" and e.get("offset") == 0]
+            else:
+                result[key] = self.scrub(value, secret)
+        return result
+
+    def open_file(self):
+        base = Path(time.strftime(self.template))
+        if base == self.base:
+            return
+        self.close()
+        base.parent.mkdir(parents=True, exist_ok=True)
+        name, dot, suffix = base.name.partition(".")
+        self.base = base
+        self.path = base.with_name(f"{name}-{self.run_id}{dot}{suffix}")
+        self.file = gzip.open(self.path, "at", encoding="utf-8")
+        self.started = None
+        logger.info(f"تسجيل التحديثات في {self.path}")
+
+    def record(self, update):
+        if not isinstance(update, Update):
+            return
+        try:
+            self.open_file()
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            secret = False
+            if update.message and update.message.text and update.effective_chat:
+                secret = update.effective_chat.id in self.secret_chats
+                self.secret_chats.discard(update.effective_chat.id)
+            line = {"t": round(now - self.started, 3), "update": self.scrub(update.to_dict(), secret)}
+            # مفاتيح أزرار الموافقة عشوائية، فتُحفظ بياناتها لتجد أداة الإعادة المفتاح المقابل
+            if update.callback_query and update.callback_query.data:
+                _, arg = parse_callback(update.callback_query.data)
+                payload = ACTION_STATE.get(arg)
+                if payload is not None:
+                    line["action_state"] = payload
+            self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self.recorded += 1
+            self.pending += 1
+            if self.pending >= TRACE_FLUSH_EVERY:
+                self.file.flush()
+                self.pending = 0
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل التحديث: {e}")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.pending = 0
+
+UPDATE_RECORDER = UpdateRecorder(UPDATE_TRACE) if UPDATE_TRACE else None
+
+
+# ─── معالجة التحديثات بالتوازي مع الحفاظ على ترتيب كل مستخدم ──────────
+# تحديثات المستخدمين المختلفين تُنفذ بالتوازي (حتى UPDATE_CONCURRENCY)، أما
+# تحديثات نفس المستخدم (ومحادثاته الجارية) فتُنفذ بالترتيب واحداً تلو الآخر.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# الحد الأقصى للتحديثات المقبولة (قيد التنفيذ أو في الانتظار) قبل إيقاف أخذ المزيد من الطابور
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1024"))
+# سعة طابور تحديثات المكتبة، وعندما يمتلئ يتوقف الـ polling أو يتأخر رد الـ webhook
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "256"))
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """منفذ تحديثات متسلسل لكل مفتاح (المستخدم أو المحادثة) بحد عام للتوازي.
+
+    المكتبة تنشئ مهمة لكل تحديث تأخذه من update_queue قبل أن يصل إلى هنا، لذا الحد
+    الفعلي للتحديثات المقبولة (self.admission) يُطبق في UpdateQueue.get قبل أخذ التحديث،
+    والتنفيذ الفعلي محدود بـ self.slots.
+    """
+
+    def __init__(self, concurrency, max_pending):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.slots = None
+        self.admission = None
+        self.admitted = 0
+        self.queue = None
+        self.tails = {}
+        self.running = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.processed = 0
+
+    @staticmethod
+    def update_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def initialize(self):
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.admission = asyncio.Semaphore(self.max_pending)
+
+    async def admit(self):
+        """انتظار مكان لتحديث جديد (يُحرر عند انتهاء do_process_update)"""
+        await self.admission.acquire()
+        self.admitted += 1
+
+    def release_admission(self):
+        if self.admitted > 0:
+            self.admitted -= 1
+            self.admission.release()
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        # التسجيل هنا يحفظ ترتيب وصول التحديثات وتوقيتها قبل أي انتظار في الطابور
+        if UPDATE_RECORDER:
+            UPDATE_RECORDER.record(update)
+        arrived = time.perf_counter()
+        key = self.update_key(update)
+        previous = self.tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self.tails[key] = done
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = False
+        try:
+            if previous is not None:
+                # shield حتى لا يؤدي إلغاء هذا التحديث إلى إلغاء انتظار التحديثات التالية
+                await asyncio.shield(previous)
+            async with self.slots:
+                self.waiting -= 1
+                self.running += 1
+                started = True
+                METRICS.observe("updates", "queue_wait", time.perf_counter() - arrived)
+                handling = time.perf_counter()
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+                    METRICS.observe("updates", "handling", time.perf_counter() - handling)
+        finally:
+            if not started:
+                self.waiting -= 1
+                coroutine.close()
+            if not done.done():
+                done.set_result(None)
+            if key is not None and self.tails.get(key) is done:
+                del self.tails[key]
+            self.release_admission()
+
+    def snapshot(self):
+        """أرقام طابور التحديثات الحالية"""
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "active_keys": len(self.tails),
+            "queued": self.queue.qsize() if self.queue else 0,
+            "processed": self.processed
+        }
+
+class UpdateQueue(asyncio.Queue):
+    """update_queue للمكتبة بسعة محدودة: get لا يأخذ تحديثاً قبل أن يقبله المنفذ.
+
+    فعندما يصل المنفذ إلى MAX_PENDING_UPDATES تبقى التحديثات هنا، وعندما يمتلئ الطابور
+    ينتظر put في الـ Updater أو مستقبل الـ webhook فتبقى التحديثات عند تيليجرام.
+    """
+
+    def __init__(self, processor, maxsize):
+        super().__init__(maxsize)
+        self.processor = processor
+        processor.queue = self
+
+    async def get(self):
+        await self.processor.admit()
+        try:
+            item = await super().get()
+        except BaseException:
+            self.processor.release_admission()
+            raise
+        # إشارة الإيقاف في المكتبة (object() عادي) لا تصل إلى process_update فلا تُحرر مكانها هناك
+        if type(item) is object:
+            self.processor.release_admission()
+        return item
+
+UPDATE_PROCESSOR = KeyedUpdateProcessor(UPDATE_CONCURRENCY, MAX_PENDING_UPDATES)
+
+# ─── موجّه الأزرار ─────────────────────────────────────────────────
+# callback_data بصيغة "action" أو "action:arg"، ويتم التوجيه بالبحث في قاموس
+# بدل تجربة أنماط regex واحداً تلو الآخر، فلا يلتقط "deposit" زر "admin_special_deposit".
+CALLBACK_SEPARATOR = ":"
+# أزرار قديمة ما زالت موجودة في المحادثات بالصيغة السابقة (action_arg)
+LEGACY_CALLBACK = re.compile(r"^((?:approve|reject)_(?:deposit|withdrawal|assets)|bcast_seg|terms_page)_(.+)$")
+
+CALLBACK_DATA_LIMIT = 64  # حد تيليجرام بالبايت
+
+def pack_callback(action, arg=None):
+    """بناء callback_data بالصيغة المهيكلة"""
+    data = action if arg is None else f"{action}{CALLBACK_SEPARATOR}{arg}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data أطول من {CALLBACK_DATA_LIMIT} بايت: {data}")
+    return data
+
+def parse_callback(data):
+    """تقسيم callback_data إلى (action, arg)"""
+    action, separator, arg = data.partition(CALLBACK_SEPARATOR)
+    if separator:
+        return action, arg
+    legacy = LEGACY_CALLBACK.match(data)
+    if legacy:
+        return legacy.group(1), legacy.group(2)
+    return data, None
+
+class CallbackRouter(CallbackQueryHandler):
+    """معالج أزرار واحد يختار الدالة من جدول {action: callback}"""
+
+    def __init__(self, routes, block=True):
+        super().__init__(self.dispatch, block=block)
+        self.routes = dict(routes)
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        return self.routes.get(parse_callback(data)[0])
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        return await check_result(update, context)
+
+    async def dispatch(self, update, context):
+        return await self.check_update(update)(update, context)
+
+# ─── بيانات الأزرار على الخادم ─────────────────────────────────────
+# الزر يحمل "action:key" فقط، والبيانات الكاملة (معرف الطلب، المبلغ...) محفوظة هنا
+# حتى تنتهي صلاحيتها، فلا نحتاج لتحليل نصوص ولا تتراكم المفاتيح القديمة.
+CALLBACK_STATE_FILE = DATA_DIR / "callback_state.json"
+CALLBACK_STATE_TTL = int(os.getenv("CALLBACK_STATE_TTL_DAYS", "30")) * 24 * 60 * 60
+
+class ActionStore:
+    """تخزين بيانات الأزرار بمفاتيح قصيرة ومهلة انتهاء"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.entries = None
+
+    def _ensure_loaded(self):
+        if self.entries is None:
+            self.entries = load_data(self.path, {})
+            self.purge()
+
+    def put(self, payload, ttl=None):
+        """حفظ البيانات وإرجاع مفتاح قصير يوضع في callback_data"""
+        self._ensure_loaded()
+        self.purge(save=False)
+        key = secrets.token_urlsafe(6)
+        while key in self.entries:
+            key = secrets.token_urlsafe(6)
+        self.entries[key] = {
+            "payload": payload,
+            "expires": int(time.time()) + (self.ttl if ttl is None else ttl)
+        }
+        save_data(self.path, self.entries)
+        return key
+
+    def get(self, key):
+        """البيانات المرتبطة بالمفتاح، أو None إذا انتهت صلاحيتها أو لم تكن موجودة"""
+        self._ensure_loaded()
+        entry = self.entries.get(key) if key else None
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry["payload"]
+
+    def discard(self, key):
+        """إلغاء المفتاح بعد تنفيذ الإجراء حتى تصبح باقي أزرار الرسالة منتهية"""
+        self._ensure_loaded()
+        if self.entries.pop(key, None) is not None:
+            save_data(self.path, self.entries)
+
+    def purge(self, save=True):
+        """حذف المفاتيح المنتهية"""
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if entry["expires"] < now]
+        for key in expired:
+            del self.entries[key]
+        if expired and save:
+            save_data(self.path, self.entries)
+        return len(expired)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.entries)
+
+ACTION_STATE = ActionStore(CALLBACK_STATE_FILE, CALLBACK_STATE_TTL)
+
+def approval_markup(request_type, payload):
+    """أزرار موافقة/رفض تشترك في مفتاح واحد لبيانات الطلب"""
+    key = ACTION_STATE.put(payload)
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ موافقة", callback_data=pack_callback(f"approve_{request_type}", key))],
+        [InlineKeyboardButton("❌ رفض", callback_data=pack_callback(f"reject_{request_type}", key))]
+    ])
+
+# ─── ذاكرة مؤقتة لأزرار القوائم ──────────────────────────────────
+# الأزرار لا تتغير إلا حسب نوع الحساب، فتُبنى مرة لكل مفتاح ويُعاد استخدامها
+MARKUP_CACHE = {}
+
+def cached_markup(key, build_keyboard):
+    """إرجاع InlineKeyboardMarkup مبني مرة واحدة لكل مفتاح"""
+    markup = MARKUP_CACHE.get(key)
+    if markup is None:
+        markup = MARKUP_CACHE[key] = InlineKeyboardMarkup(build_keyboard())
+    return markup
+
+# ─── الصفحات الثابتة (تُجهز مرة واحدة عند التشغيل) ──────────────────────
+CONTRACT_PAGE_CHARS = 1500
+ARTICLE_BOUNDARY = r"\n\s*-{3,}\s*\n"
+PARAGRAPH_BOUNDARY = r"\n\s*\n"
+LINE_BOUNDARY = r"\n"
+
+def static_page(text, keyboard, parse_mode=ParseMode.HTML):
+    """صفحة جاهزة للإرسال: reply_text(**page) أو edit_message_text(**page)"""
+    return {"text": text, "reply_markup": InlineKeyboardMarkup(keyboard), "parse_mode": parse_mode}
+
+def build_static_pages():
+    """تجهيز نصوص وأزرار الصفحات الثابتة"""
+    pages = {}
+
+    message = (
+        "🔒 <b>معلومات تخزين البيانات</b>\n\n"
+        "🛡️ <b>الأمان والخصوصية:</b>\n"
+        "• جميع بياناتك مشفرة بالكامل\n"
+        "• حتى الموظفين في Asser Platform لا يمكنهم رؤية بياناتك\n"
+        "• الشخص الوحيد الذي يمكنه رؤية بياناتك هو المالك\n\n"
+        "🔑 <b>ماذا يحدث إذا نسيت كلمة السر أو البريد الإلكتروني؟</b>\n\n"
+        "👑 <b>للعملاء المميزين:</b>\n"
+        "• اتصل بالمالك بشكل مباشر\n"
+        "• سيتصل بك أحد أفراد خدمة العملاء عبر رقم خط أرضي\n"
+        "• ⚠️ لن يتصل بك فرد خدمة العملاء من رقم موبايل إطلاقاً\n"
+        "• سيسألك أسئلة أمان تخص الحساب وعمليات التحويل\n"
+        "• عند التأكد من أنك مالك الحساب بنفسك\n"
+        "• سيتم إرسال لك ملف PDF بكلمة سر لا يعرفها غير المستخدم والمالك فقط\n\n"
+        "👤 <b>للمستخدمين العاديين:</b>\n"
+        "• نفس الخطوات ولكن عبر خدمة العملاء عبر الواتساب\n"
+        "• نفس إجراءات الأمان والتحقق"
+    )
+    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="back_to_start")]]
+    pages["data_storage_info"] = static_page(message, keyboard)
+
+    message = (
+        "📖 <b>كيفية العمل على المواقع</b>\n\n"
+        "🔸 <b>الخطوة الأولى:</b> سجل في المواقع المتاحة\n"
+        "🔸 <b>الخطوة الثانية:</b> اكمل المهام المطلوبة\n"
+        "🔸 <b>الخطوة الثالثة:</b> اجمع أرباحك\n"
+        "🔸 <b>الخطوة الرابعة:</b> استخدم خاصية 'سحب الأصول' لتحويل أرباحك إلى منصة Asser Platform\n\n"
+        "💡 <b>نصائح مهمة:</b>\n"
+        "• تأكد من إتمام المهام بشكل صحيح\n"
+        "• احرص على متابعة أرباحك يومياً\n"
+        "• استخدم روابط الدعوة المتاحة لزيادة الأرباح"
+    )
+    keyboard = [
+        [InlineKeyboardButton("🔙 العودة لقسم العمل", callback_data="work_sites")]
+    ]
+    pages["how_to_work"] = static_page(message, keyboard)
+
+    message = (
+        "💡 <b>كيفية الربح من دعوة الأصدقاء</b>\n\n"
+        "🎯 <b>من العمل على المواقع:</b>\n"
+        "عن طريق العمل على المواقع من أعضاء فريقك ستحصل أنت على 20% إحالة\n\n"
+        "📈 <b>من التقديم على الشهادات:</b>\n"
+        "على التقديم على شهادة ستحصل على 10% من أرباح صديقك\n\n"
+        "⚠️ <b>ملاحظة مهمة:</b>\n"
+        "المبلغ الذي صديقك قام بإيداعه لا يتم خصم أي شيء منه، هو للعمل فقط ولا يخص ذلك\n\n"
+        "💰 <b>مثال:</b>\n"
+        "إذا قام صديقك بربح شهرياً 1000 EGP ستحصل على 200 EGP"
+    )
+    keyboard = [
+        [InlineKeyboardButton("🔙 العودة لدعوة الأصدقاء", callback_data="invite_friends")],
+        [InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="back_to_main")]
+    ]
+    pages["referral_earnings"] = static_page(message, keyboard)
+
+    message = (
+        "📱 <b>تابعنا على مواقع التواصل الاجتماعي</b>\n\n"
+        "اختر المنصة التي تريد زيارتها:"
+    )
+    keyboard = [
+        [InlineKeyboardButton("📱 Telegram", url="https://t.me/Asser_Platform")],
+        [InlineKeyboardButton("🎥 YouTube", url="https://www.youtube.com/@Asser-Platform")],
+        [InlineKeyboardButton("🎵 TikTok", url="https://tiktok.com/@asser_platform")],
+        [InlineKeyboardButton("📷 Instagram", callback_data="instagram_soon")],
+        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
+    ]
+    pages["social_media"] = static_page(message, keyboard)
+
+    return pages
+
+def split_paragraphs(text, limit, boundaries=(ARTICLE_BOUNDARY, PARAGRAPH_BOUNDARY, LINE_BOUNDARY)):
+    """تقسيم النص إلى أجزاء لا تتجاوز limit حرفاً عند حدود المواد ثم الفقرات ثم الأسطر"""
+    parts = []
+    current = ""
+    for block in re.split(boundaries[0], text.strip()):
+        block = block.strip()
+        if not block:
+            continue
+        if len(block) <= limit:
+            pieces = [block]
+        elif len(boundaries) > 1:
+            pieces = split_paragraphs(block, limit, boundaries[1:])
+        else:
+            pieces = [block[i:i + limit] for i in range(0, len(block), limit)]
+
+        for piece in pieces:
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                if current:
+                    parts.append(current)
+                current = piece
+    if current:
+        parts.append(current)
+    return parts
+
+def build_contract_pages():
+    """صفحات عقد الاستخدام مع أزرار التنقل، تُعرض كلها في رسالة واحدة يتم تعديلها"""
+    parts = split_paragraphs(CONTRACT_TEXT, CONTRACT_PAGE_CHARS)
+    pages = []
+    for i, part in enumerate(parts):
+        navigation = []
+        if i > 0:
+            navigation.append(InlineKeyboardButton("◀️ السابق", callback_data=pack_callback("terms_page", i - 1)))
+        if i < len(parts) - 1:
+            navigation.append(InlineKeyboardButton("التالي ▶️", callback_data=pack_callback("terms_page", i + 1)))
+
+        keyboard = [navigation] if navigation else []
+        if i == len(parts) - 1:
+            keyboard.append([InlineKeyboardButton("موافــــق ✅", callback_data="accept_terms")])
+        keyboard.append([InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")])
+
+        text = f"📋 عقد الاستخدام ({i + 1}/{len(parts)})\n\n{part}"
+        pages.append(static_page(text, keyboard, parse_mode=None))
+    return pages
+
+STATIC_PAGES = build_static_pages()
+CONTRACT_PAGES = build_contract_pages()
+
 # ─── نظام الدفع التلقائي للشهادات ─────────────────────────────────────
 async def process_automatic_payouts(context=None):
     """معالجة الأرباح التلقائية لجميع المستخدمين"""
+    started = time.perf_counter()
     users = load_data(USERS_FILE, {})
     current_time = time.time()
+    log_payouts = PAYOUT_LOGGER.isEnabledFor(logging.INFO)
+    paid_count = 0
+    paid_total = 0.0
     
     for uid, user_data in users.items():
         if "plans" not in user_data or user_data.get("banned", False):
@@ -339,8 +2469,15 @@ async def process_automatic_payouts(context=None):
                 # تحديث وقت آخر دفع
                 plan["last_payout"] = last_payout + (num_payouts * payout_interval)
                 
-                logger.info(f"تم دفع {profit_amount:.2f} EGP للمستخدم {uid} من خطة {plan_type}")
-        
+                if log_payouts:
+                    PAYOUT_LOGGER.info("تم دفع %.2f EGP للمستخدم %s من خطة %s", profit_amount, uid, plan_type)
+                METRICS.count("payouts", plan_type)
+                paid_count += 1
+                paid_total += profit_amount
+
+        if total_profit_added > 0:
+            SEGMENTS.update_user(uid, user_data)
+
         # إرسال إشعار للمستخدم في حالة إضافة أرباح
         if total_profit_added > 0 and context:
             try:
@@ -374,15 +2511,23 @@ async def process_automatic_payouts(context=None):
                     f"💙 شكراً لثقتك في Asser Platform"
                 )
                 
-                await context.bot.send_message(
-                    chat_id=int(uid),
+                OUTBOX.enqueue(
+                    int(uid),
                     text=profit_message,
-                    parse_mode=ParseMode.HTML
+                    parse_mode=ParseMode.HTML,
+                    save=False
                 )
             except Exception as e:
                 logger.error(f"فشل في إرسال إشعار الأرباح للمستخدم {uid}: {e}")
     
     save_data(USERS_FILE, users)
+    OUTBOX.save()
+    elapsed = time.perf_counter() - started
+    METRICS.observe("jobs", "process_automatic_payouts", elapsed)
+    if paid_count:
+        # ملخص واحد لكل دورة حتى مع تقليل أو إيقاف تفاصيل كل دفعة
+        logger.info("الأرباح: %d دفعة بإجمالي %.2f EGP في %.0f ms", paid_count, paid_total, elapsed * 1000,
+                    extra={"payouts": paid_count, "amount": round(paid_total, 2)})
 
 # ─── دوال التسجيل المحسنة ─────────────────────────────────────────────
 async def check_user_ban(uid, update, context):
@@ -439,12 +2584,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if inviter_id and inviter_id in users:
         context.user_data["inviter_id"] = inviter_id
 
-    keyboard = [
+    reply_markup = cached_markup("start", lambda: [
         [InlineKeyboardButton("👤 تسجيل مستخدم جديد", callback_data="new_register")],
         [InlineKeyboardButton("🔑 تسجيل الدخول", callback_data="login")],
         [InlineKeyboardButton("📋 معلومات تخزين البيانات", callback_data="data_storage_info")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     welcome_text = (
         "أهلاً وسهلاً بك في Asser Platform! 🎉\n\n"
@@ -474,40 +2618,12 @@ async def handle_start_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
         return ConversationHandler.END
 
 async def show_data_storage_info(update, context):
-    message = (
-        "🔒 <b>معلومات تخزين البيانات</b>\n\n"
-        "🛡️ <b>الأمان والخصوصية:</b>\n"
-        "• جميع بياناتك مشفرة بالكامل\n"
-        "• حتى الموظفين في Asser Platform لا يمكنهم رؤية بياناتك\n"
-        "• الشخص الوحيد الذي يمكنه رؤية بياناتك هو المالك\n\n"
-        "🔑 <b>ماذا يحدث إذا نسيت كلمة السر أو البريد الإلكتروني؟</b>\n\n"
-        "👑 <b>للعملاء المميزين:</b>\n"
-        "• اتصل بالمالك بشكل مباشر\n"
-        "• سيتصل بك أحد أفراد خدمة العملاء عبر رقم خط أرضي\n"
-        "• ⚠️ لن يتصل بك فرد خدمة العملاء من رقم موبايل إطلاقاً\n"
-        "• سيسألك أسئلة أمان تخص الحساب وعمليات التحويل\n"
-        "• عند التأكد من أنك مالك الحساب بنفسك\n"
-        "• سيتم إرسال لك ملف PDF بكلمة سر لا يعرفها غير المستخدم والمالك فقط\n\n"
-        "👤 <b>للمستخدمين العاديين:</b>\n"
-        "• نفس الخطوات ولكن عبر خدمة العملاء عبر الواتساب\n"
-        "• نفس إجراءات الأمان والتحقق"
-    )
-
-    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="back_to_start")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    page = STATIC_PAGES["data_storage_info"]
 
     if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.edit_message_text(
-            message, 
-            reply_markup=reply_markup, 
-            parse_mode=ParseMode.HTML
-        )
+        await update.callback_query.edit_message_text(**page)
     else:
-        await update.message.reply_text(
-            message, 
-            reply_markup=reply_markup, 
-            parse_mode=ParseMode.HTML
-        )
+        await update.message.reply_text(**page)
 
 async def back_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -562,6 +2678,8 @@ async def reg_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return REG_EMAIL
 
     context.user_data["email"] = email
+    if UPDATE_RECORDER:
+        UPDATE_RECORDER.expect_secret(update.effective_chat.id)
     await update.message.reply_text("🔒 اختر كلمة مرور:")
     return REG_PASS
 
@@ -609,6 +2727,9 @@ async def reg_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         users[context.user_data["inviter_id"]]["team_count"] = users[context.user_data["inviter_id"]].get("team_count", 0) + 1
 
     save_data(USERS_FILE, users)
+    SEGMENTS.update_user(uid, users[uid])
+    if context.user_data.get("inviter_id") in users:
+        SEGMENTS.update_user(context.user_data["inviter_id"], users[context.user_data["inviter_id"]])
 
     await update.message.reply_text("✅ تم إنشاء حسابك بنجاح!")
     await show_main_menu(update, context)
@@ -618,6 +2739,8 @@ async def reg_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def login_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     email = update.message.text.strip()
     context.user_data["login_email"] = email
+    if UPDATE_RECORDER:
+        UPDATE_RECORDER.expect_secret(update.effective_chat.id)
     await update.message.reply_text("🔒 أدخل كلمة المرور:")
     return LOGIN_PASSWORD
 
@@ -656,21 +2779,9 @@ async def login_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ معلومات تسجيل الدخول غير صحيحة!")
     return ConversationHandler.END
 
-async def show_main_menu(update, context):
-    """عرض القائمة الرئيسية للبوت"""
-    uid = str(update.effective_user.id)
-    
-    # فحص الحظر
-    if await check_user_ban(uid, update, context):
-        return
-    
-    await process_automatic_payouts(context)
-    
-    users = load_data(USERS_FILE, {})
-
-    is_premium = users.get(uid, {}).get("premium", False)
+def main_menu_keyboard(is_premium, is_admin):
+    """بناء أزرار القائمة الرئيسية حسب نوع الحساب"""
     premium_icon = "👑" if is_premium else ""
-
     keyboard = [
         [InlineKeyboardButton(f"{premium_icon} بياناتك", callback_data="profile")],
         [InlineKeyboardButton("💰 أرصدتك", callback_data="balance")],
@@ -687,10 +2798,28 @@ async def show_main_menu(update, context):
     if not is_premium:
         keyboard.insert(-3, [InlineKeyboardButton("👑 كيف تصبح حساب مميز؟", callback_data="premium_info")])
 
-    if uid == str(ADMIN_IDS[0]):
+    if is_admin:
         keyboard.append([InlineKeyboardButton("🔧 لوحة الأدمن", callback_data="admin_panel")])
+    return keyboard
+
+async def show_main_menu(update, context):
+    """عرض القائمة الرئيسية للبوت"""
+    uid = str(update.effective_user.id)
+    
+    # فحص الحظر
+    if await check_user_ban(uid, update, context):
+        return
+    
+    await process_automatic_payouts(context)
+    
+    users = load_data(USERS_FILE, {})
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    is_premium = users.get(uid, {}).get("premium", False)
+    premium_icon = "👑" if is_premium else ""
+    is_admin = uid == str(ADMIN_IDS[0])
+
+    reply_markup = cached_markup(("main_menu", is_premium, is_admin),
+                                 lambda: main_menu_keyboard(is_premium, is_admin))
     welcome_text = f"مرحبًا بك في Asser Platform! {premium_icon}\n\nاختر ما تريد:"
 
     if hasattr(update, 'callback_query') and update.callback_query:
@@ -700,15 +2829,14 @@ async def show_main_menu(update, context):
 
 # ─── قسم العمل المحدث ────────────────────────────────────────────
 async def show_work_sites(update, context):
-    keyboard = [
+    reply_markup = cached_markup("show_work_sites", lambda: [
         [InlineKeyboardButton("📖 كيفية العمل", callback_data="how_to_work")],
         [InlineKeyboardButton("🌐 VKserfing", url="https://vkserfing.ru/?ref=551025727")],
         [InlineKeyboardButton("🚀 SMM Fast", url="https://fastsmm.ru/u/256485")],
         [InlineKeyboardButton("🎵 Asser Platform", url="https://taskpay.ru/?ref=4041472")],
         [InlineKeyboardButton("💰 سحب الأصول", callback_data="assets_withdrawal")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     message = (
         "💼 <b>العمل على المواقع الخارجية</b>\n\n"
@@ -722,28 +2850,7 @@ async def show_work_sites(update, context):
     )
 
 async def show_how_to_work(update, context):
-    message = (
-        "📖 <b>كيفية العمل على المواقع</b>\n\n"
-        "🔸 <b>الخطوة الأولى:</b> سجل في المواقع المتاحة\n"
-        "🔸 <b>الخطوة الثانية:</b> اكمل المهام المطلوبة\n"
-        "🔸 <b>الخطوة الثالثة:</b> اجمع أرباحك\n"
-        "🔸 <b>الخطوة الرابعة:</b> استخدم خاصية 'سحب الأصول' لتحويل أرباحك إلى منصة Asser Platform\n\n"
-        "💡 <b>نصائح مهمة:</b>\n"
-        "• تأكد من إتمام المهام بشكل صحيح\n"
-        "• احرص على متابعة أرباحك يومياً\n"
-        "• استخدم روابط الدعوة المتاحة لزيادة الأرباح"
-    )
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 العودة لقسم العمل", callback_data="work_sites")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.callback_query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.HTML
-    )
+    await update.callback_query.edit_message_text(**STATIC_PAGES["how_to_work"])
 
 async def start_assets_withdrawal(update, context):
     uid = str(update.callback_query.from_user.id)
@@ -754,9 +2861,9 @@ async def start_assets_withdrawal(update, context):
 
     context.user_data["is_assets_withdrawal"] = True
 
-    keyboard = [
+    reply_markup = cached_markup("start_assets_withdrawal", lambda: [
         [InlineKeyboardButton("🔙 العودة لقسم العمل", callback_data="work_sites")]
-    ]
+    ])
 
     message = (
         "🎉 <b>احنا مبسوطين انك وصلت لهنا!</b>\n\n"
@@ -770,7 +2877,7 @@ async def start_assets_withdrawal(update, context):
 
     await update.callback_query.edit_message_text(
         message,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=reply_markup,
         parse_mode=ParseMode.HTML
     )
     return DEP_SCREENSHOT
@@ -783,12 +2890,12 @@ async def start_deposit(update, context):
     if await check_user_ban(uid, update, context):
         return ConversationHandler.END
 
-    keyboard = [
+    reply_markup = cached_markup("currency_choice", lambda: [
         [InlineKeyboardButton("💵 EGP", callback_data="EGP")],
         [InlineKeyboardButton("💲 USDT", callback_data="USDT")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    await update.callback_query.edit_message_text("اختر العملة:", reply_markup=InlineKeyboardMarkup(keyboard))
+    ])
+    await update.callback_query.edit_message_text("اختر العملة:", reply_markup=reply_markup)
     return DEP_CURR
 
 async def dep_curr(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -831,12 +2938,11 @@ async def dep_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     curr = context.user_data["curr"]
 
     if curr == "EGP":
-        keyboard = [
+        reply_markup = cached_markup("dep_amount", lambda: [
             [InlineKeyboardButton("📱 محفظة إلكترونية", callback_data="wallet")],
             [InlineKeyboardButton("💳 انستاباي (قريباً)", callback_data="instapay_soon")],
             [InlineKeyboardButton("🏦 تحويل بنكي (قريباً)", callback_data="bank_soon")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        ])
         await update.message.reply_text("اختر طريقة الدفع:", reply_markup=reply_markup)
         return DEP_METHOD
     else:
@@ -866,16 +2972,35 @@ async def dep_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return DEP_SCREENSHOT
 
     uid = str(update.effective_user.id)
+    photo = update.message.photo[-1]
+
+    if photo.file_size and photo.file_size > MAX_SCREENSHOT_BYTES:
+        await update.message.reply_text("⚠️ حجم الصورة كبير جداً، يرجى إرسال لقطة شاشة أصغر.")
+        return DEP_SCREENSHOT
+
+    if not DOWNLOADS.try_reserve(uid):
+        await update.message.reply_text("⏳ يتم الآن معالجة لقطات شاشة سابقة لك، يرجى المحاولة بعد قليل.")
+        return DEP_SCREENSHOT
+
+    try:
+        return await submit_screenshot(update, context, uid, photo)
+    except BaseException:
+        # الحجز يُحرر عادةً بعد انتهاء التحميل في الخلفية
+        DOWNLOADS.release(uid)
+        raise
+
+async def submit_screenshot(update, context, uid, photo):
+    """تسجيل الطلب وإشعار الأدمن والمستخدم، ثم جدولة التحميل في الخلفية"""
     users = load_data(USERS_FILE, {})
 
     is_assets_withdrawal = context.user_data.get("is_assets_withdrawal", False)
 
-    photo_file = await update.message.photo[-1].get_file()
-    if is_assets_withdrawal:
-        photo_path = f"data/assets_withdrawal_{uid}_{int(time.time())}.jpg"
-    else:
-        photo_path = f"data/deposit_{uid}_{int(time.time())}.jpg"
-    await photo_file.download_to_drive(photo_path)
+    # نستخدم file_id الخاص بالصورة لإرسالها للأدمن دون إعادة رفعها،
+    # ونحفظ النسخة المحلية في الخلفية بعد الرد على المستخدم
+    photo_file_id = photo.file_id
+    request_id = None
+    caption = None
+    reply_markup = None
 
     if is_assets_withdrawal:
         if ADMIN_IDS:
@@ -894,23 +3019,7 @@ async def dep_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"💰 <b>نوع الطلب:</b> سحب أصول من العمل الخارجي"
             )
 
-            keyboard = [
-                [InlineKeyboardButton("✅ موافقة", callback_data=f"approve_assets_{uid}")],
-                [InlineKeyboardButton("❌ رفض", callback_data=f"reject_assets_{uid}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_photo(
-                        chat_id=admin_id,
-                        photo=open(photo_path, 'rb'),
-                        caption=caption,
-                        reply_markup=reply_markup,
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الأدمن: {e}")
+            reply_markup = approval_markup("assets", {"uid": uid})
 
         success_message = (
             "✅ <b>تم إرسال طلب سحب الأصول بنجاح!</b>\n\n"
@@ -925,14 +3034,19 @@ async def dep_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• تحويل بنكي 🏦\n\n"
             "شكراً لك على استخدام Asser Platform! 💙"
         )
-        await update.message.reply_text(success_message, parse_mode=ParseMode.HTML)
+        admin_messages, _ = await asyncio.gather(
+            notify_admins_photo(context.bot, photo_file_id, caption, reply_markup),
+            update.message.reply_text(success_message, parse_mode=ParseMode.HTML)
+        )
 
     else:
         curr = context.user_data["curr"]
         amount = context.user_data["amount"]
 
         pend = load_data(PEND_DEP, [], ensure_list=True)  
+        request_id = next_request_id()
         req = {  
+            "id": request_id,
             "uid": uid,
             "currency": curr,  
             "amount": amount,  
@@ -940,7 +3054,9 @@ async def dep_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "user_name": context.user_data.get("name", users.get(uid, {}).get("name", "غير معروف")),
             "user_phone": context.user_data.get("phone", users.get(uid, {}).get("phone", "غير معروف")),
             "status": "pending",
-            "screenshot_path": photo_path,
+            "screenshot_path": None,
+            "screenshot_sha256": None,
+            "screenshot_file_id": photo_file_id,
             "type": "normal"
         }  
 
@@ -958,28 +3074,102 @@ async def dep_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"📅 الوقت: {time.strftime('%Y-%m-%d %H:%M:%S')}"
             )
 
-            keyboard = [
-                [InlineKeyboardButton("✅ موافقة", callback_data=f"approve_deposit_{len(pend)-1}")],
-                [InlineKeyboardButton("❌ رفض", callback_data=f"reject_deposit_{len(pend)-1}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_photo(
-                        chat_id=admin_id,
-                        photo=open(photo_path, 'rb'),
-                        caption=caption,
-                        reply_markup=reply_markup,
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الأدمن: {e}")
+            reply_markup = approval_markup("deposit", {"request_id": request_id})
 
-        await update.message.reply_text("✅ تم إرسال طلب الإيداع بنجاح! سيتم مراجعته قريباً.")
+        admin_messages, _ = await asyncio.gather(
+            notify_admins_photo(context.bot, photo_file_id, caption, reply_markup),
+            update.message.reply_text("✅ تم إرسال طلب الإيداع بنجاح! سيتم مراجعته قريباً.")
+        )
 
+    context.application.create_task(
+        save_screenshot(context.bot, photo_file_id, request_id, uid, admin_messages)
+    )
     return ConversationHandler.END
 
+async def notify_admins_photo(bot, photo_file_id, caption, reply_markup):
+    """إرسال صورة الطلب لكل الأدمن بالتوازي باستخدام file_id (بدون إعادة رفع)"""
+    if not ADMIN_IDS or caption is None:
+        return []
+    results = await asyncio.gather(
+        *(
+            bot.send_photo(
+                chat_id=admin_id,
+                photo=photo_file_id,
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.HTML
+            )
+            for admin_id in ADMIN_IDS
+        ),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"فشل في إرسال إشعار الأدمن: {result}")
+    return [result for result in results if not isinstance(result, Exception)]
+
+async def save_screenshot(bot, photo_file_id, request_id, uid, admin_messages):
+    """حفظ نسخة محلية من لقطة الشاشة في مخزن الـ hash في الخلفية وربطها بالطلب،
+    ثم تنبيه الأدمن إذا كانت مشابهة للقطة شاشة سابقة"""
+    try:
+        digest = await DOWNLOADS.download(bot, photo_file_id, uid)
+    except Exception as e:
+        logger.error(f"فشل في حفظ لقطة الشاشة للطلب {request_id}: {e}")
+        return
+
+    # الملف مثبت حتى انتهاء فحص التكرار، فلا تحذفه الصيانة إذا تم تحرير مرجعه قبل ذلك
+    SCREENSHOTS.pin(digest)
+    try:
+        match = await link_screenshot(request_id, uid, digest)
+    finally:
+        SCREENSHOTS.unpin(digest)
+    if match:
+        await annotate_admin_messages(bot, admin_messages, duplicate_note(match))
+
+async def link_screenshot(request_id, uid, digest):
+    """ربط الملف بطلبه (أو بسجل إثبات لسحب الأصول) وإرجاع لقطة الشاشة المشابهة إن وجدت"""
+    if request_id is None:
+        # طلبات سحب الأصول ليس لها سجل معلق، فيُحفظ الإثبات مع الطلبات المنتهية حتى يُؤرشف
+        settled = load_data(SETTLED_DEP, [], ensure_list=True)
+        settled.append(screenshot_evidence("assets_withdrawal", uid, digest, int(time.time())))
+        save_data(SETTLED_DEP, settled)
+    elif not attach_screenshot(request_id, digest):
+        SCREENSHOTS.decref(digest)
+
+    return await check_duplicate_screenshot(SCREENSHOTS.path(digest), request_id, uid, digest)
+
+async def annotate_admin_messages(bot, admin_messages, note):
+    """إضافة ملاحظة لتعليق صورة الطلب عند الأدمن مع الإبقاء على أزرار الموافقة"""
+    for message in admin_messages:
+        try:
+            await bot.edit_message_caption(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                caption=f"{message.caption_html}\n\n{note}",
+                reply_markup=message.reply_markup,
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e:
+            logger.error(f"فشل في تعديل إشعار الأدمن: {e}")
+
+def attach_screenshot(request_id, digest):
+    """ربط hash لقطة الشاشة بطلب الإيداع (المعلق، أو المنتهي إذا تمت مراجعته قبل اكتمال التحميل)"""
+    for path in (PEND_DEP, SETTLED_DEP):
+        records = load_data(path, [], ensure_list=True)
+        for req in records:
+            if req.get("id") == request_id:
+                req["screenshot_sha256"] = digest
+                req["screenshot_path"] = str(SCREENSHOTS.path(digest))
+                save_data(path, records)
+                return True
+    return False
+
+def settle_deposit(deposit_request, status):
+    """نقل طلب الإيداع لسجل الطلبات المنتهية، ويبقى مرجع لقطة الشاشة معه حتى الأرشفة"""
+    settled = load_data(SETTLED_DEP, [], ensure_list=True)
+    settled.append({**deposit_request, "status": status, "settled_time": int(time.time())})
+    save_data(SETTLED_DEP, settled)
+
 # ─── دالة بدء السحب المحدثة ────────────────────────────────────────────
 async def start_withdraw(update, context):
     uid = str(update.callback_query.from_user.id)
@@ -988,12 +3178,12 @@ async def start_withdraw(update, context):
     if await check_user_ban(uid, update, context):
         return ConversationHandler.END
 
-    keyboard = [
+    reply_markup = cached_markup("currency_choice", lambda: [
         [InlineKeyboardButton("💵 EGP", callback_data="EGP")],
         [InlineKeyboardButton("💲 USDT", callback_data="USDT")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    await update.callback_query.edit_message_text("عملة السحب:", reply_markup=InlineKeyboardMarkup(keyboard))
+    ])
+    await update.callback_query.edit_message_text("عملة السحب:", reply_markup=reply_markup)
     return WDR_CURR
 
 async def wdr_curr(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1007,12 +3197,11 @@ async def wdr_curr(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["wc"] = query.data
 
     if query.data == "EGP":
-        keyboard = [
+        reply_markup = cached_markup("wdr_curr", lambda: [
             [InlineKeyboardButton("📱 محفظة إلكترونية", callback_data="wallet")],
             [InlineKeyboardButton("💳 انستاباي (قريباً)", callback_data="instapay_soon")],
             [InlineKeyboardButton("🏦 تحويل بنكي (قريباً)", callback_data="bank_soon")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        ])
         await query.edit_message_text("اختر طريقة السحب:", reply_markup=reply_markup)
         return WDR_METHOD
     else:
@@ -1056,9 +3245,11 @@ async def wdr_amt(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     users[uid]["balance"][currency] -= amt  
     save_data(USERS_FILE, users)  
+    SEGMENTS.update_user(uid, users[uid])
 
     pend = load_data(PEND_WDR, [], ensure_list=True)  
     wdr_request = {  
+        "id": next_request_id(),
         "uid": uid,  
         "currency": currency,  
         "amount": net,
@@ -1082,11 +3273,7 @@ async def wdr_amt(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📅 الوقت: {time.strftime('%Y-%m-%d %H:%M:%S')}"
         )
 
-        keyboard = [
-            [InlineKeyboardButton("✅ موافقة", callback_data=f"approve_withdrawal_{len(pend)-1}")],
-            [InlineKeyboardButton("❌ رفض", callback_data=f"reject_withdrawal_{len(pend)-1}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = approval_markup("withdrawal", {"request_id": wdr_request["id"]})
 
         for admin_id in ADMIN_IDS:
             try:
@@ -1116,7 +3303,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ ليس لديك صلاحيات الوصول لهذا الأمر.")
         return ConversationHandler.END
 
-    keyboard = [
+    reply_markup = cached_markup("admin_panel", lambda: [
         [InlineKeyboardButton("💰 إرسال أموال لمستخدم", callback_data="admin_send_money")],
         [InlineKeyboardButton("4️⃣ إيداع خاص", callback_data="admin_special_deposit")],
         [InlineKeyboardButton("🚫 حظر/فك حظر مستخدم", callback_data="admin_ban")],
@@ -1127,8 +3314,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("👑 إدارة الحساب المميز", callback_data="admin_premium")],
         [InlineKeyboardButton("📨 إرسال إشعار عام", callback_data="admin_broadcast")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await query.edit_message_text(
         "👑 <b>لوحة تحكم الأدمن الرئيسي</b>\n\n"
@@ -1174,12 +3360,11 @@ async def admin_ban(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    keyboard = [
+    reply_markup = cached_markup("admin_ban", lambda: [
         [InlineKeyboardButton("🚫 حظر مستخدم", callback_data="ban_user")],
         [InlineKeyboardButton("✅ فك حظر مستخدم", callback_data="unban_user")],
         [InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await query.edit_message_text(
         "🚫 <b>إدارة حظر المستخدمين</b>\n\n"
@@ -1221,12 +3406,11 @@ async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⚠️ هذا المستخدم محظور بالفعل!")
             return ConversationHandler.END
 
-        keyboard = [
+        reply_markup = cached_markup("admin_ban_user", lambda: [
             [InlineKeyboardButton("💼 عملية احتيال", callback_data="fraud")],
             [InlineKeyboardButton("⏰ مؤقت حتى الموافقة على العقد", callback_data="contract_pending")],
             [InlineKeyboardButton("✏️ أخرى (كتابة يدوية)", callback_data="custom_reason")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        ])
 
         await update.message.reply_text(
             f"👤 <b>المستخدم:</b> {users[uid]['name']}\n\n"
@@ -1245,18 +3429,16 @@ async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         users[uid]["ban_reason"] = ""
         users[uid]["ban_time"] = None
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
 
         # إشعار المستخدم
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text="🎉 <b>تم فك الحظر عن حسابك!</b>\n\n"
-                     "يمكنك الآن استخدام جميع خدمات Asser Platform بشكل طبيعي.\n\n"
-                     "💙 مرحباً بك مرة أخرى!",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار فك الحظر: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text="🎉 <b>تم فك الحظر عن حسابك!</b>\n\n"
+                 "يمكنك الآن استخدام جميع خدمات Asser Platform بشكل طبيعي.\n\n"
+                 "💙 مرحباً بك مرة أخرى!",
+            parse_mode=ParseMode.HTML
+        )
 
         await update.message.reply_text(
             f"✅ تم فك الحظر عن المستخدم {users[uid]['name']} بنجاح!"
@@ -1289,6 +3471,7 @@ async def admin_ban_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
         users[uid]["ban_reason"] = reason
         users[uid]["ban_time"] = int(time.time())
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
 
         # حفظ في سجل الحظر
         ban_log = load_data(BAN_LOG, [], ensure_list=True)
@@ -1302,17 +3485,14 @@ async def admin_ban_reason(update: Update, context: ContextTypes.DEFAULT_TYPE):
         save_data(BAN_LOG, ban_log)
 
         # إشعار المستخدم
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text=f"🚫 <b>تم حظر حسابك!</b>\n\n"
-                     f"📋 <b>السبب:</b> {reason}\n"
-                     f"📅 <b>التاريخ:</b> {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                     f"للاستفسار، تواصل مع الإدارة.",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار الحظر: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text=f"🚫 <b>تم حظر حسابك!</b>\n\n"
+                 f"📋 <b>السبب:</b> {reason}\n"
+                 f"📅 <b>التاريخ:</b> {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                 f"للاستفسار، تواصل مع الإدارة.",
+            parse_mode=ParseMode.HTML
+        )
 
         await query.edit_message_text(
             f"✅ تم حظر المستخدم {users[uid]['name']} بسبب: {reason}"
@@ -1329,6 +3509,7 @@ async def admin_custom_ban_reason(update: Update, context: ContextTypes.DEFAULT_
     users[uid]["ban_reason"] = reason
     users[uid]["ban_time"] = int(time.time())
     save_data(USERS_FILE, users)
+    SEGMENTS.update_user(uid, users[uid])
 
     # حفظ في سجل الحظر
     ban_log = load_data(BAN_LOG, [], ensure_list=True)
@@ -1342,17 +3523,14 @@ async def admin_custom_ban_reason(update: Update, context: ContextTypes.DEFAULT_
     save_data(BAN_LOG, ban_log)
 
     # إشعار المستخدم
-    try:
-        await context.bot.send_message(
-            chat_id=int(uid),
-            text=f"🚫 <b>تم حظر حسابك!</b>\n\n"
-                 f"📋 <b>السبب:</b> {reason}\n"
-                 f"📅 <b>التاريخ:</b> {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                 f"للاستفسار، تواصل مع الإدارة.",
-            parse_mode=ParseMode.HTML
-        )
-    except Exception as e:
-        logger.error(f"فشل في إرسال إشعار الحظر: {e}")
+    OUTBOX.enqueue(
+        int(uid),
+        text=f"🚫 <b>تم حظر حسابك!</b>\n\n"
+             f"📋 <b>السبب:</b> {reason}\n"
+             f"📅 <b>التاريخ:</b> {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+             f"للاستفسار، تواصل مع الإدارة.",
+        parse_mode=ParseMode.HTML
+    )
 
     await update.message.reply_text(
         f"✅ تم حظر المستخدم {users[uid]['name']} بسبب: {reason}"
@@ -1361,41 +3539,50 @@ async def admin_custom_ban_reason(update: Update, context: ContextTypes.DEFAULT_
 
 # ─── إضافة باقي وظائف الأدمن المفقودة ────────────────────────────────────────────
 
+def platform_stats(users, deposits, withdrawals):
+    """أرقام لوحة الإحصائيات"""
+    return {
+        "total_users": len(users),
+        "banned_users": sum(1 for user in users.values() if user.get("banned", False)),
+        "premium_users": sum(1 for user in users.values() if user.get("premium", False)),
+        "total_egp": sum(user["balance"]["EGP"] for user in users.values()),
+        "total_usdt": sum(user["balance"]["USDT"] for user in users.values()),
+        "pending_deposits": len(deposits),
+        "pending_withdrawals": len(withdrawals)
+    }
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض إحصائيات المنصة"""
     query = update.callback_query
     await query.answer()
     
-    users = load_data(USERS_FILE, {})
-    deposits = load_data(PEND_DEP, [], ensure_list=True)
-    withdrawals = load_data(PEND_WDR, [], ensure_list=True)
-    
-    total_users = len(users)
-    banned_users = sum(1 for user in users.values() if user.get("banned", False))
-    premium_users = sum(1 for user in users.values() if user.get("premium", False))
-    
-    total_egp = sum(user["balance"]["EGP"] for user in users.values())
-    total_usdt = sum(user["balance"]["USDT"] for user in users.values())
-    
-    pending_deposits = len(deposits)
-    pending_withdrawals = len(withdrawals)
+    stats = platform_stats(
+        load_data(USERS_FILE, {}),
+        load_data(PEND_DEP, [], ensure_list=True),
+        load_data(PEND_WDR, [], ensure_list=True)
+    )
+    queue = UPDATE_PROCESSOR.snapshot()
     
     stats_text = (
         f"📊 <b>إحصائيات المنصة</b>\n\n"
         f"👥 <b>المستخدمين:</b>\n"
-        f"  - إجمالي: {total_users}\n"
-        f"  - محظورين: {banned_users}\n"
-        f"  - مميزين: {premium_users}\n\n"
+        f"  - إجمالي: {stats['total_users']}\n"
+        f"  - محظورين: {stats['banned_users']}\n"
+        f"  - مميزين: {stats['premium_users']}\n\n"
         f"💰 <b>الأرصدة الإجمالية:</b>\n"
-        f"  - EGP: {total_egp:.2f}\n"
-        f"  - USDT: {total_usdt:.2f}\n\n"
+        f"  - EGP: {stats['total_egp']:.2f}\n"
+        f"  - USDT: {stats['total_usdt']:.2f}\n\n"
         f"📋 <b>الطلبات المعلقة:</b>\n"
-        f"  - إيداعات: {pending_deposits}\n"
-        f"  - سحوبات: {pending_withdrawals}"
+        f"  - إيداعات: {stats['pending_deposits']}\n"
+        f"  - سحوبات: {stats['pending_withdrawals']}\n\n"
+        f"⚙️ <b>طابور التحديثات:</b>\n"
+        f"  - قيد التنفيذ: {queue['running']}\n"
+        f"  - في الانتظار: {queue['waiting']} (الأعلى: {queue['peak_waiting']})\n"
+        f"  - مستخدمين نشطين: {queue['active_keys']}\n"
+        f"  - تمت معالجتها: {queue['processed']}"
     )
     
-    keyboard = [[InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = cached_markup("back_to_admin", lambda: [[InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]])
     
     await query.edit_message_text(stats_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
@@ -1411,32 +3598,35 @@ async def admin_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
     requests_text += f"💰 إيداعات معلقة: {len(deposits)}\n"
     requests_text += f"📤 سحوبات معلقة: {len(withdrawals)}\n\n"
     
-    if deposits:
-        requests_text += "<b>آخر 3 إيداعات:</b>\n"
-        for i, dep in enumerate(deposits[-3:]):
-            requests_text += f"  {i+1}. {dep['currency']} {dep['amount']:.2f} - UID: {dep['uid']}\n"
+    if deposits or withdrawals:
+        requests_text += "⬇️ أزرار الموافقة/الرفض لكل طلب في الرسائل التالية"
     
-    if withdrawals:
-        requests_text += "\n<b>آخر 3 سحوبات:</b>\n"
-        for i, wdr in enumerate(withdrawals[-3:]):
-            requests_text += f"  {i+1}. {wdr['currency']} {wdr['amount']:.2f} - UID: {wdr['uid']}\n"
-    
-    keyboard = [[InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = cached_markup("back_to_admin", lambda: [[InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]])
     
     await query.edit_message_text(requests_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
+    # أزرار جديدة لكل طلب معلق حتى لا يعتمد قبوله على رسالة الإشعار الأصلية أو مدة صلاحية أزرارها
+    for request_type, label, requests in (("deposit", "💰 إيداع", deposits), ("withdrawal", "📤 سحب", withdrawals)):
+        for req in requests:
+            try:
+                await context.bot.send_message(
+                    chat_id=query.message.chat_id,
+                    text=f"{label} #{req['id']}\n🆔 UID: {req['uid']}\n💵 المبلغ: {req['amount']:.2f} {req['currency']}",
+                    reply_markup=approval_markup(request_type, {"request_id": req["id"]})
+                )
+            except Exception as e:
+                logger.error(f"فشل في إرسال أزرار الطلب {req.get('id')}: {e}")
+
 async def admin_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة الحساب المميز"""
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
+    reply_markup = cached_markup("admin_premium", lambda: [
         [InlineKeyboardButton("👑 منح حساب مميز", callback_data="grant_premium")],
         [InlineKeyboardButton("❌ إلغاء حساب مميز", callback_data="revoke_premium")],
         [InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
     
     await query.edit_message_text(
         "👑 <b>إدارة الحساب المميز</b>\n\n"
@@ -1478,69 +3668,130 @@ async def admin_premium_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if action == "grant_premium":
         users[uid]["premium"] = True
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
         
         # إشعار المستخدم
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text="🎉 <b>مبروك! تم ترقية حسابك إلى حساب مميز!</b>\n\n"
-                     "👑 يمكنك الآن الاستفادة من جميع مميزات الحساب المميز\n\n"
-                     "💙 شكراً لثقتك في Asser Platform",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار الحساب المميز: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text="🎉 <b>مبروك! تم ترقية حسابك إلى حساب مميز!</b>\n\n"
+                 "👑 يمكنك الآن الاستفادة من جميع مميزات الحساب المميز\n\n"
+                 "💙 شكراً لثقتك في Asser Platform",
+            parse_mode=ParseMode.HTML
+        )
         
         await update.message.reply_text(f"✅ تم منح {user_name} حساب مميز!")
         
     elif action == "revoke_premium":
         users[uid]["premium"] = False
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
         
         # إشعار المستخدم
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text="📢 <b>تم إلغاء الحساب المميز</b>\n\n"
-                     "تم إلغاء مميزات الحساب المميز من حسابك\n\n"
-                     "للاستفسار، تواصل مع الإدارة",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار إلغاء الحساب المميز: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text="📢 <b>تم إلغاء الحساب المميز</b>\n\n"
+                 "تم إلغاء مميزات الحساب المميز من حسابك\n\n"
+                 "للاستفسار، تواصل مع الإدارة",
+            parse_mode=ParseMode.HTML
+        )
         
         await update.message.reply_text(f"✅ تم إلغاء الحساب المميز من {user_name}")
     
     return ConversationHandler.END
 
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """إرسال إشعار عام"""
+    """إرسال إشعار عام - اختيار الشريحة المستهدفة"""
     query = update.callback_query
     await query.answer()
-    
+
+    reply_markup = cached_markup("admin_broadcast", lambda: [
+        [InlineKeyboardButton(label, callback_data=pack_callback("bcast_seg", segment))]
+        for segment, label in SEGMENT_LABELS.items()
+    ] + [[InlineKeyboardButton("🔙 العودة للوحة الأدمن", callback_data="admin_panel")]])
+
     await query.edit_message_text(
         "📨 <b>إرسال إشعار عام</b>\n\n"
-        "اكتب الرسالة التي تريد إرسالها لجميع المستخدمين:",
+        "اختر الشريحة التي تريد إرسال الإشعار إليها:",
+        reply_markup=reply_markup,
         parse_mode=ParseMode.HTML
     )
+    return ADMIN_BROADCAST_SEGMENT
+
+async def admin_broadcast_segment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج اختيار شريحة الإشعار"""
+    query = update.callback_query
+    await query.answer()
+
+    if query.data == "admin_panel":
+        await admin_panel(update, context)
+        return ADMIN_MAIN
+
+    segment = parse_callback(query.data)[1]
+    context.user_data["broadcast_segment"] = segment
+    context.user_data["broadcast_param"] = None
+
+    if segment == "recent":
+        await query.edit_message_text("🆕 أدخل عدد الأيام (N):")
+        return ADMIN_BROADCAST_PARAM
+    if segment == "balance_above":
+        await query.edit_message_text("💰 أدخل الحد الأدنى لرصيد EGP (X):")
+        return ADMIN_BROADCAST_PARAM
+
+    await ask_broadcast_message(query.edit_message_text, segment, None)
     return ADMIN_BROADCAST
 
+async def admin_broadcast_param(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج قيمة الشريحة (عدد الأيام أو الرصيد)"""
+    try:
+        param = float(update.message.text.strip())
+        if param < 0:
+            raise ValueError
+    except Exception:
+        await update.message.reply_text("❌ أدخل رقماً صحيحاً غير سالب!")
+        return ADMIN_BROADCAST_PARAM
+
+    segment = context.user_data["broadcast_segment"]
+    context.user_data["broadcast_param"] = param
+
+    await ask_broadcast_message(update.message.reply_text, segment, param)
+    return ADMIN_BROADCAST
+
+async def ask_broadcast_message(reply, segment, param):
+    recipients = SEGMENTS.members_of(segment, param)
+    label = SEGMENT_LABELS[segment]
+    if param is not None:
+        label = f"{label} ({param:g})"
+
+    await reply(
+        f"📨 <b>إرسال إشعار عام</b>\n\n"
+        f"🎯 <b>الشريحة:</b> {label}\n"
+        f"👥 <b>عدد المستلمين:</b> {len(recipients)}\n\n"
+        "اكتب الرسالة التي تريد إرسالها:",
+        parse_mode=ParseMode.HTML
+    )
+
 async def admin_broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إرسال الإشعار العام"""
     message = update.message.text.strip()
-    users = load_data(USERS_FILE, {})
+    segment = context.user_data.get("broadcast_segment", "all")
+    recipients = SEGMENTS.members_of(segment, context.user_data.get("broadcast_param"))
     
     sent_count = 0
     failed_count = 0
+    skipped_count = 0
     
-    for uid in users.keys():
+    for uid in recipients:
         try:
-            await context.bot.send_message(
-                chat_id=int(uid),
+            sent = await send_to_user(
+                bulk_bot(context),
+                int(uid),
                 text=f"📢 <b>إشعار من إدارة Asser Platform</b>\n\n{message}",
                 parse_mode=ParseMode.HTML
             )
-            sent_count += 1
+            if sent is None:
+                skipped_count += 1
+            else:
+                sent_count += 1
         except Exception as e:
             failed_count += 1
             logger.error(f"فشل إرسال الإشعار للمستخدم {uid}: {e}")
@@ -1548,6 +3799,7 @@ async def admin_broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(
         f"✅ <b>تم إرسال الإشعار!</b>\n\n"
         f"📤 تم الإرسال: {sent_count}\n"
+        f"🚫 محادثات مغلقة (تم تخطيها): {skipped_count}\n"
         f"❌ فشل: {failed_count}",
         parse_mode=ParseMode.HTML
     )
@@ -1569,20 +3821,24 @@ async def admin_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ADMIN_SEARCH_INPUT
 
-async def admin_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالج البحث عن المستخدم"""
-    search_term = update.message.text.strip()
-    users = load_data(USERS_FILE, {})
-    
+def search_users(users, search_term):
+    """المستخدمين المطابقين لـ UID أو الاسم أو البريد أو الهاتف"""
+    term = search_term.lower()
     found_users = []
-    
-    # البحث في جميع المستخدمين
     for uid, user_data in users.items():
         if (uid == search_term or 
-            user_data.get('name', '').lower() == search_term.lower() or
-            user_data.get('email', '').lower() == search_term.lower() or
+            user_data.get('name', '').lower() == term or
+            user_data.get('email', '').lower() == term or
             user_data.get('phone', '') == search_term):
             found_users.append((uid, user_data))
+    return found_users
+
+async def admin_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج البحث عن المستخدم"""
+    search_term = update.message.text.strip()
+    users = load_data(USERS_FILE, {})
+    
+    found_users = search_users(users, search_term)
     
     if not found_users:
         await update.message.reply_text(
@@ -1672,11 +3928,10 @@ async def admin_edit_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["edit_uid"] = uid
     user = users[uid]
     
-    keyboard = [
+    reply_markup = cached_markup("admin_edit_user", lambda: [
         [InlineKeyboardButton("💵 EGP", callback_data="edit_EGP")],
         [InlineKeyboardButton("💲 USDT", callback_data="edit_USDT")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
     
     await update.message.reply_text(
         f"👤 <b>المستخدم:</b> {user['name']}\n\n"
@@ -1721,19 +3976,17 @@ async def admin_edit_balance(update: Update, context: ContextTypes.DEFAULT_TYPE)
     old_balance = users[uid]["balance"][currency]
     users[uid]["balance"][currency] = new_balance
     save_data(USERS_FILE, users)
+    SEGMENTS.update_user(uid, users[uid])
     
     # إشعار المستخدم
-    try:
-        await context.bot.send_message(
-            chat_id=int(uid),
-            text=f"💰 <b>تم تحديث رصيدك!</b>\n\n"
-                 f"العملة: {currency}\n"
-                 f"الرصيد الجديد: {new_balance:.2f}\n\n"
-                 f"من إدارة Asser Platform 💙",
-            parse_mode=ParseMode.HTML
-        )
-    except Exception as e:
-        logger.error(f"فشل في إرسال إشعار تحديث الرصيد: {e}")
+    OUTBOX.enqueue(
+        int(uid),
+        text=f"💰 <b>تم تحديث رصيدك!</b>\n\n"
+             f"العملة: {currency}\n"
+             f"الرصيد الجديد: {new_balance:.2f}\n\n"
+             f"من إدارة Asser Platform 💙",
+        parse_mode=ParseMode.HTML
+    )
     
     await update.message.reply_text(
         f"✅ <b>تم تحديث الرصيد!</b>\n\n"
@@ -1793,18 +4046,16 @@ async def admin_send_money_amount(update: Update, context: ContextTypes.DEFAULT_
         
         users[uid]["balance"]["EGP"] += amount
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
 
         # إرسال إشعار مخصص للإيداع الخاص
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text=f"4️⃣ <b>تهانينا! تم قبول الإيداع الخاص بك.</b>\n\n"
-                     f"تم إضافة <b>{amount:.2f} EGP</b> إلى رصيدك\n\n"
-                     f"من إدارة Asser Platform 💙",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار المستخدم: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text=f"4️⃣ <b>تهانينا! تم قبول الإيداع الخاص بك.</b>\n\n"
+                 f"تم إضافة <b>{amount:.2f} EGP</b> إلى رصيدك\n\n"
+                 f"من إدارة Asser Platform 💙",
+            parse_mode=ParseMode.HTML
+        )
 
         await update.message.reply_text(
             f"✅ <b>تم الإيداع الخاص بنجاح!</b>\n\n"
@@ -1817,14 +4068,13 @@ async def admin_send_money_amount(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     else:
         # إرسال أموال عادي
-        keyboard = [
+        reply_markup = cached_markup("admin_send_money_amount", lambda: [
             [InlineKeyboardButton("🎁 مكافأة", callback_data="reward")],
             [InlineKeyboardButton("💸 تعويض", callback_data="compensation")],
             [InlineKeyboardButton("🎉 هدية", callback_data="gift")],
             [InlineKeyboardButton("💰 إيداع", callback_data="deposit_transfer")],
             [InlineKeyboardButton("💼 سحب الأصول", callback_data="assets_withdrawal_transfer")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        ])
 
         await update.message.reply_text(
             f"💰 المبلغ: {amount:.2f} EGP\n\n"
@@ -1853,11 +4103,10 @@ async def admin_send_money_type(update: Update, context: ContextTypes.DEFAULT_TY
     users = load_data(USERS_FILE, {})
     user_name = users[uid]["name"]
 
-    keyboard = [
+    reply_markup = cached_markup("admin_send_money_type", lambda: [
         [InlineKeyboardButton("✅ تأكيد", callback_data="confirm_send")],
         [InlineKeyboardButton("❌ إلغاء", callback_data="admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await query.edit_message_text(
         f"📋 <b>تأكيد التحويل</b>\n\n"
@@ -1883,19 +4132,17 @@ async def admin_send_money_confirm(update: Update, context: ContextTypes.DEFAULT
         users = load_data(USERS_FILE, {})
         users[uid]["balance"]["EGP"] += amount
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
 
         # إرسال إشعار للمستخدم
-        try:
-            await context.bot.send_message(
-                chat_id=int(uid),
-                text=f"🎉 <b>تهانينا!</b>\n\n"
-                     f"تم إضافة <b>{amount:.2f} EGP</b> إلى رصيدك\n"
-                     f"السبب: {transfer_type}\n\n"
-                     f"من إدارة Asser Platform 💙",
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"فشل في إرسال إشعار المستخدم: {e}")
+        OUTBOX.enqueue(
+            int(uid),
+            text=f"🎉 <b>تهانينا!</b>\n\n"
+                 f"تم إضافة <b>{amount:.2f} EGP</b> إلى رصيدك\n"
+                 f"السبب: {transfer_type}\n\n"
+                 f"من إدارة Asser Platform 💙",
+            parse_mode=ParseMode.HTML
+        )
 
         await query.edit_message_text(
             f"✅ <b>تم التحويل بنجاح!</b>\n\n"
@@ -1908,17 +4155,32 @@ async def admin_send_money_confirm(update: Update, context: ContextTypes.DEFAULT
         return ADMIN_MAIN
 
 # ─── معالجة موافقة/رفض الطلبات ────────────────────────────────────────────
+def find_request_index(requests, state):
+    """موضع الطلب في القائمة المعلقة حسب معرفه"""
+    for index, request in enumerate(requests):
+        if request.get("id") == state.get("request_id"):
+            return index
+    return None
+
 async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    action, request_type, request_id = query.data.split("_", 2)
+    route, key = parse_callback(query.data)
+    action, request_type = route.split("_", 1)
+
+    # الأزرار القديمة التي تحمل ترتيب الطلب في القائمة لا تُنفذ: الترتيب يتغير بعد معالجة
+    # أي طلب سابق فقد يشير لطلب مستخدم آخر
+    state = ACTION_STATE.get(key)
+    if state is None:
+        await query.edit_message_text("⌛ انتهت صلاحية هذا الزر أو تمت معالجة الطلب.")
+        return
 
     if request_type == "deposit":
         deposits = load_data(PEND_DEP, [], ensure_list=True)
         try:
-            request_index = int(request_id)
-            if request_index >= len(deposits):
+            request_index = find_request_index(deposits, state)
+            if request_index is None:
                 await query.edit_message_text("❌ الطلب غير موجود!")
                 return
 
@@ -1933,42 +4195,41 @@ async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TY
                 # إضافة المبلغ للرصيد
                 users[uid]["balance"][currency] += amount
                 save_data(USERS_FILE, users)
+                SEGMENTS.update_user(uid, users[uid])
 
                 # إشعار المستخدم
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(uid),
-                        text=f"✅ <b>تم قبول إيداعك!</b>\n\n"
-                             f"💰 تم إضافة {amount:.2f} {currency} إلى رصيدك\n\n"
-                             f"💙 شكراً لثقتك في Asser Platform",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الموافقة: {e}")
+                OUTBOX.enqueue(
+                    int(uid),
+                    text=f"✅ <b>تم قبول إيداعك!</b>\n\n"
+                         f"💰 تم إضافة {amount:.2f} {currency} إلى رصيدك\n\n"
+                         f"💙 شكراً لثقتك في Asser Platform",
+                    parse_mode=ParseMode.HTML
+                )
 
                 # حذف الطلب
                 deposits.pop(request_index)
                 save_data(PEND_DEP, deposits)
+                settle_deposit(deposit_request, "approved")
+                ACTION_STATE.discard(key)
 
                 await query.edit_message_text(f"✅ تم قبول الإيداع وإضافة {amount:.2f} {currency}")
 
             elif action == "reject":
                 # إشعار المستخدم
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(uid),
-                        text=f"❌ <b>تم رفض إيداعك</b>\n\n"
-                             f"💵 المبلغ: {amount:.2f} {currency}\n"
-                             f"📝 يرجى التأكد من البيانات والمحاولة مرة أخرى\n\n"
-                             f"للاستفسار، تواصل مع الإدارة",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الرفض: {e}")
+                OUTBOX.enqueue(
+                    int(uid),
+                    text=f"❌ <b>تم رفض إيداعك</b>\n\n"
+                         f"💵 المبلغ: {amount:.2f} {currency}\n"
+                         f"📝 يرجى التأكد من البيانات والمحاولة مرة أخرى\n\n"
+                         f"للاستفسار، تواصل مع الإدارة",
+                    parse_mode=ParseMode.HTML
+                )
 
                 # حذف الطلب
                 deposits.pop(request_index)
                 save_data(PEND_DEP, deposits)
+                settle_deposit(deposit_request, "rejected")
+                ACTION_STATE.discard(key)
 
                 await query.edit_message_text(f"❌ تم رفض الإيداع")
 
@@ -1978,8 +4239,8 @@ async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TY
     elif request_type == "withdrawal":
         withdrawals = load_data(PEND_WDR, [], ensure_list=True)
         try:
-            request_index = int(request_id)
-            if request_index >= len(withdrawals):
+            request_index = find_request_index(withdrawals, state)
+            if request_index is None:
                 await query.edit_message_text("❌ الطلب غير موجود!")
                 return
 
@@ -1992,21 +4253,19 @@ async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TY
 
             if action == "approve":
                 # إشعار المستخدم
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(uid),
-                        text=f"✅ <b>تم قبول طلب السحب!</b>\n\n"
-                             f"💰 المبلغ: {amount:.2f} {currency}\n"
-                             f"📱 سيتم التحويل خلال 24 ساعة\n\n"
-                             f"💙 شكراً لثقتك في Asser Platform",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الموافقة: {e}")
+                OUTBOX.enqueue(
+                    int(uid),
+                    text=f"✅ <b>تم قبول طلب السحب!</b>\n\n"
+                         f"💰 المبلغ: {amount:.2f} {currency}\n"
+                         f"📱 سيتم التحويل خلال 24 ساعة\n\n"
+                         f"💙 شكراً لثقتك في Asser Platform",
+                    parse_mode=ParseMode.HTML
+                )
 
                 # حذف الطلب
                 withdrawals.pop(request_index)
                 save_data(PEND_WDR, withdrawals)
+                ACTION_STATE.discard(key)
 
                 await query.edit_message_text(f"✅ تم قبول السحب {amount:.2f} {currency}")
 
@@ -2015,24 +4274,23 @@ async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TY
                 original_amount = amount + withdrawal_request.get("fee", 0)
                 users[uid]["balance"][currency] += original_amount
                 save_data(USERS_FILE, users)
+                SEGMENTS.update_user(uid, users[uid])
 
                 # إشعار المستخدم
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(uid),
-                        text=f"❌ <b>تم رفض طلب السحب</b>\n\n"
-                             f"💵 المبلغ: {amount:.2f} {currency}\n"
-                             f"💰 تم إعادة المبلغ إلى رصيدك\n"
-                             f"📝 يرجى التأكد من البيانات والمحاولة مرة أخرى\n\n"
-                             f"للاستفسار، تواصل مع الإدارة",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"فشل في إرسال إشعار الرفض: {e}")
+                OUTBOX.enqueue(
+                    int(uid),
+                    text=f"❌ <b>تم رفض طلب السحب</b>\n\n"
+                         f"💵 المبلغ: {amount:.2f} {currency}\n"
+                         f"💰 تم إعادة المبلغ إلى رصيدك\n"
+                         f"📝 يرجى التأكد من البيانات والمحاولة مرة أخرى\n\n"
+                         f"للاستفسار، تواصل مع الإدارة",
+                    parse_mode=ParseMode.HTML
+                )
 
                 # حذف الطلب
                 withdrawals.pop(request_index)
                 save_data(PEND_WDR, withdrawals)
+                ACTION_STATE.discard(key)
 
                 await query.edit_message_text(f"❌ تم رفض السحب وإعادة المبلغ")
 
@@ -2041,6 +4299,7 @@ async def handle_admin_approval(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif request_type == "assets":
         # معالجة سحب الأصول
+        ACTION_STATE.discard(key)
         if action == "approve":
             await query.edit_message_text("✅ تم قبول طلب سحب الأصول! يرجى إضافة المبلغ يدوياً للمستخدم.")
         elif action == "reject":
@@ -2051,34 +4310,7 @@ async def handle_main_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    if query.data == "profile":
-        await show_profile(update, context)
-    elif query.data == "balance":
-        await show_balance(update, context)
-    elif query.data == "work_sites":
-        await show_work_sites(update, context)
-    elif query.data == "back_to_main":
-        await show_main_menu(update, context)
-    elif query.data == "back_to_start":
-        await back_to_start(update, context)
-    elif query.data == "invest":
-        await start_invest(update, context)
-    elif query.data == "deposit":
-        await start_deposit(update, context)
-    elif query.data == "withdraw":
-        await start_withdraw(update, context)
-    elif query.data == "transfer":
-        await start_transfer(update, context)
-    elif query.data == "invite_friends":
-        await show_invite_friends(update, context)
-    elif query.data == "terms":
-        await show_terms(update, context)
-    elif query.data == "social_media":
-        await show_social_media(update, context)
-    elif query.data == "premium_info":
-        await show_premium_info(update, context)
-    elif query.data == "admin_panel":
-        await admin_panel(update, context)
+    await MAIN_MENU_ACTIONS[query.data](update, context)
 
 async def show_profile(update, context):
     uid = str(update.callback_query.from_user.id)
@@ -2139,8 +4371,7 @@ async def show_profile(update, context):
         f"{ban_status}"
     )
 
-    keyboard = [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = cached_markup("back_to_main", lambda: [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]])
 
     await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
@@ -2159,8 +4390,7 @@ async def show_balance(update, context):
         f"  - USDT: {bal['USDT']:.2f}"  
     )
 
-    keyboard = [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = cached_markup("back_to_main", lambda: [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]])
 
     await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
 
@@ -2184,11 +4414,10 @@ async def show_invite_friends(update, context):
         "كلما دخل عضو جديد عن طريق الرابط، يزداد عدد فريقك!"
     )
 
-    keyboard = [
+    reply_markup = cached_markup("show_invite_friends", lambda: [
         [InlineKeyboardButton("💡 كيفية الربح من دعوة الأصدقاء", callback_data="referral_earnings")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await update.callback_query.edit_message_text(
         text=message,
@@ -2197,46 +4426,19 @@ async def show_invite_friends(update, context):
     )
 
 async def show_referral_earnings(update, context):
-    message = (
-        "💡 <b>كيفية الربح من دعوة الأصدقاء</b>\n\n"
-        "🎯 <b>من العمل على المواقع:</b>\n"
-        "عن طريق العمل على المواقع من أعضاء فريقك ستحصل أنت على 20% إحالة\n\n"
-        "📈 <b>من التقديم على الشهادات:</b>\n"
-        "على التقديم على شهادة ستحصل على 10% من أرباح صديقك\n\n"
-        "⚠️ <b>ملاحظة مهمة:</b>\n"
-        "المبلغ الذي صديقك قام بإيداعه لا يتم خصم أي شيء منه، هو للعمل فقط ولا يخص ذلك\n\n"
-        "💰 <b>مثال:</b>\n"
-        "إذا قام صديقك بربح شهرياً 1000 EGP ستحصل على 200 EGP"
-    )
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 العودة لدعوة الأصدقاء", callback_data="invite_friends")],
-        [InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.callback_query.edit_message_text(
-        message, 
-        reply_markup=reply_markup, 
-        parse_mode=ParseMode.HTML
-    )
+    await update.callback_query.edit_message_text(**STATIC_PAGES["referral_earnings"])
 
 async def show_terms(update, context):
-    for i in range(0, len(CONTRACT_TEXT), 4096):
-        part = CONTRACT_TEXT[i:i+4096]
-        await update.callback_query.message.reply_text(part)
-        time.sleep(0.5)
+    await update.callback_query.edit_message_text(**CONTRACT_PAGES[0])
 
-    keyboard = [
-        [InlineKeyboardButton("موافــــق ✅", callback_data="accept_terms")],
-        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_terms_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """التنقل بين صفحات العقد بتعديل نفس الرسالة"""
+    query = update.callback_query
+    await query.answer()
 
-    await update.callback_query.message.reply_text(
-        "إذا كنت موافقًا اضغط الزر:", 
-        reply_markup=reply_markup
-    )
+    page = int(parse_callback(query.data)[1])
+    if 0 <= page < len(CONTRACT_PAGES):
+        await query.edit_message_text(**CONTRACT_PAGES[page])
 
 async def accept_terms(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -2248,30 +4450,13 @@ async def accept_terms(update: Update, context: ContextTypes.DEFAULT_TYPE):
         users[uid]["accepted_terms"] = True
         users[uid]["acceptance_time"] = int(time.time())
         save_data(USERS_FILE, users)
+        SEGMENTS.update_user(uid, users[uid])
         await query.edit_message_text("✅ تم التوقيع على العقد.")
     else:
         await query.edit_message_text("❌ يجب التسجيل أولاً!")
 
 async def show_social_media(update, context):
-    message = (
-        "📱 <b>تابعنا على مواقع التواصل الاجتماعي</b>\n\n"
-        "اختر المنصة التي تريد زيارتها:"
-    )
-
-    keyboard = [
-        [InlineKeyboardButton("📱 Telegram", url="https://t.me/Asser_Platform")],
-        [InlineKeyboardButton("🎥 YouTube", url="https://www.youtube.com/@Asser-Platform")],
-        [InlineKeyboardButton("🎵 TikTok", url="https://tiktok.com/@asser_platform")],
-        [InlineKeyboardButton("📷 Instagram", callback_data="instagram_soon")],
-        [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.callback_query.edit_message_text(
-        message, 
-        reply_markup=reply_markup, 
-        parse_mode=ParseMode.HTML
-    )
+    await update.callback_query.edit_message_text(**STATIC_PAGES["social_media"])
 
 async def instagram_soon(update, context):
     await update.callback_query.answer("قريباً...")
@@ -2293,8 +4478,7 @@ async def show_premium_info(update, context):
         "⚖️ ألا يكون قد خالف شروط الاستخدام أو تم الإبلاغ عنه"
     )
 
-    keyboard = [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = cached_markup("back_to_main", lambda: [[InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]])
 
     await update.callback_query.edit_message_text(
         message, 
@@ -2310,13 +4494,12 @@ async def start_invest(update, context):
     if await check_user_ban(uid, update, context):
         return ConversationHandler.END
 
-    keyboard = [
+    reply_markup = cached_markup("start_invest", lambda: [
         [InlineKeyboardButton("يومي (5% شهريًا)", callback_data="daily")],
         [InlineKeyboardButton("أسبوعي (6% شهريًا)", callback_data="weekly")],
         [InlineKeyboardButton("شهري (10% شهريًا)", callback_data="monthly")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await update.callback_query.edit_message_text(
         "📊 اختر نوع الشهادة:",
@@ -2398,6 +4581,7 @@ async def plan_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     users[uid]["plans"].append(new_plan)
 
     save_data(USERS_FILE, users)
+    SEGMENTS.update_user(uid, users[uid])
 
     # حساب الجدول الزمني للدفع
     payout_schedule = ""
@@ -2430,12 +4614,11 @@ async def start_transfer(update, context):
     if await check_user_ban(uid, update, context):
         return ConversationHandler.END
 
-    keyboard = [
+    reply_markup = cached_markup("start_transfer", lambda: [
         [InlineKeyboardButton("تحويل عملات 💱", callback_data="convert")],
         [InlineKeyboardButton("تحويل بين المستخدمين 👤", callback_data="user_transfer")],
         [InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
 
     await update.callback_query.edit_message_text(
         "📤 <b>تحويل الأموال</b>\n\n"
@@ -2509,6 +4692,8 @@ async def transfer_user_amount(update: Update, context: ContextTypes.DEFAULT_TYP
     users[sender_uid]["balance"]["EGP"] -= amount
     users[target_uid]["balance"]["EGP"] += amount
     save_data(USERS_FILE, users)
+    SEGMENTS.update_user(sender_uid, users[sender_uid])
+    SEGMENTS.update_user(target_uid, users[target_uid])
 
     # إشعار المرسل
     await update.message.reply_text(
@@ -2520,29 +4705,564 @@ async def transfer_user_amount(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
     # إشعار المستقبل
+    OUTBOX.enqueue(
+        int(target_uid),
+        text=f"💰 <b>تم استلام تحويل!</b>\n\n"
+             f"💵 المبلغ: {amount:.2f} EGP\n"
+             f"👤 من: {users[sender_uid]['name']}\n"
+             f"🆔 UID المرسل: {sender_uid}\n\n"
+             f"💙 شكراً لاستخدام Asser Platform",
+        parse_mode=ParseMode.HTML
+    )
+
+    return ConversationHandler.END
+
+# ─── جدول توجيه الأزرار العامة ───────────────────────────────────────
+MAIN_MENU_ACTIONS = {
+    "profile": show_profile,
+    "balance": show_balance,
+    "work_sites": show_work_sites,
+    "back_to_main": show_main_menu,
+    "back_to_start": back_to_start,
+    "invest": start_invest,
+    "deposit": start_deposit,
+    "withdraw": start_withdraw,
+    "transfer": start_transfer,
+    "invite_friends": show_invite_friends,
+    "terms": show_terms,
+    "social_media": show_social_media,
+    "premium_info": show_premium_info,
+    "admin_panel": admin_panel
+}
+
+MAIN_ROUTER = CallbackRouter({
+    **dict.fromkeys(MAIN_MENU_ACTIONS, handle_main_buttons),
+    "how_to_work": show_how_to_work,
+    "accept_terms": accept_terms,
+    "terms_page": show_terms_page,
+    "referral_earnings": show_referral_earnings,
+    "instagram_soon": instagram_soon,
+    **dict.fromkeys(
+        (f"{action}_{request_type}" for action in ("approve", "reject") for request_type in ("deposit", "withdrawal", "assets")),
+        handle_admin_approval
+    )
+})
+
+# ─── قياس زمن المعالجات و /metrics ─────────────────────────────────────
+# التغليف يتم على دوال المعالجات نفسها بعد تسجيلها، لأن معالج المجموعة -1 يعمل قبل
+# اختيار المعالج ولا يعرف أي دالة نُفذت ولا متى انتهت.
+METRICS_TOP = int(os.getenv("METRICS_TOP", "10"))
+METRICS_FAMILIES = (
+    ("handler", "⚙️ المعالجات"),
+    ("api", "📡 استدعاءات تيليجرام"),
+    ("storage", "💾 التخزين"),
+    ("updates", "📥 التحديثات"),
+    ("loop", "⏳ حلقة الأحداث")
+)
+
+def timed_callback(name, callback):
+    """تغليف دالة معالج لتسجيل زمنها في METRICS باسم name"""
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            METRICS.observe("handler", name, time.perf_counter() - started)
+    timed.__name__ = name
+    return timed
+
+def instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for states in (handler.entry_points, handler.fallbacks, *handler.states.values()):
+            for child in states:
+                instrument_handler(child)
+    elif isinstance(handler, CallbackRouter):
+        for action, callback in handler.routes.items():
+            # الأزرار العامة تمر عبر handle_main_buttons، فتُسجل باسم الشاشة التي تفتحها
+            target = MAIN_MENU_ACTIONS[action] if callback is handle_main_buttons else callback
+            handler.routes[action] = timed_callback(target.__name__, callback)
+    elif asyncio.iscoroutinefunction(handler.callback):
+        handler.callback = timed_callback(handler.callback.__name__, handler.callback)
+
+def instrument_handlers(app):
+    """تغليف كل المعالجات المسجلة (يُستدعى مرة واحدة بعد إضافتها)"""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+def format_uptime(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    return f"{hours}h {seconds // 60}m"
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """زمن المعالجات واستدعاءات تيليجرام والتخزين منذ التشغيل وخلال آخر ساعة (للأدمن فقط)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    def columns(histogram):
+        if not histogram.count:
+            return f"{0:>6}{'-':>8}{'-':>8}{'-':>8}"
+        p50, p95, p99 = (histogram.percentile(q) * 1000 for q in (0.50, 0.95, 0.99))
+        return f"{histogram.count:>6}{p50:>8.1f}{p95:>8.1f}{p99:>8.1f}"
+
+    sections = [f"📈 <b>القياسات</b> (ms) — منذ التشغيل {format_uptime(time.time() - METRICS.started)} | آخر ساعة"]
+    for family, title in METRICS_FAMILIES:
+        rows = METRICS.family(family)[:METRICS_TOP]
+        if not rows:
+            continue
+        table = [f"{'':<24}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8} |{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}"]
+        for name, overall, recent in rows:
+            table.append(f"{name[:24]:<24}{columns(overall)} |{columns(recent)}")
+        sections.append(f"<b>{title}</b>\n<pre>" + "\n".join(table) + "</pre>")
+
+    if len(sections) == 1:
+        sections.append("لا توجد قياسات بعد.")
+    await update.message.reply_text("\n\n".join(sections), parse_mode=ParseMode.HTML)
+
+# ─── نقطة /metrics بصيغة Prometheus ──────────────────────────────────
+# خادم HTTP صغير داخل حلقة الأحداث نفسها؛ القيم تُجمع وتُنسق فقط عند كل طلب.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = متوقف
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# نوع السلسلة في METRICS -> (اسم المقياس، أسماء الوسوم، الوصف)
+PROMETHEUS_HISTOGRAMS = {
+    "handler": ("asser_handler_duration_seconds", ("handler",), "Handler callback duration"),
+    "api": ("asser_api_request_duration_seconds", ("method",), "Bot API request duration"),
+    "storage": ("asser_storage_duration_seconds", ("op", "file"), "load_data/save_data duration"),
+    "updates": ("asser_update_duration_seconds", ("stage",), "Update queue wait and handling time"),
+    "jobs": ("asser_job_duration_seconds", ("job",), "Background job duration"),
+    "loop": ("asser_event_loop_lag_seconds", (), "Event loop wake-up delay")
+}
+PROMETHEUS_COUNTERS = {
+    "api_errors": ("asser_api_errors_total", ("method", "error"), "Failed Bot API requests"),
+    "outbox_messages": ("asser_outbox_messages_total", ("result",), "Outbox deliveries by result"),
+    "outbox_retries": ("asser_outbox_retries_total", ("reason",), "Outbox delivery retries"),
+    "payouts": ("asser_payouts_total", ("plan",), "Plan payouts credited"),
+    "loop_stalls": ("asser_event_loop_stalls_total", (), "Event loop stalls over LOOP_STALL_MS")
+}
+
+METRICS_SERVER = None
+
+def prometheus_labels(names, values):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def prometheus_text():
+    """كل المقاييس بصيغة Prometheus النصية"""
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def sample(name, label_names, values, value):
+        lines.append(f"{name}{prometheus_labels(label_names, values) if label_names else ''} {value}")
+
+    series = list(METRICS.series.items())
+    for family, (name, label_names, help_text) in PROMETHEUS_HISTOGRAMS.items():
+        header(name, "histogram", help_text)
+        for (series_family, series_name), windowed in series:
+            if series_family != family:
+                continue
+            values = series_name.split(" ", len(label_names) - 1) if label_names else ()
+            histogram = windowed.overall
+            bucket_labels = (*label_names, "le")
+            for bound, count in zip(PROMETHEUS_BUCKETS, histogram.cumulative(PROMETHEUS_BUCKETS)):
+                sample(f"{name}_bucket", bucket_labels, (*values, bound), count)
+            sample(f"{name}_bucket", bucket_labels, (*values, "+Inf"), histogram.count)
+            sample(f"{name}_sum", label_names, values, histogram.total)
+            sample(f"{name}_count", label_names, values, histogram.count)
+
+    counters = list(METRICS.counters.items())
+    for key, (name, label_names, help_text) in PROMETHEUS_COUNTERS.items():
+        header(name, "counter", help_text)
+        for (counter, values), value in counters:
+            if counter == key:
+                sample(name, label_names, values, value)
+
+    header("asser_storage_writes_total", "counter", "save_data calls per file")
+    for file_name, stats in list(STORAGE_STATS.items()):
+        sample("asser_storage_writes_total", ("file",), (file_name,), stats["saves"])
+    header("asser_storage_written_bytes_total", "counter", "Bytes written by save_data per file")
+    for file_name, stats in list(STORAGE_STATS.items()):
+        sample("asser_storage_written_bytes_total", ("file",), (file_name,), stats["bytes"])
+
+    queue = UPDATE_PROCESSOR.snapshot()
+    header("asser_update_queue", "gauge", "Updates running, waiting for a slot, not yet admitted, and users with queued updates")
+    for state in ("running", "waiting", "queued", "active_keys"):
+        sample("asser_update_queue", ("state",), (state,), queue[state])
+    header("asser_updates_processed_total", "counter", "Updates handled since start")
+    sample("asser_updates_processed_total", (), (), queue["processed"])
+    header("asser_outbox_pending", "gauge", "Messages waiting in the outbox")
+    sample("asser_outbox_pending", (), (), len(OUTBOX.pending))
+
+    header("asser_pending_requests", "gauge", "Requests waiting for admin approval")
+    for kind, count in PENDING_COUNTS.items():
+        sample("asser_pending_requests", ("type",), (kind,), count)
+
+    # من فهرس الشرائح بدل قراءة ملف المستخدمين في كل طلب
+    SEGMENTS.ensure_loaded()
+    header("asser_users", "gauge", "Registered users by segment")
+    for segment in SegmentIndex.FLAG_SEGMENTS:
+        sample("asser_users", ("segment",), (segment,), len(SEGMENTS.members[segment]))
+
+    header("asser_uptime_seconds", "gauge", "Seconds since the bot started")
+    sample("asser_uptime_seconds", (), (), round(time.time() - METRICS.started, 1))
+    return "\n".join(lines) + "\n"
+
+async def serve_metrics(reader, writer):
+    """طلب HTTP واحد: GET /metrics فقط"""
     try:
-        await context.bot.send_message(
-            chat_id=int(target_uid),
-            text=f"💰 <b>تم استلام تحويل!</b>\n\n"
-                 f"💵 المبلغ: {amount:.2f} EGP\n"
-                 f"👤 من: {users[sender_uid]['name']}\n"
-                 f"🆔 UID المرسل: {sender_uid}\n\n"
-                 f"💙 شكراً لاستخدام Asser Platform",
-            parse_mode=ParseMode.HTML
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while await asyncio.wait_for(reader.readline(), 5) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+            status, body = "200 OK", prometheus_text().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
         )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"طلب مقاييس غير مكتمل: {e}")
     except Exception as e:
-        logger.error(f"فشل في إرسال إشعار المستقبل: {e}")
+        logger.error(f"خطأ في نقطة المقاييس: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    global METRICS_SERVER
+    if METRICS_PORT:
+        load_pending_counts()
+        METRICS_SERVER = await asyncio.start_server(serve_metrics, METRICS_LISTEN, METRICS_PORT)
+        logger.info(f"نقطة المقاييس على http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+
+async def stop_metrics_server():
+    global METRICS_SERVER
+    if METRICS_SERVER:
+        METRICS_SERVER.close()
+        await METRICS_SERVER.wait_closed()
+        METRICS_SERVER = None
+
+# ─── قياس الأداء بالعينات عند الطلب (/profile) ─────────────────────────
+# خيط يأخذ مكدس كل الخيوط (حلقة الأحداث والعمال) PROFILE_HZ مرة في الثانية، والنتيجة
+# بصيغة collapsed stacks التي يقرأها flamegraph.pl و speedscope مباشرة.
+PROFILE_HZ = int(os.getenv("PROFILE_HZ", "97"))  # رقم أولي حتى لا يتزامن مع المؤقتات الدورية
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+class StackSampler:
+    """تجميع عدد مرات ظهور كل مكدس لكل خيط؛ التحويل لنص يتم مرة واحدة في النهاية"""
+
+    def __init__(self, hz):
+        self.interval = 1 / hz
+        self.stacks = Counter()
+        # id(code) -> code: مفاتيح المكدس أرقام لأن hash كائن الكود نفسه مكلف
+        self.codes = {}
+        self.thread_names = {}
+        self.samples = 0
+        self.busy = 0.0
+
+    def run(self, seconds):
+        """يُستدعى في خيط منفصل ويعود بعد seconds ثانية"""
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        cpu_started = time.thread_time()
+        while next_sample < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                codes = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = id(code)
+                    if key not in self.codes:
+                        self.codes[key] = code
+                    codes.append(key)
+                    frame = frame.f_back
+                self.stacks[(ident, tuple(codes))] += 1
+                if ident not in self.thread_names:
+                    self.thread_names[ident] = next(
+                        (thread.name for thread in threading.enumerate() if thread.ident == ident), f"thread-{ident}"
+                    )
+            self.samples += 1
+            next_sample += self.interval
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+        # وقت المعالج الذي استهلكه خيط القياس نفسه (بدون انتظار الـ GIL)
+        self.busy = time.thread_time() - cpu_started
+
+    def collapsed(self):
+        """سطر لكل مكدس: thread;root;...;leaf count"""
+        labels = {}
+        merged = Counter()
+        for (ident, codes), count in self.stacks.items():
+            frames = [self.thread_names[ident]]
+            for key in reversed(codes):
+                label = labels.get(key)
+                if label is None:
+                    code = self.codes[key]
+                    label = labels[key] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                frames.append(label)
+            merged[";".join(frames)] += count
+        return "".join(f"{stack} {count}\n" for stack, count in merged.most_common())
+
+ACTIVE_PROFILE = None
+
+async def start_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [ثواني] للأدمن: تشغيل القياس بالعينات ثم إرسال النتيجة كملف"""
+    global ACTIVE_PROFILE
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if ACTIVE_PROFILE:
+        await update.message.reply_text("⏳ يوجد قياس جارٍ بالفعل، انتظر حتى ينتهي.")
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("❌ الاستخدام: /profile [عدد الثواني]")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
 
-    return ConversationHandler.END
+    # الحجز قبل الرد حتى لا يبدأ أدمن آخر قياساً أثناء الانتظار، ويُحرر إن فشل الرد
+    sampler = ACTIVE_PROFILE = StackSampler(PROFILE_HZ)
+    try:
+        await update.message.reply_text(f"🔬 بدأ القياس لمدة {seconds} ثانية ({PROFILE_HZ} عينة/ثانية)...")
+        context.application.create_task(finish_profile(context.bot, update.effective_chat.id, sampler, seconds))
+    except BaseException:
+        ACTIVE_PROFILE = None
+        raise
+
+async def finish_profile(bot, chat_id, sampler, seconds):
+    global ACTIVE_PROFILE
+    try:
+        await asyncio.to_thread(sampler.run, seconds)
+        overhead = sampler.busy / seconds * 100
+        collapsed = sampler.collapsed()
+        stacks = collapsed.count("\n")
+        logger.info(f"قياس الأداء: {sampler.samples} عينة، {stacks} مكدس، تكلفة {overhead:.2f}%")
+        await bot.send_document(
+            chat_id,
+            document=collapsed.encode(),
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+            caption=(
+                f"🔬 {sampler.samples} عينة خلال {seconds} ثانية، {stacks} مكدس مختلف\n"
+                f"⚙️ تكلفة القياس: {overhead:.2f}% من وقت المعالج\n"
+                f"📊 للعرض: speedscope.app أو flamegraph.pl"
+            )
+        )
+    except Exception as e:
+        logger.error(f"خطأ في قياس الأداء: {e}")
+    finally:
+        ACTIVE_PROFILE = None
+
+# ─── فحص الذاكرة (/memory) ───────────────────────────────────────────
+# /memory start يبدأ tracemalloc ويحفظ خط أساس، و /memory يقارن بخط الأساس ويعرض
+# أكثر مواضع الحجز نمواً وأعداد الكائنات حسب النوع وأحجام ذاكرات البوت.
+MEMORY_TOP = int(os.getenv("MEMORY_TOP", "10"))
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "1"))
+MEMORY_BASELINE = {"snapshot": None, "census": None, "time": None}
+# كائنات مشتركة لا تُحسب ضمن حجم الذاكرة التي تشير إليها
+DEEP_SIZE_SKIP = (type, types.ModuleType, types.FunctionType, types.MethodType, Bot)
+# عدد الكائنات التي يمر عليها deep_sizeof قبل أن يترك حلقة الأحداث تعالج التحديثات
+DEEP_SIZE_CHUNK = 5000
+
+async def deep_sizeof(root):
+    """حجم تقريبي بالبايت للكائن وكل ما يحتويه
+
+    يعمل على حلقة الأحداث نفسها (وليس في خيط) حتى تُقرأ كل حاوية في لحظة لا تعدلها فيها
+    المعالجات، ويتوقف كل DEEP_SIZE_CHUNK كائن حتى لا يؤخر التحديثات.
+    """
+    seen = set()
+    total = 0
+    steps = 0
+    stack = [root]
+    while stack:
+        steps += 1
+        if steps % DEEP_SIZE_CHUNK == 0:
+            await asyncio.sleep(0)
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, DEEP_SIZE_SKIP):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(obj))
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                slots = getattr(cls, "__slots__", ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    if slot not in ("__dict__", "__weakref__"):
+                        stack.append(getattr(obj, slot, None))
+    return total
+
+def object_census():
+    # gc.get_objects() يحجز الـ GIL طوال بناء القائمة (حوالي 20ms لكل مليون كائن)،
+    # فتتوقف حلقة الأحداث هذه المدة رغم أن الإحصاء يعمل في خيط منفصل
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+def bot_caches(application):
+    """[(الاسم، عدد العناصر، الكائن)] لذاكرات البوت وبيانات المحادثات"""
+    bot = application.bot
+    conversations = {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                conversations.update(getattr(handler, "_conversations", {}))
+    user_data = dict(application.user_data)
+    return [
+        ("user_data", sum(1 for data in user_data.values() if data), user_data),
+        ("chat_data", len(application.chat_data), dict(application.chat_data)),
+        ("conversations", len(conversations), conversations),
+        ("MARKUP_CACHE", len(MARKUP_CACHE), MARKUP_CACHE),
+        ("render.rendered", len(getattr(bot, "rendered", ())), getattr(bot, "rendered", None)),
+        ("render.skipped_edits", len(getattr(bot, "skipped_edits", ())), getattr(bot, "skipped_edits", None)),
+        ("render.answered", len(getattr(bot, "answered_queries", ())), getattr(bot, "answered_queries", None)),
+        ("ACTION_STATE", len(ACTION_STATE.entries or {}), ACTION_STATE.entries),
+        ("SEGMENTS", len(SEGMENTS.keys), SEGMENTS),
+        ("PHASH_INDEX", len(PHASH_INDEX.entries or ()), PHASH_INDEX),
+        ("DEAD_CHATS", len(DEAD_CHATS.chats or {}), DEAD_CHATS.chats),
+        ("OUTBOX", len(OUTBOX.pending), OUTBOX.pending),
+        ("update_tails", len(UPDATE_PROCESSOR.tails), UPDATE_PROCESSOR.tails),
+        ("METRICS", len(METRICS.series), METRICS)
+    ]
+
+def process_memory():
+    """(RSS الحالي، الذروة) بالبايت وعدد الملفات المفتوحة، None إذا لم تكن متاحة"""
+    rss = None
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = None
+    if resource:
+        # ru_maxrss بالكيلوبايت على Linux وبالبايت على macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+    try:
+        open_files = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        open_files = None
+    return rss, peak, open_files
+
+def build_memory_report(caches):
+    """يعمل في خيط منفصل لأن مقارنة tracemalloc قد تستغرق ثوانٍ
+
+    caches: [(الاسم، العدد، الحجم بالبايت)] محسوبة مسبقاً على حلقة الأحداث
+    """
+    # اللقطة أولاً حتى لا تظهر حجوزات التقرير نفسه في المقارنة
+    snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() and MEMORY_BASELINE["snapshot"] else None
+    census = object_census()
+    rss, peak, open_files = process_memory()
+    mb = lambda value: f"{value / 1024 / 1024:.1f} MB" if value is not None else "?"
+    lines = [
+        "🧠 <b>الذاكرة</b>",
+        f"RSS: {mb(rss)} | الذروة: {mb(peak)} | ملفات مفتوحة: {open_files if open_files is not None else '?'}",
+        f"كائنات gc: {sum(census.values())}"
+    ]
+
+    rows = [f"{name:<22}{count:>8}{size / 1024:>10.1f} KB" for name, count, size in caches]
+    lines.append("\n<b>📦 ذاكرات البوت</b>\n<pre>" + html.escape("\n".join(rows)) + "</pre>")
+
+    baseline = MEMORY_BASELINE["census"] or Counter()
+    rows = [f"{name[:26]:<26}{count:>9}{count - baseline.get(name, 0):>+9}" for name, count in census.most_common(MEMORY_TOP)]
+    lines.append("\n<b>🔢 الكائنات حسب النوع</b> (التغير منذ خط الأساس)\n<pre>" + html.escape("\n".join(rows)) + "</pre>")
+
+    if snapshot:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ))
+        rows = []
+        for stat in snapshot.compare_to(MEMORY_BASELINE["snapshot"], "lineno")[:MEMORY_TOP]:
+            frame = stat.traceback[0]
+            rows.append(f"{stat.size_diff / 1024:>+9.1f} KB {stat.count_diff:>+8}  {Path(frame.filename).name}:{frame.lineno}")
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        minutes = int((time.time() - MEMORY_BASELINE["time"]) // 60)
+        lines.append(
+            f"\n<b>📍 أكثر مواضع الحجز نمواً</b> (خلال {minutes} دقيقة، متتبع {mb(traced)}، الذروة {mb(traced_peak)})\n"
+            f"<pre>" + html.escape("\n".join(rows) or "-") + "</pre>"
+        )
+    else:
+        lines.append("\nℹ️ tracemalloc متوقف. استخدم /memory start لبدء تتبع مواضع الحجز.")
+    return "\n".join(lines)
+
+def take_memory_baseline():
+    MEMORY_BASELINE["census"] = object_census()
+    MEMORY_BASELINE["snapshot"] = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    MEMORY_BASELINE["time"] = time.time()
+
+async def show_memory(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/memory [start|stop] للأدمن"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    action = context.args[0].lower() if context.args else ""
+
+    if action == "start":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+        await asyncio.to_thread(take_memory_baseline)
+        await update.message.reply_text("🧠 تم بدء tracemalloc وحفظ خط الأساس. أرسل /memory لاحقاً للمقارنة.")
+        return
+    if action == "stop":
+        tracemalloc.stop()
+        MEMORY_BASELINE.update(snapshot=None, census=None, time=None)
+        await update.message.reply_text("🧠 تم إيقاف tracemalloc وحذف خط الأساس.")
+        return
+
+    if MEMORY_BASELINE["census"] is None:
+        await asyncio.to_thread(take_memory_baseline)
+    caches = [(name, count, await deep_sizeof(obj)) for name, count, obj in bot_caches(context.application)]
+    report = await asyncio.to_thread(build_memory_report, caches)
+    if len(report) > 4000:
+        plain = html.unescape(re.sub(r"</?(b|pre)>", "", report))
+        await update.message.reply_document(
+            document=plain.encode(),
+            filename=f"memory-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+            caption="🧠 تقرير الذاكرة"
+        )
+    else:
+        await update.message.reply_text(report, parse_mode=ParseMode.HTML)
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .bot(RenderCacheBot(
+            TOKEN,
+            base_url=f"{BOT_API_URL}/bot",
+            base_file_url=f"{BOT_API_URL}/file/bot",
+            request=build_request(INTERACTIVE_POOL_SIZE, INTERACTIVE_TIMEOUT),
+            get_updates_request=build_request(1, UPDATES_TIMEOUT)
+        ))
+        .concurrent_updates(UPDATE_PROCESSOR)
+        .update_queue(UpdateQueue(UPDATE_PROCESSOR, UPDATE_QUEUE_SIZE))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # معالج المحادثات للتسجيل
     auth_handler = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
-            CallbackQueryHandler(handle_start_buttons, pattern="^(new_register|login|data_storage_info)$")
+            CallbackRouter(dict.fromkeys(("new_register", "login", "data_storage_info"), handle_start_buttons))
         ],
         states={
             REG_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_name)],
@@ -2558,13 +5278,13 @@ def main():
 
     # معالج الودائع
     dep_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_deposit, pattern="deposit")],
+        entry_points=[CallbackRouter({"deposit": start_deposit})],
         states={
-            DEP_CURR: [CallbackQueryHandler(dep_curr)],
+            DEP_CURR: [CallbackRouter(dict.fromkeys(("EGP", "USDT", "back_to_main"), dep_curr))],
             DEP_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, dep_name)],
             DEP_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, dep_phone)],
             DEP_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, dep_amount)],
-            DEP_METHOD: [CallbackQueryHandler(dep_method)],
+            DEP_METHOD: [CallbackRouter(dict.fromkeys(("wallet", "instapay_soon", "bank_soon"), dep_method))],
             DEP_SCREENSHOT: [MessageHandler(filters.PHOTO, dep_screenshot)]
         },
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
@@ -2573,7 +5293,7 @@ def main():
 
     # معالج سحب الأصول
     assets_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_assets_withdrawal, pattern="assets_withdrawal")],
+        entry_points=[CallbackRouter({"assets_withdrawal": start_assets_withdrawal})],
         states={
             DEP_SCREENSHOT: [MessageHandler(filters.PHOTO, dep_screenshot)]
         },
@@ -2583,10 +5303,10 @@ def main():
 
     # معالج السحب
     wdr_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_withdraw, pattern="withdraw")],
+        entry_points=[CallbackRouter({"withdraw": start_withdraw})],
         states={
-            WDR_CURR: [CallbackQueryHandler(wdr_curr)],
-            WDR_METHOD: [CallbackQueryHandler(wdr_method)],
+            WDR_CURR: [CallbackRouter(dict.fromkeys(("EGP", "USDT", "back_to_main"), wdr_curr))],
+            WDR_METHOD: [CallbackRouter(dict.fromkeys(("wallet", "instapay_soon", "bank_soon"), wdr_method))],
             WDR_AMT: [MessageHandler(filters.TEXT & ~filters.COMMAND, wdr_amt)]
         },
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
@@ -2595,9 +5315,9 @@ def main():
 
     # معالج التحويلات المحسن
     transfer_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_transfer, pattern="transfer")],
+        entry_points=[CallbackRouter({"transfer": start_transfer})],
         states={
-            TRANSFER_TYPE: [CallbackQueryHandler(transfer_type)],
+            TRANSFER_TYPE: [CallbackRouter(dict.fromkeys(("convert", "user_transfer", "back_to_main"), transfer_type))],
             TRANSFER_USER_TARGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, transfer_user_target)],
             TRANSFER_USER_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, transfer_user_amount)]
         },
@@ -2607,9 +5327,9 @@ def main():
 
     # معالج الاستثمار
     invest_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_invest, pattern="invest")],
+        entry_points=[CallbackRouter({"invest": start_invest})],
         states={
-            PLAN_CHOOSE: [CallbackQueryHandler(plan_chosen)],
+            PLAN_CHOOSE: [CallbackRouter(dict.fromkeys((*PLANS, "back_to_main"), plan_chosen))],
             PLAN_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, plan_amount)]
         },
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
@@ -2618,41 +5338,46 @@ def main():
 
     # معالج لوحة الأدمن المحسن
     admin_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(admin_panel, pattern="admin_panel")],
+        entry_points=[CallbackRouter({"admin_panel": admin_panel})],
         states={
-            ADMIN_MAIN: [
-                CallbackQueryHandler(admin_send_money, pattern="admin_send_money"),
-                CallbackQueryHandler(admin_special_deposit, pattern="admin_special_deposit"),
-                CallbackQueryHandler(admin_ban, pattern="admin_ban"),
-                CallbackQueryHandler(admin_edit, pattern="admin_edit"),
-                CallbackQueryHandler(admin_search, pattern="admin_search"),
-                CallbackQueryHandler(admin_stats, pattern="admin_stats"),
-                CallbackQueryHandler(admin_requests, pattern="admin_requests"),
-                CallbackQueryHandler(admin_premium, pattern="admin_premium"),
-                CallbackQueryHandler(admin_broadcast, pattern="admin_broadcast")
-            ],
-            ADMIN_PREMIUM: [CallbackQueryHandler(admin_premium_action, pattern="^(grant_premium|revoke_premium|admin_panel)$")],
+            ADMIN_MAIN: [CallbackRouter({
+                "admin_send_money": admin_send_money,
+                "admin_special_deposit": admin_special_deposit,
+                "admin_ban": admin_ban,
+                "admin_edit": admin_edit,
+                "admin_search": admin_search,
+                "admin_stats": admin_stats,
+                "admin_requests": admin_requests,
+                "admin_premium": admin_premium,
+                "admin_broadcast": admin_broadcast
+            })],
+            ADMIN_PREMIUM: [CallbackRouter(dict.fromkeys(("grant_premium", "revoke_premium", "admin_panel"), admin_premium_action))],
             ADMIN_PREMIUM_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_premium_user)],
+            ADMIN_BROADCAST_SEGMENT: [CallbackRouter(dict.fromkeys(("bcast_seg", "admin_panel"), admin_broadcast_segment))],
+            ADMIN_BROADCAST_PARAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_param)],
             ADMIN_BROADCAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_send)],
             ADMIN_SEARCH_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_search_input)],
             ADMIN_EDIT_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_edit_user)],
-            ADMIN_EDIT_FIELD: [CallbackQueryHandler(admin_edit_field, pattern="^edit_(EGP|USDT)$")],
+            ADMIN_EDIT_FIELD: [CallbackRouter(dict.fromkeys(("edit_EGP", "edit_USDT"), admin_edit_field))],
             ADMIN_EDIT_BALANCE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_edit_balance)],
             ADMIN_BAN_USER: [
-                CallbackQueryHandler(ban_user_start, pattern="^(ban_user|unban_user|admin_panel)$"),
+                CallbackRouter(dict.fromkeys(("ban_user", "unban_user", "admin_panel"), ban_user_start)),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ban_user)
             ],
-            ADMIN_BAN_REASON: [CallbackQueryHandler(admin_ban_reason, pattern="^(fraud|contract_pending|custom_reason)$")],
+            ADMIN_BAN_REASON: [CallbackRouter(dict.fromkeys(("fraud", "contract_pending", "custom_reason"), admin_ban_reason))],
             ADMIN_CUSTOM_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_custom_ban_reason)],
             ADMIN_SEND_MONEY_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_send_money_user)],
             ADMIN_SEND_MONEY_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_send_money_amount)],
-            ADMIN_SEND_MONEY_TYPE: [CallbackQueryHandler(admin_send_money_type, pattern="^(reward|compensation|gift|deposit_transfer|assets_withdrawal_transfer)$")],
-            ADMIN_SEND_MONEY_CONFIRM: [CallbackQueryHandler(admin_send_money_confirm, pattern="^(confirm_send|admin_panel)$")]
+            ADMIN_SEND_MONEY_TYPE: [CallbackRouter(dict.fromkeys(("reward", "compensation", "gift", "deposit_transfer", "assets_withdrawal_transfer"), admin_send_money_type))],
+            ADMIN_SEND_MONEY_CONFIRM: [CallbackRouter(dict.fromkeys(("confirm_send", "admin_panel"), admin_send_money_confirm))]
         },
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
         per_message=False
     )
 
+    # إزالة المستخدم من سجل المحادثات المغلقة عند تفاعله
+    app.add_handler(TypeHandler(Update, revive_dead_chat), group=-1)
+
     # إضافة المعالجات
     app.add_handler(auth_handler)
     app.add_handler(dep_handler)
@@ -2662,18 +5387,41 @@ def main():
     app.add_handler(invest_handler)
     app.add_handler(admin_handler)
 
-    # معالجات الأزرار
-    app.add_handler(CallbackQueryHandler(handle_main_buttons, pattern="^(profile|balance|work_sites|back_to_main|back_to_start|invest|deposit|withdraw|transfer|invite_friends|terms|social_media|premium_info|admin_panel)$"))
-    app.add_handler(CallbackQueryHandler(show_how_to_work, pattern="how_to_work"))
-    app.add_handler(CallbackQueryHandler(accept_terms, pattern="accept_terms"))
-    app.add_handler(CallbackQueryHandler(show_referral_earnings, pattern="referral_earnings"))
-    app.add_handler(CallbackQueryHandler(instagram_soon, pattern="instagram_soon"))
-    
-    # معالجات موافقة/رفض الطلبات
-    app.add_handler(CallbackQueryHandler(handle_admin_approval, pattern="^(approve|reject)_(deposit|withdrawal|assets)_"))
+    # الإجابة على الأزرار التي تم تخطي تعديلها المطابق (بعد انتهاء المعالج الأساسي)
+    app.add_handler(CallbackQueryHandler(answer_skipped_edit), group=1)
+
+    # معالجات الأزرار وموافقة/رفض الطلبات (جدول توجيه واحد)
+    app.add_handler(MAIN_ROUTER)
+
+    # قياسات الأداء للأدمن
+    app.add_handler(CommandHandler("metrics", show_metrics))
+    app.add_handler(CommandHandler("profile", start_profile))
+    app.add_handler(CommandHandler("memory", show_memory))
+    instrument_handlers(app)
+
+    # صيانة لقطات الشاشة الدورية
+    app.job_queue.run_repeating(
+        screenshot_maintenance,
+        interval=SCREENSHOT_MAINTENANCE_HOURS * 3600,
+        first=600
+    )
 
     print("🚀 Bot started successfully with all features!")
-    app.run_polling()
+    if WEBHOOK_URL:
+        run_webhook(app)
+    else:
+        app.run_polling()
+
+def run_webhook(app):
+    """تشغيل مستقبل الـ webhook المدمج مع التحقق من الرمز السري"""
+    print(f"🌐 Webhook: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET
+    )
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,218 @@
+"""خادم Bot API بديل لتشغيل البوت بدون إنترنت
+
+يرد على طرق Bot API التي يستخدمها البوت (getUpdates, sendMessage, editMessageText,
+sendPhoto, answerCallbackQuery, getFile ...) بردود ناجحة بسيطة، مع إمكانية إضافة
+تأخير وأخطاء عشوائية لمحاكاة ظروف تيليجرام الحقيقية.
+
+التشغيل:
+    python tools/fake_bot_api.py --port 8081 --latency-ms 50 --error-rate 0.01
+    BOT_API_URL=http://127.0.0.1:8081 python "main (5).py"
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Asser Platform", "username": "asser_test_bot"}
+
+# طرق لا يتم حقن أخطاء فيها حتى يبدأ البوت ويستمر في استلام التحديثات
+BOOTSTRAP_METHODS = {"getMe", "getUpdates", "setWebhook", "deleteWebhook", "close", "logOut"}
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class FakeBotApi:
+    """حالة الخادم البديل: طابور التحديثات، أرقام الرسائل، وعدد الاستدعاءات لكل طريقة"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, listener=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.listener = listener
+        self.lock = threading.Lock()
+        self.updates_ready = threading.Condition(self.lock)
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls = {}
+        self.errors = {}
+
+    def push_update(self, update):
+        """إضافة تحديث ليستلمه البوت في getUpdates، وإرجاع update_id"""
+        with self.updates_ready:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append({**update, "update_id": update_id})
+            self.updates_ready.notify_all()
+        return update_id
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self.updates_ready:
+            # التحديثات التي تم تأكيد استلامها (أقل من offset) لا تُرسل مرة أخرى
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.updates_ready.wait(remaining)
+            return self.updates[:limit]
+
+    def message(self, method, params):
+        with self.lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        if method.startswith("edit") and "message_id" in params:
+            message_id = int(params["message_id"])
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+        }
+        for field in ("text", "caption"):
+            if field in params:
+                result[field] = params[field]
+        if "reply_markup" in params:
+            markup = params["reply_markup"]
+            result["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        return result
+
+    def injected_error(self, method):
+        """رد خطأ عشوائي (429 أو 502) حسب error_rate"""
+        if method in BOOTSTRAP_METHODS or random.random() >= self.error_rate:
+            return None
+        with self.lock:
+            self.errors[method] = self.errors.get(method, 0) + 1
+        if random.random() < 0.5:
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                         "parameters": {"retry_after": 1}}
+        return 502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+
+    def handle(self, method, params):
+        """تنفيذ طريقة Bot API وإرجاع (كود HTTP، الرد)"""
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method != "getUpdates" and (self.latency or self.jitter):
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        error = self.injected_error(method)
+        if error:
+            return error
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = self.get_updates(params)
+        elif method in MESSAGE_METHODS:
+            result = self.message(method, params)
+        elif method == "getFile":
+            file_id = params.get("file_id", "file")
+            result = {"file_id": file_id, "file_unique_id": file_id[-16:], "file_size": 4096,
+                      "file_path": f"photos/{file_id}.jpg"}
+        else:
+            result = True
+
+        if self.listener:
+            self.listener(method, params, result)
+        return 200, {"ok": True, "result": result}
+
+    @staticmethod
+    def file_content(name):
+        """صورة JPEG مختلفة لكل ملف (ضوضاء ثابتة حسب الاسم) أو بايتات عشوائية بدون Pillow"""
+        rng = random.Random(name)
+        if Image is None:
+            return bytes(rng.getrandbits(8) for _ in range(4096))
+        image = Image.new("L", (64, 64))
+        image.putdata([rng.randrange(256) for _ in range(64 * 64)])
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+
+def make_handler(api, verbose):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # الرأس والمحتوى يُرسلان منفصلين، فبدون هذا يضيف Nagle + delayed ACK ~40ms لكل طلب
+        disable_nagle_algorithm = True
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if "/file/bot" in self.path:
+                self.send_body(200, api.file_content(self.path.rsplit("/", 1)[-1]), "image/jpeg")
+            else:
+                self.do_POST()
+
+        def do_POST(self):
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            content_type = self.headers.get("Content-Type", "")
+            if "json" in content_type:
+                params = json.loads(body or b"{}")
+            elif "form-urlencoded" in content_type:
+                params = dict(parse_qsl(body.decode()))
+            else:
+                params = {}
+
+            status, payload = api.handle(method, params)
+            self.send_body(status, json.dumps(payload).encode(), "application/json")
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def serve(host, port, verbose=True, **options):
+    """تشغيل الخادم في الخلفية وإرجاع (server, api)"""
+    api = FakeBotApi(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(api, verbose))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="تأخير كل طلب")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="تغير عشوائي في التأخير (±)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="نسبة الطلبات التي ترد بخطأ 429/502")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    server, api = serve(
+        args.host, args.port, verbose=not args.quiet,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate
+    )
+    print(f"Fake Bot API on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps({"calls": api.calls, "errors": api.errors}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
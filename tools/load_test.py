@@ -0,0 +1,325 @@
+"""اختبار تحميل البوت محلياً بمستخدمين افتراضيين ضد خادم Bot API البديل
+
+يشغل البوت كعملية منفصلة (long polling) موجهة إلى tools/fake_bot_api.py، ثم يحاكي
+N مستخدمين بالتوازي يمرون بمراحل: التسجيل، الإيداع (مع موافقة الأدمن)، الاستثمار،
+التحويل، والسحب. زمن كل خطوة = من إضافة التحديث حتى أول رد مرئي من البوت لنفس المحادثة.
+
+التشغيل:
+    python tools/load_test.py --users 50 --latency-ms 30 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_bot_api import serve
+
+ROOT = Path(__file__).resolve().parent.parent
+BOT_FILE = ROOT / "main (5).py"
+FIRST_USER_ID = 100000
+DEFAULT_ADMIN_ID = 7952226615  # ADMIN_IDS[0] في البوت
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Inbox:
+    """الرسائل التي أرسلها البوت لكل محادثة (تُملأ من خيط الخادم البديل)"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queues = {}
+        self.last_message = {}
+        self.admin_messages = []
+        self.admin_changed = asyncio.Condition()
+
+    def queue(self, chat_id):
+        return self.queues.setdefault(chat_id, asyncio.Queue())
+
+    def listener(self, method, params, result):
+        if not isinstance(result, dict) or "chat" not in result:
+            return
+        self.loop.call_soon_threadsafe(self.deliver, method, params, result)
+
+    def deliver(self, method, params, result):
+        chat_id = result["chat"]["id"]
+        self.last_message[chat_id] = result["message_id"]
+        self.queue(chat_id).put_nowait((time.perf_counter(), method, params))
+        if chat_id == ADMIN_ID and method in ("sendPhoto", "sendMessage"):
+            self.admin_messages.append((result["message_id"], params))
+            self.loop.create_task(self.notify_admin())
+
+    async def notify_admin(self):
+        async with self.admin_changed:
+            self.admin_changed.notify_all()
+
+    def drain(self, chat_id):
+        queue = self.queue(chat_id)
+        while not queue.empty():
+            queue.get_nowait()
+
+
+class SyntheticUser:
+    """مستخدم افتراضي يرسل تحديثات وينتظر رد البوت على كل خطوة"""
+
+    def __init__(self, driver, uid):
+        self.driver = driver
+        self.uid = uid
+        self.next_message_id = 1
+        self.photo_count = 0
+
+    def base_message(self, chat_id=None):
+        self.next_message_id += 1
+        chat_id = chat_id or self.uid
+        return {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"user{self.uid}"},
+            "from": {"id": self.uid, "is_bot": False, "first_name": f"user{self.uid}"},
+        }
+
+    def text_update(self, text):
+        message = {**self.base_message(), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def photo_update(self):
+        self.photo_count += 1
+        file_id = f"photo-{self.uid}-{self.photo_count}"
+        photo = {"file_id": file_id, "file_unique_id": file_id, "width": 64, "height": 64, "file_size": 4096}
+        return {"message": {**self.base_message(), "photo": [photo]}}
+
+    def callback_update(self, data, chat_id=None, message_id=None):
+        chat_id = chat_id or self.uid
+        message_id = message_id or self.driver.inbox.last_message.get(chat_id, 1)
+        return {"callback_query": {
+            "id": f"cb-{self.uid}-{time.perf_counter_ns()}",
+            "chat_instance": f"ci-{chat_id}",
+            "from": {"id": self.uid, "is_bot": False, "first_name": f"user{self.uid}"},
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bot"},
+                "text": "menu",
+            },
+        }}
+
+    async def step(self, flow, update, expect=1, wait_chat=None):
+        """إرسال تحديث وانتظار expect رسائل من البوت، وتسجيل زمن أول رد"""
+        wait_chat = wait_chat or self.uid
+        inbox = self.driver.inbox
+        inbox.drain(wait_chat)
+        started = time.perf_counter()
+        self.driver.api.push_update(update)
+        self.driver.sent += 1
+        try:
+            for index in range(expect):
+                received, _, _ = await asyncio.wait_for(inbox.queue(wait_chat).get(), self.driver.step_timeout)
+                if index == 0:
+                    self.driver.record(flow, received - started)
+        except asyncio.TimeoutError:
+            self.driver.timeouts[flow] = self.driver.timeouts.get(flow, 0) + 1
+            return False
+        return True
+
+    async def register(self):
+        ok = await self.step("registration", self.text_update("/start"))
+        ok = ok and await self.step("registration", self.callback_update("new_register"))
+        ok = ok and await self.step("registration", self.text_update(f"Load User {self.uid}"))
+        ok = ok and await self.step("registration", self.text_update(f"user{self.uid}@example.com"))
+        ok = ok and await self.step("registration", self.text_update("secret-pass"))
+        return ok and await self.step("registration", self.text_update(f"+20{self.uid:010d}"), expect=2)
+
+    async def deposit(self):
+        ok = await self.step("deposit", self.callback_update("deposit"))
+        ok = ok and await self.step("deposit", self.callback_update("EGP"))
+        ok = ok and await self.step("deposit", self.text_update(f"Load User {self.uid}"))
+        ok = ok and await self.step("deposit", self.text_update(f"+20{self.uid:010d}"))
+        ok = ok and await self.step("deposit", self.text_update("1000"))
+        ok = ok and await self.step("deposit", self.callback_update("wallet"))
+        ok = ok and await self.step("deposit", self.photo_update())
+        if not ok:
+            return False
+
+        # الأدمن يوافق على الطلب من رسالة الصورة التي وصلته، والزمن حتى وصول إشعار القبول للمستخدم
+        button = await self.driver.admin_button(self.uid, "approve_deposit")
+        if button is None:
+            self.driver.timeouts["deposit_approval"] = self.driver.timeouts.get("deposit_approval", 0) + 1
+            return False
+        data, message_id = button
+        admin = SyntheticUser(self.driver, ADMIN_ID)
+        return await admin.step("deposit_approval", admin.callback_update(data, ADMIN_ID, message_id), wait_chat=self.uid)
+
+    async def invest(self):
+        ok = await self.step("investment", self.callback_update("invest"))
+        ok = ok and await self.step("investment", self.callback_update("daily"))
+        return ok and await self.step("investment", self.text_update("200"))
+
+    async def transfer(self, target_uid):
+        ok = await self.step("transfer", self.callback_update("transfer"))
+        ok = ok and await self.step("transfer", self.callback_update("user_transfer"))
+        ok = ok and await self.step("transfer", self.text_update(str(target_uid)))
+        return ok and await self.step("transfer", self.text_update("50"))
+
+    async def withdraw(self):
+        ok = await self.step("withdrawal", self.callback_update("withdraw"))
+        ok = ok and await self.step("withdrawal", self.callback_update("EGP"))
+        ok = ok and await self.step("withdrawal", self.callback_update("wallet"))
+        return ok and await self.step("withdrawal", self.text_update("100"))
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.step_timeout = args.step_timeout
+        self.latencies = {}
+        self.timeouts = {}
+        self.sent = 0
+        self.inbox = None
+        self.api = None
+
+    def record(self, flow, seconds):
+        self.latencies.setdefault(flow, []).append(seconds)
+
+    async def admin_button(self, uid, action):
+        """إيجاد زر الأدمن الخاص بطلب المستخدم من رسائل الأدمن المستلمة"""
+        marker = f"UID: {uid}"
+
+        def find():
+            for message_id, params in reversed(self.inbox.admin_messages):
+                if marker in params.get("caption", params.get("text", "")) and "reply_markup" in params:
+                    for row in json.loads(params["reply_markup"])["inline_keyboard"]:
+                        for button in row:
+                            if button.get("callback_data", "").startswith(action):
+                                return button["callback_data"], message_id
+            return None
+
+        async with self.inbox.admin_changed:
+            try:
+                await asyncio.wait_for(self.inbox.admin_changed.wait_for(lambda: find() is not None), self.step_timeout)
+            except asyncio.TimeoutError:
+                return None
+        return find()
+
+    async def user_session(self, user, users):
+        # التحويل يحتاج أن يكون المستلم مسجلاً، لذا تبدأ باقي المراحل بعد تسجيل الجميع
+        registered = await user.register()
+        self.registered_count += 1
+        if self.registered_count == len(users):
+            self.registered.set()
+        if not registered:
+            return
+        await self.registered.wait()
+        await user.deposit()
+        await user.invest()
+        if len(users) > 1:
+            target = users[(users.index(user) + 1) % len(users)]
+            await user.transfer(target.uid)
+        await user.withdraw()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.inbox = Inbox(loop)
+        server, self.api = serve(
+            "127.0.0.1", self.args.port, verbose=False,
+            latency=self.args.latency_ms / 1000, jitter=self.args.jitter_ms / 1000,
+            error_rate=self.args.error_rate, listener=self.inbox.listener
+        )
+
+        data_dir = tempfile.mkdtemp(prefix="asser-load-")
+        env = {
+            **os.environ,
+            "BOT_TOKEN": "123456:LOADTEST",
+            "DATA_DIR": data_dir,
+            "BOT_API_URL": f"http://127.0.0.1:{self.args.port}",
+        }
+        env.pop("WEBHOOK_URL", None)
+        log = open(Path(data_dir) / "bot.out", "w")
+        bot = subprocess.Popen([sys.executable, str(BOT_FILE)], cwd=data_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            # انتظار أول getUpdates (البوت جاهز)
+            while self.api.calls.get("getUpdates", 0) == 0:
+                if bot.poll() is not None:
+                    raise RuntimeError(f"توقف البوت قبل البدء، راجع {data_dir}/bot.out")
+                await asyncio.sleep(0.1)
+
+            users = [SyntheticUser(self, FIRST_USER_ID + i) for i in range(self.args.users)]
+            self.registered = asyncio.Event()
+            self.registered_count = 0
+            started = time.perf_counter()
+            await asyncio.gather(*(self.user_session(user, users) for user in users))
+            elapsed = time.perf_counter() - started
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            log.close()
+            server.shutdown()
+
+        self.report(elapsed, data_dir)
+
+    def report(self, elapsed, data_dir):
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        result = {
+            "users": self.args.users,
+            "updates_sent": self.sent,
+            "elapsed_s": round(elapsed, 3),
+            "updates_per_s": round(self.sent / elapsed, 1) if elapsed else 0,
+            "timeouts": self.timeouts,
+            "api_calls": self.api.calls,
+            "injected_errors": self.api.errors,
+            "flows": {},
+        }
+        print(f"{'flow':<18}{'steps':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for flow, values in list(self.latencies.items()) + [("all", all_latencies)]:
+            stats = {
+                "steps": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            }
+            result["flows"][flow] = stats
+            print(f"{flow:<18}{stats['steps']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        print(f"\nupdates: {self.sent} in {elapsed:.2f}s = {result['updates_per_s']} updates/s")
+        if self.timeouts:
+            print(f"timeouts: {self.timeouts}")
+        print(f"bot data and log: {data_dir}")
+        if self.args.json:
+            Path(self.args.json).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+def main():
+    global ADMIN_ID
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="عدد المستخدمين الافتراضيين")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--step-timeout", type=float, default=15.0)
+    parser.add_argument("--admin-id", type=int, default=DEFAULT_ADMIN_ID)
+    parser.add_argument("--json", help="حفظ النتائج في ملف JSON")
+    args = parser.parse_args()
+    ADMIN_ID = args.admin_id
+    asyncio.run(LoadTest(args).run())
+
+
+ADMIN_ID = DEFAULT_ADMIN_ID
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""إرسال تحديثات مسجلة إلى مستقبل الـ webhook الخاص بالبوت
+
+كل سطر في الملف تحديث بصيغة JSON كما يرسله تيليجرام. يتم تغيير update_id
+تلقائياً حتى يمكن إعادة إرسال نفس الملف أكثر من مرة.
+
+التشغيل:
+    python tools/post_updates.py tools/sample_updates.jsonl \\
+        --url http://127.0.0.1:8443/telegram --secret test
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import httpx
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path):
+    """قراءة التحديثات من ملف JSONL"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_updates(updates, url, secret=None, repeat=1, delay=0.0):
+    """إرسال التحديثات بالترتيب وإرجاع (أكواد الرد، زمن كل طلب)"""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses = {}
+    latencies = []
+    update_id = int(time.time())
+    with httpx.Client(timeout=10) as client:
+        for _ in range(repeat):
+            for update in updates:
+                update_id += 1
+                started = time.perf_counter()
+                response = client.post(url, json={**update, "update_id": update_id}, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if delay:
+                    time.sleep(delay)
+    return statuses, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", type=Path, help="ملف JSONL بالتحديثات المسجلة")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--delay", type=float, default=0.0, help="ثوانٍ بين كل تحديث")
+    args = parser.parse_args()
+
+    statuses, latencies = post_updates(load_updates(args.updates), args.url, args.secret, args.repeat, args.delay)
+    latencies.sort()
+    print(f"sent: {len(latencies)}  statuses: {statuses}")
+    if latencies:
+        print(f"median: {latencies[len(latencies) // 2] * 1000:.2f} ms  max: {latencies[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
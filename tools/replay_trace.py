@@ -0,0 +1,262 @@
+"""إعادة تشغيل تسجيل تحديثات حقيقي (UPDATE_TRACE) ضد نسخة من مجلد البيانات
+
+يشغل البوت كعملية منفصلة موجهة إلى tools/fake_bot_api.py مع نسخة مؤقتة من مجلد البيانات
+(يُفضل نسخة أُخذت عند بدء التسجيل)، ثم يرسل التحديثات بنفس ترتيبها المسجل. تحديث المحادثة
+لا يُرسل قبل رد البوت على تحديثها السابق (كما ينتظر المستخدم الحقيقي)، والتوقيت يتبع
+التسجيل مقسوماً على --speed (0 = أسرع ما يمكن).
+
+النتيجة: زمن أول رد لكل نوع تحديث، التحديثات بدون رد، وعدد مرات وحجم الكتابة لكل ملف
+بيانات (من حقل save_data في لوج البوت عند الإيقاف) لمقارنتها بين الإصدارات.
+
+التشغيل:
+    python tools/replay_trace.py data/traces/2026-10-18-093000-4242.jsonl.gz --data-dir backup/data --speed 60
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_bot_api import serve
+from load_test import BOT_FILE, percentile
+
+
+def load_trace(path):
+    """قراءة سطور التسجيل (مضغوط أو لا)"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def update_kind(update):
+    if "callback_query" in update:
+        return "callback"
+    message = update.get("message") or update.get("edited_message") or {}
+    if "photo" in message:
+        return "photo"
+    if message.get("text", "").startswith("/"):
+        return "command"
+    return "message" if message else "other"
+
+
+def update_chat(update):
+    if "callback_query" in update:
+        query = update["callback_query"]
+        return (query.get("message") or {}).get("chat", {}).get("id", query["from"]["id"])
+    for field in ("message", "edited_message", "channel_post"):
+        if field in update:
+            return update[field]["chat"]["id"]
+    return None
+
+
+class Replay:
+    def __init__(self, args):
+        self.args = args
+        self.loop = None
+        self.api = None
+        self.data_dir = None
+        self.replies = {}
+        self.callbacks = {}
+        self.latencies = {}
+        self.no_reply = {}
+        self.unmatched_actions = 0
+        self.used_keys = set()
+
+    def listener(self, method, params, result):
+        if method == "answerCallbackQuery":
+            chat_id = self.callbacks.pop(params.get("callback_query_id"), None)
+        elif isinstance(result, dict) and "chat" in result:
+            chat_id = result["chat"]["id"]
+        else:
+            return
+        if chat_id is not None:
+            self.loop.call_soon_threadsafe(self.queue(chat_id).put_nowait, time.perf_counter())
+
+    def queue(self, chat_id):
+        return self.replies.setdefault(chat_id, asyncio.Queue())
+
+    def find_action_key(self, payload):
+        """المفتاح الذي أنشأه البوت لنفس بيانات الطلب في نسخة البيانات"""
+        try:
+            entries = json.loads((self.data_dir / "data" / "callback_state.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        for key, entry in entries.items():
+            if entry["payload"] == payload and key not in self.used_keys:
+                return key
+        return None
+
+    async def resolve_action(self, update, payload):
+        """استبدال مفتاح زر الموافقة المسجل بالمفتاح الجديد (بعد أن يُنشئ البوت الطلب)"""
+        deadline = time.perf_counter() + self.args.step_timeout
+        key = self.find_action_key(payload)
+        while key is None and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+            key = self.find_action_key(payload)
+        if key is None:
+            self.unmatched_actions += 1
+            return
+        self.used_keys.add(key)
+        query = update["callback_query"]
+        query["data"] = f"{query['data'].split(':', 1)[0]}:{key}"
+
+    async def wait_reply(self, queue, kind, started):
+        try:
+            replied = await asyncio.wait_for(queue.get(), self.args.step_timeout)
+            self.latencies.setdefault(kind, []).append(replied - started)
+        except asyncio.TimeoutError:
+            self.no_reply[kind] = self.no_reply.get(kind, 0) + 1
+
+    async def replay(self, trace):
+        """الإرسال بترتيب التسجيل؛ تحديث المحادثة ينتظر رد البوت على تحديثها السابق فقط"""
+        started = time.perf_counter()
+        waiting = {}
+        for record in trace:
+            if self.args.speed > 0:
+                delay = started + record["t"] / self.args.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = record["update"]
+            update.pop("update_id", None)
+            chat_id = update_chat(update)
+            if chat_id in waiting:
+                await waiting.pop(chat_id)
+            if "action_state" in record:
+                await self.resolve_action(update, record["action_state"])
+            if chat_id is None:
+                self.api.push_update(update)
+                continue
+
+            queue = self.queue(chat_id)
+            while not queue.empty():
+                queue.get_nowait()
+            if "callback_query" in update:
+                self.callbacks[update["callback_query"]["id"]] = chat_id
+            pushed = time.perf_counter()
+            self.api.push_update(update)
+            waiting[chat_id] = asyncio.create_task(self.wait_reply(queue, update_kind(update), pushed))
+        await asyncio.gather(*waiting.values())
+        return time.perf_counter() - started
+
+    async def run(self, trace):
+        self.loop = asyncio.get_running_loop()
+        server, self.api = serve("127.0.0.1", self.args.port, verbose=False,
+                                 latency=self.args.latency_ms / 1000, listener=self.listener)
+
+        self.data_dir = Path(tempfile.mkdtemp(prefix="asser-replay-"))
+        if self.args.data_dir:
+            shutil.copytree(self.args.data_dir, self.data_dir / "data")
+        else:
+            (self.data_dir / "data").mkdir()
+        before = self.file_sizes()
+        env = {
+            **os.environ,
+            "BOT_TOKEN": "123456:REPLAY",
+            "DATA_DIR": str(self.data_dir / "data"),
+            "BOT_API_URL": f"http://127.0.0.1:{self.args.port}",
+        }
+        for name in ("WEBHOOK_URL", "UPDATE_TRACE"):
+            env.pop(name, None)
+        log = open(self.data_dir / "bot.out", "w")
+        bot = subprocess.Popen([sys.executable, str(BOT_FILE)], cwd=self.data_dir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+        try:
+            while self.api.calls.get("getUpdates", 0) == 0:
+                if bot.poll() is not None:
+                    raise RuntimeError(f"توقف البوت قبل البدء، راجع {self.data_dir}/bot.out")
+                await asyncio.sleep(0.1)
+
+            elapsed = await self.replay(trace)
+            # مهلة قصيرة لانتهاء الكتابات المتأخرة (مثل الإشعارات بعد الموافقة)
+            await asyncio.sleep(self.args.settle)
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            log.close()
+            server.shutdown()
+
+        return self.report(len(trace), elapsed, before)
+
+    def file_sizes(self):
+        return {path.name: path.stat().st_size for path in (self.data_dir / "data").glob("*.json")}
+
+    def storage_stats(self):
+        """حقل save_data في آخر سجل كتبه البوت عند الإيقاف (لوج JSON سطر لكل سجل)"""
+        stats = None
+        log_path = self.data_dir / "bot.log"
+        if log_path.exists():
+            for line in log_path.read_text(encoding="utf-8", errors="replace").splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "save_data" in record:
+                    stats = record["save_data"]
+        return stats
+
+    def report(self, total, elapsed, before):
+        after = self.file_sizes()
+        result = {
+            "updates": total,
+            "elapsed_s": round(elapsed, 3),
+            "no_reply": self.no_reply,
+            "unmatched_actions": self.unmatched_actions,
+            "api_calls": self.api.calls,
+            "save_data": self.storage_stats(),
+            "file_growth_bytes": {name: after[name] - before.get(name, 0) for name in after
+                                  if after[name] != before.get(name)},
+            "kinds": {},
+        }
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        print(f"{'kind':<12}{'updates':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for kind, values in list(self.latencies.items()) + [("all", all_latencies)]:
+            stats = {
+                "updates": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            }
+            result["kinds"][kind] = stats
+            print(f"{kind:<12}{stats['updates']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        print(f"\nreplayed {total} updates in {elapsed:.2f}s")
+        if self.no_reply:
+            print(f"no reply: {self.no_reply}")
+        if self.unmatched_actions:
+            print(f"approval buttons without a matching request: {self.unmatched_actions}")
+        if result["save_data"]:
+            saves = sum(stats["saves"] for stats in result["save_data"].values())
+            written = sum(stats["bytes"] for stats in result["save_data"].values())
+            print(f"save_data: {saves} writes, {written / 1024:.1f} KiB")
+        print(f"bot data and log: {self.data_dir}")
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", type=Path, help="ملف التسجيل (.jsonl.gz)")
+    parser.add_argument("--data-dir", type=Path, help="مجلد البيانات الذي تُنسخ منه حالة البداية")
+    parser.add_argument("--speed", type=float, default=0.0, help="تسريع التوقيت المسجل (0 = بدون انتظار)")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="تأخير خادم Bot API البديل")
+    parser.add_argument("--step-timeout", type=float, default=2.0, help="مهلة انتظار رد البوت على كل تحديث")
+    parser.add_argument("--settle", type=float, default=1.0, help="ثوانٍ بعد آخر تحديث قبل إيقاف البوت")
+    parser.add_argument("--json", help="حفظ النتائج في ملف JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(Replay(args).run(load_trace(args.trace)))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()